@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import List, Tuple
+
+from tools.asyncbot import AsyncBot
+from tools.ckcyberbot import Bot
+from tools.exceptions import TelegramApiError
+
+
+# Measure `Bot.send_message` against `tools.fakebot` at several concurrency levels, so that changes to the
+# bot's HTTP code can be compared offline. Run it from the repository's root: `python -m benchmarks.bot_bench`.
+# `--async` measures `AsyncBot.send_to_many` instead, sending to a different chat per message.
+
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16]
+# High enough that the async bot's rate limits don't cap the throughput, unless `--global-rate` asks for it.
+UNLIMITED_RATE = 1e6
+
+
+@dataclass
+class BenchResult:
+    concurrency: int
+    messages: int
+    errors: int
+    seconds: float
+    messages_per_second: float
+    p50_ms: float
+    p99_ms: float
+
+    def format(self) -> str:
+        return (
+            f'{self.concurrency:>11}  {self.messages_per_second:>8.1f}  {self.p50_ms:>8.2f}  {self.p99_ms:>8.2f}'
+            f'  {self.errors:>6}'
+        )
+
+
+def percentile(values: List[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def bench_send_message(url: str, concurrency: int, messages: int, text: str = 'benchmark') -> BenchResult:
+    """Send `messages` messages from `concurrency` threads that share one `Bot` and its connection pool."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = iter(range(messages))
+
+    with Bot('bench', '1', base_url=url, pool_size=concurrency) as bot:
+        # Open the connections before the clock starts.
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda _: bot.get_me(), range(concurrency)))
+
+        def worker():
+            nonlocal errors
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                start = time.perf_counter()
+                try:
+                    bot.send_message(text)
+                except (TelegramApiError, OSError):
+                    with lock:
+                        errors += 1
+                    continue
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        seconds = time.perf_counter() - start
+
+    return BenchResult(
+        concurrency=concurrency,
+        messages=messages,
+        errors=errors,
+        seconds=seconds,
+        messages_per_second=len(latencies) / seconds,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
+
+
+def bench_send_to_many(
+        url: str,
+        concurrency: int,
+        messages: int,
+        global_rate: float = UNLIMITED_RATE,
+        text: str = 'benchmark',
+) -> BenchResult:
+    """Send to `messages` chats at once with `AsyncBot.send_to_many` over `concurrency` connections."""
+    latencies: List[float] = []
+
+    async def run() -> Tuple[float, int]:
+        async with AsyncBot('bench', base_url=url, global_rate=global_rate, max_connections=concurrency) as bot:
+            # Open the connections before the clock starts.
+            await asyncio.gather(*(bot.get_me() for _ in range(concurrency)))
+            send_message = bot.send_message
+
+            async def timed_send_message(*args) -> dict:
+                start = time.perf_counter()
+                response = await send_message(*args)
+                latencies.append(time.perf_counter() - start)
+                return response
+
+            bot.send_message = timed_send_message
+            start = time.perf_counter()
+            results = await bot.send_to_many(text, [str(chat_id) for chat_id in range(1, messages + 1)])
+            seconds = time.perf_counter() - start
+        return seconds, sum(isinstance(result, Exception) for result in results.values())
+
+    seconds, errors = asyncio.run(run())
+    return BenchResult(
+        concurrency=concurrency,
+        messages=messages,
+        errors=errors,
+        seconds=seconds,
+        messages_per_second=len(latencies) / seconds,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
+
+
+def start_fake_api(latency: float, error_rate: float, rate_limit_rate: float) -> subprocess.Popen:
+    """Run the fake API in its own process, so that it doesn't compete with the bot for the GIL."""
+    return subprocess.Popen(
+        [
+            sys.executable, '-m', 'tools.fakebot',
+            '--latency', str(latency),
+            '--error-rate', str(error_rate),
+            '--rate-limit-rate', str(rate_limit_rate),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark Bot.send_message, or AsyncBot.send_to_many, against a local fake Bot API.')
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        nargs='+',
+        default=DEFAULT_CONCURRENCY,
+        help=f'the numbers of concurrent senders to measure. Default: {DEFAULT_CONCURRENCY}',
+    )
+    parser.add_argument('-n', '--messages', type=int, default=2000, help='messages per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated server latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of sends that fail with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of sends that get a 429')
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='benchmark AsyncBot.send_to_many to a different chat per message, with the concurrency as its'
+             ' number of connections',
+    )
+    parser.add_argument(
+        '--global-rate',
+        type=float,
+        default=UNLIMITED_RATE,
+        help='with --async, the global rate limit in messages per second. Default: practically unlimited',
+    )
+    parser.add_argument('--url', help='benchmark an already running API at this URL instead')
+    parser.add_argument('--json', metavar='FILE', help='also write the results to FILE as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    process = None
+    url = args.url
+    if not url:
+        process = start_fake_api(args.latency, args.error_rate, args.rate_limit_rate)
+        url = process.stdout.readline().strip()
+    try:
+        print('concurrency     msg/s   p50 ms   p99 ms  errors')
+        results = []
+        for concurrency in args.concurrency:
+            if args.use_async:
+                result = bench_send_to_many(url, concurrency, args.messages, args.global_rate)
+            else:
+                result = bench_send_message(url, concurrency, args.messages)
+            print(result.format(), flush=True)
+            results.append(result)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+from tools import utils
+from tools.cron import parse_cron
+from tools.prettypath import path_dirs
+from tools.runner import run_command
+from tools.schedcom import parse_delay
+from tools.scheduler import Job, JobQueue
+from tools.utils import get_state_dir
+
+
+# Time the hot paths of the tools and compare them with a baseline saved earlier on this machine: the run fails if
+# any of them got more than `--threshold` percent slower. Run it from the repository's root:
+# `python -m benchmarks.hotpath_bench --save-baseline` before a change, then without it to compare. Timings from
+# another machine mean nothing here, which is why the baseline lives in the state directory, not in the repository.
+
+BASELINE_PATH = os.path.join(get_state_dir(), 'hotpath_baseline.json')
+DEFAULT_THRESHOLD = 25.0
+
+ENV_LINES = 10_000
+PATH_ENTRIES = 5_000
+DELAYS = ['1d3h36m34s', '90s', '15m', '2h', '1d', 'invalid', '3h30m', '45s']
+QUEUE_JOBS = 1_000
+RUNNER_MIB = 256
+BOT_MESSAGES = 500
+
+MIB = 1024 * 1024
+
+
+@dataclass
+class Benchmark:
+    name: str
+    description: str
+    # Runs the benchmark once and returns how long the timed part took and how many units it processed.
+    run: Callable[[], Tuple[float, int]]
+    unit: str = 'op'
+
+
+def bench_env_file(cached: bool) -> Tuple[float, int]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, '.env')
+        with open(path, 'w') as file:
+            for i in range(ENV_LINES):
+                file.write(f'# setting {i}\nexport KEY_{i}="value {i} with \\"quotes\\""\n' if i % 3 else
+                           f'KEY_{i}=value_{i}\n')
+        utils.load_env_file(path)
+        loads = 1000 if cached else 20
+        start = time.perf_counter()
+        for _ in range(loads):
+            if not cached:
+                utils._env_cache.clear()
+            utils.load_env_file(path)
+        return time.perf_counter() - start, loads
+
+
+def bench_path_filter() -> Tuple[float, int]:
+    path = os.pathsep.join(
+        f'/opt/tool{i}/bin' if i % 2 else f'/mnt/c/Program Files/App {i}' for i in range(PATH_ENTRIES)
+    )
+    filters = 200
+    with patch.dict(os.environ, {'PATH': path}):
+        start = time.perf_counter()
+        for _ in range(filters):
+            path_dirs('tool', '/mnt/c/')
+        return time.perf_counter() - start, filters
+
+
+def bench_parse_delay() -> Tuple[float, int]:
+    rounds = 10_000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for delay in DELAYS:
+            parse_delay(delay)
+    return time.perf_counter() - start, rounds * len(DELAYS)
+
+
+def bench_cron_next() -> Tuple[float, int]:
+    schedule = parse_cron('*/15 9-17 * * mon-fri')
+    runs = 2_000
+    now = 1_700_000_000.0
+    start = time.perf_counter()
+    for _ in range(runs):
+        now = schedule.next_after(now)
+    return time.perf_counter() - start, runs
+
+
+def bench_job_queue() -> Tuple[float, int]:
+    """Push jobs to an in-memory queue, cancel every tenth and pop the rest once they're due."""
+    jobs = [Job(f'job {i}', 1_700_000_000.0 + (i * 7919) % QUEUE_JOBS) for i in range(QUEUE_JOBS)]
+    queue = JobQueue()
+    start = time.perf_counter()
+    for job in jobs:
+        queue.push(job)
+    for job in jobs[::10]:
+        queue.cancel(job.id)
+    due = queue.pop_due(1_700_000_000.0 + QUEUE_JOBS)
+    elapsed = time.perf_counter() - start
+    assert len(due) == QUEUE_JOBS - len(jobs[::10])
+    return elapsed, QUEUE_JOBS
+
+
+def bench_runner() -> Tuple[float, int]:
+    start = time.perf_counter()
+    result = run_command(f'head -c {RUNNER_MIB * MIB} /dev/zero', tee=False)
+    elapsed = time.perf_counter() - start
+    assert result.stdout.total == RUNNER_MIB * MIB
+    return elapsed, RUNNER_MIB
+
+
+def bench_bot() -> Tuple[float, int]:
+    """Send messages one at a time to the fake Bot API, which answers right away: what's left is the bot's own
+    overhead and the local round trip."""
+    from benchmarks.bot_bench import start_fake_api
+    from tools.ckcyberbot import Bot
+
+    process = start_fake_api(latency=0.0, error_rate=0.0, rate_limit_rate=0.0)
+    try:
+        url = process.stdout.readline().strip()
+        with Bot('bench', '1', base_url=url) as bot:
+            bot.get_me()
+            start = time.perf_counter()
+            for _ in range(BOT_MESSAGES):
+                bot.send_message('benchmark')
+            return time.perf_counter() - start, BOT_MESSAGES
+    finally:
+        process.terminate()
+        process.wait()
+
+
+BENCHMARKS = [
+    Benchmark('env_file', f'load_env_file() parsing a {ENV_LINES}-line .env file', lambda: bench_env_file(False)),
+    Benchmark('env_file_cached', 'load_env_file() of an unchanged, cached .env file', lambda: bench_env_file(True)),
+    Benchmark('path_filter', f'prettypath -s/-i over a PATH with {PATH_ENTRIES} entries', bench_path_filter),
+    Benchmark('parse_delay', 'schedcom parsing a delay like "1d3h36m34s"', bench_parse_delay),
+    Benchmark('cron_next', 'the next run of a cron schedule', bench_cron_next),
+    Benchmark('job_queue', 'pushing, cancelling and popping a job of the daemon\'s queue', bench_job_queue, 'job'),
+    Benchmark('runner', 'run_command() capturing the output of a command', bench_runner, 'MiB'),
+    Benchmark('bot_send', 'Bot.send_message() to a local fake Bot API', bench_bot, 'message'),
+]
+
+
+def measure(benchmark: Benchmark, repeat: int) -> float:
+    """Return the best time per unit of `repeat` runs: the slower ones only measure noise."""
+    return min(seconds / units for seconds, units in (benchmark.run() for _ in range(repeat)))
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('µs', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    try:
+        with open(path) as file:
+            return {name: entry['seconds'] for name, entry in json.load(file)['results'].items()}
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path: str, results: Dict[str, float]):
+    """Write the results to the baseline file, keeping the baselines of the benchmarks that didn't run."""
+    try:
+        with open(path) as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        baseline = {'results': {}}
+    baseline['python'] = platform.python_version()
+    baseline['machine'] = f'{platform.system()} {platform.machine()}'
+    units = {benchmark.name: benchmark.unit for benchmark in BENCHMARKS}
+    for name, seconds in results.items():
+        baseline['results'][name] = {'seconds': seconds, 'unit': units[name]}
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def change(seconds: float, baseline: Optional[float]) -> Optional[float]:
+    """How much slower than the baseline, in percent. Negative if it got faster."""
+    if not baseline:
+        return None
+    return (seconds / baseline - 1) * 100
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Time the hot paths of the tools and compare them with a baseline.')
+    parser.add_argument(
+        'names',
+        nargs='*',
+        metavar='NAME',
+        help=f'only run these benchmarks: {", ".join(benchmark.name for benchmark in BENCHMARKS)}',
+    )
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs per benchmark. Default: 5')
+    parser.add_argument(
+        '-t',
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f'fail if a benchmark got more than this many percent slower. Default: {DEFAULT_THRESHOLD:g}',
+    )
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='the baseline file. Default: %(default)s')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.names) - {benchmark.name for benchmark in BENCHMARKS}
+    if unknown:
+        parser.error(f'unknown benchmark(s): {", ".join(sorted(unknown))}')
+    benchmarks = [benchmark for benchmark in BENCHMARKS if not args.names or benchmark.name in args.names]
+    baseline = load_baseline(args.baseline)
+
+    results = {}
+    slower = []
+    print(f'{"benchmark":<16}  {"time":>18}  {"rate":>20}  {"baseline":>10}  {"change":>8}')
+    for benchmark in benchmarks:
+        seconds = measure(benchmark, args.repeat)
+        results[benchmark.name] = seconds
+        percent = change(seconds, baseline.get(benchmark.name))
+        flag = ''
+        if percent is not None and percent > args.threshold:
+            flag = '  SLOWER'
+            slower.append(benchmark.name)
+        print(
+            f'{benchmark.name:<16}  {format_time(seconds) + "/" + benchmark.unit:>18}'
+            f'  {f"{1 / seconds:,.0f} {benchmark.unit}/s":>20}'
+            f'  {format_time(baseline[benchmark.name]) if benchmark.name in baseline else "-":>10}'
+            f'  {f"{percent:+.1f}%" if percent is not None else "new":>8}{flag}',
+            flush=True,
+        )
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        save_baseline(args.baseline, results)
+        print(f'\nSaved the baseline to {args.baseline}.')
+        return 0
+    if not baseline:
+        print('\nNo baseline to compare with yet: save one with --save-baseline.')
+    if slower:
+        print(f'\n{len(slower)} benchmark(s) more than {args.threshold:g}% slower than the baseline:'
+              f' {", ".join(slower)}.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
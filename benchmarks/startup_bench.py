@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+
+# Measure how long the `ck` subcommands take to start, with `python -X importtime`, and fail if any of them
+# takes longer than its budget. Run it from the repository's root: `python -m benchmarks.startup_bench`.
+
+CK_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'ck.py')
+
+# Budgets for the total import time of each command, in milliseconds, including the interpreter's own
+# start-up imports (about 10 ms). They leave some headroom, but a regression that pulls e.g. `http.client`
+# into `ck sched` blows through them. Use `--scale` on slower machines.
+BUDGETS_MS = {
+    'ck --help': 20.0,
+    'ck path': 80.0,
+    'ck sched --help': 140.0,
+    'ck bot --help': 140.0,
+}
+
+
+def parse_importtime(stderr: str) -> Tuple[float, Set[str]]:
+    """Return the total import time in milliseconds and the names of the imported modules."""
+    total_us = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line.split('|')
+        total_us += int(self_us.split(':')[1])
+        modules.add(name.strip())
+    return total_us / 1000, modules
+
+
+def measure(args: List[str]) -> Tuple[float, float, Set[str]]:
+    """Start `ck` once and return its import time and wall time in milliseconds, and its modules."""
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', CK_PATH, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    import_ms, modules = parse_importtime(process.stderr)
+    return import_ms, wall_ms, modules
+
+
+def bench(runs: int = 5) -> Dict[str, Tuple[float, float]]:
+    """Return the median import and wall time of every command in `BUDGETS_MS`."""
+    results = {}
+    for command in BUDGETS_MS:
+        args = command.split()[1:]
+        # The first run compiles the byte code, which later runs don't have to.
+        measure(args)
+        samples = [measure(args) for _ in range(runs)]
+        results[command] = (
+            statistics.median(import_ms for import_ms, _, _ in samples),
+            statistics.median(wall_ms for _, wall_ms, _ in samples),
+        )
+    return results
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Check the startup time of the `ck` subcommands.')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='runs per command. Default: 5')
+    parser.add_argument(
+        '--scale',
+        type=float,
+        default=1.0,
+        help='multiply every budget by this factor, e.g. on a slow CI machine',
+    )
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    print(f'{"command":<16}  {"imports ms":>10}  {"wall ms":>8}  {"budget ms":>9}')
+    for command, (import_ms, wall_ms) in bench(args.runs).items():
+        budget_ms = BUDGETS_MS[command] * args.scale
+        flag = '' if import_ms <= budget_ms else '  OVER BUDGET'
+        print(f'{command:<16}  {import_ms:>10.1f}  {wall_ms:>8.1f}  {budget_ms:>9.1f}{flag}')
+        if flag:
+            over_budget.append(command)
+    if over_budget:
+        print(f'\n{len(over_budget)} command(s) over budget. See `python -X importtime tools/ck.py ...`.')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+import unittest
+from typing import Dict, List, Tuple
+from unittest.mock import patch
+
+from tools.asyncbot import AsyncBot, TokenBucket
+from tools.exceptions import TelegramApiError
+from tools.fakebot import FakeBotApi
+
+
+class ScriptedBotApi(FakeBotApi):
+    """A fake Bot API that answers the next requests to a chat with scripted errors before answering normally."""
+
+    def __init__(self, script: Dict[str, List[Tuple[int, dict]]], **kwargs):
+        super().__init__(**kwargs)
+        self.script = script
+
+    def handle(self, method: str, params: dict) -> Tuple[int, dict]:
+        with self._lock:
+            responses = self.script.get(str(params.get('chat_id')))
+            if responses:
+                self.request_count += 1
+                return responses.pop(0)
+        return super().handle(method, params)
+
+
+RATE_LIMITED = (429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                      'parameters': {'retry_after': 1}})
+SERVER_ERROR = (500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+BAD_REQUEST = (400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'})
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_allows_a_burst_then_the_rate(self):
+        async def acquire_all():
+            bucket = TokenBucket(rate=50, capacity=5)
+            start = time.monotonic()
+            for _ in range(10):
+                await bucket.acquire()
+            return time.monotonic() - start
+
+        # 5 tokens are available immediately, the other 5 take 1/50 s each.
+        self.assertAlmostEqual(asyncio.run(acquire_all()), 0.1, delta=0.05)
+
+    def test_pause_blocks_acquisition(self):
+        async def acquire_after_pause():
+            bucket = TokenBucket(rate=1000)
+            bucket.pause(0.1)
+            start = time.monotonic()
+            await bucket.acquire()
+            return time.monotonic() - start
+
+        self.assertGreaterEqual(asyncio.run(acquire_after_pause()), 0.1)
+
+    def test_no_burst_after_a_pause(self):
+        async def acquire_after_pause():
+            bucket = TokenBucket(rate=20, capacity=20)
+            bucket.pause(0.1)
+            start = time.monotonic()
+            for _ in range(3):
+                await bucket.acquire()
+            return time.monotonic() - start
+
+        # The pause doesn't count as refill time: the three tokens take 1/20 s each after it.
+        self.assertGreaterEqual(asyncio.run(acquire_after_pause()), 0.1 + 3 / 20 - 0.01)
+
+
+class AsyncBotTests(unittest.TestCase):
+    def start_api(self, script: Dict[str, List[Tuple[int, dict]]] = None) -> FakeBotApi:
+        api = ScriptedBotApi(script or {}).start()
+        self.addCleanup(api.stop)
+        return api
+
+    def run_bot(self, api: FakeBotApi, coroutine_function, **kwargs):
+        async def run():
+            async with AsyncBot('token', '42', base_url=api.url, **kwargs) as bot:
+                return await coroutine_function(bot)
+
+        return asyncio.run(run())
+
+    def test_send_to_many(self):
+        api = self.start_api({'3': [BAD_REQUEST]})
+        chat_ids = [str(chat_id) for chat_id in range(1, 6)]
+        results = self.run_bot(api, lambda bot: bot.send_to_many('hello', chat_ids), global_rate=1000)
+        self.assertEqual(list(results), chat_ids)
+        self.assertIsInstance(results['3'], TelegramApiError)
+        self.assertEqual(results['3'].error_code, 400)
+        self.assertEqual(sorted(message['chat']['id'] for message in api.messages), ['1', '2', '4', '5'])
+
+    def test_pauses_the_chat_for_retry_after(self):
+        api = self.start_api({'42': [RATE_LIMITED]})
+        start = time.monotonic()
+        self.run_bot(api, lambda bot: bot.send_message('hello'))
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertEqual(api.request_count, 2)
+        self.assertEqual(len(api.messages), 1)
+
+    @patch('tools.asyncbot.BACKOFF_BASE', 0.01)
+    def test_retries_server_errors_with_backoff(self):
+        api = self.start_api({'42': [SERVER_ERROR, SERVER_ERROR]})
+        with patch('tools.asyncbot.random.uniform', wraps=lambda low, high: high) as uniform:
+            self.run_bot(api, lambda bot: bot.send_message('hello'))
+        # Full jitter up to an exponentially growing cap.
+        self.assertEqual([call.args for call in uniform.call_args_list], [(0, 0.01), (0, 0.02)])
+        self.assertEqual(len(api.messages), 1)
+
+    @patch('tools.asyncbot.BACKOFF_BASE', 0.01)
+    def test_gives_up_after_max_retries(self):
+        api = self.start_api({'42': [SERVER_ERROR] * 3})
+        with self.assertRaises(TelegramApiError) as context:
+            self.run_bot(api, lambda bot: bot.send_message('hello'), max_retries=2)
+        self.assertEqual(context.exception.error_code, 500)
+        self.assertEqual(api.request_count, 3)
+        self.assertEqual(api.messages, [])
+
+    def test_waits_for_the_chat_before_taking_a_global_token(self):
+        sent: List[float] = []
+
+        async def request(*_):
+            sent.append(time.monotonic())
+            return 200, json.dumps({'ok': True, 'result': {}}).encode()
+
+        async def send_all(bot: AsyncBot):
+            bot._pool.request = request
+            await asyncio.gather(*(
+                bot.send_message('hello', str(chat_id)) for _ in range(3) for chat_id in range(30)
+            ))
+
+        api = self.start_api()
+        start = time.monotonic()
+        self.run_bot(api, send_all, global_rate=20, per_chat_rate=2)
+        times = [moment - start for moment in sent]
+        # The burst of 20 global tokens and 10 more from the refill go to chats that are ready right away.
+        self.assertGreaterEqual(sum(moment < 0.5 for moment in times), 28)
+        # ...and no window of 0.5 s ever gets more than the burst and the refill.
+        self.assertLessEqual(max(sum(t <= moment < t + 0.5 for moment in times) for t in times), 31)
+
+
+if __name__ == '__main__':
+    unittest.main()
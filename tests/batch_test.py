@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+from tools.batch import BatchJob, FAILED, SKIPPED, SUCCEEDED, check_dependencies, load_jobs, run_batch
+from tools.exceptions import JobFileError
+from tools.runner import OutputBuffer, RunResult
+
+
+def fake_runner(failing=(), log=None):
+    def runner(job: BatchJob) -> RunResult:
+        if log is not None:
+            log.append(job.name)
+        return RunResult(job.command, 1 if job.name in failing else 0, OutputBuffer(), OutputBuffer())
+    return runner
+
+
+class CheckDependenciesTests(unittest.TestCase):
+    def test_rejects_unknown_dependency(self):
+        with self.assertRaisesRegex(JobFileError, 'doesn\'t exist'):
+            check_dependencies([BatchJob('a', 'true', depends_on=['b'])])
+
+    def test_rejects_duplicate_names(self):
+        with self.assertRaisesRegex(JobFileError, 'more than one'):
+            check_dependencies([BatchJob('a', 'true'), BatchJob('a', 'false')])
+
+    def test_rejects_cycles(self):
+        jobs = [
+            BatchJob('a', 'true'),
+            BatchJob('b', 'true', depends_on=['a', 'c']),
+            BatchJob('c', 'true', depends_on=['b']),
+        ]
+        with self.assertRaisesRegex(JobFileError, 'cycle between jobs: b, c'):
+            check_dependencies(jobs)
+
+
+class RunBatchTests(unittest.TestCase):
+    def test_runs_dependencies_first(self):
+        order = []
+        jobs = [
+            BatchJob('deploy', 'true', depends_on=['build', 'test']),
+            BatchJob('test', 'true', depends_on=['build']),
+            BatchJob('build', 'true'),
+        ]
+        results = run_batch(jobs, max_parallel=4, runner=fake_runner(log=order))
+        self.assertEqual(order, ['build', 'test', 'deploy'])
+        self.assertEqual([result.status for result in results], [SUCCEEDED] * 3)
+
+    def test_skips_dependents_of_failed_jobs(self):
+        jobs = [
+            BatchJob('build', 'true'),
+            BatchJob('test', 'true', depends_on=['build']),
+            BatchJob('deploy', 'true', depends_on=['test']),
+            BatchJob('lint', 'true'),
+        ]
+        results = run_batch(jobs, max_parallel=2, runner=fake_runner(failing={'build'}))
+        self.assertEqual([result.status for result in results], [FAILED, SKIPPED, SKIPPED, SUCCEEDED])
+        self.assertEqual(results[2].blocked_by, 'test')
+
+    def test_uses_job_cwd_and_env(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            job = BatchJob('pwd', 'pwd; echo $CK_TEST', cwd=tmp_dir, env={'CK_TEST': 'value'})
+            start_dir = os.getcwd()
+            results = run_batch([job])
+            self.assertEqual(os.getcwd(), start_dir)
+            self.assertEqual(results[0].result.stdout.text().split(), [os.path.realpath(tmp_dir), 'value'])
+
+
+class LoadJobsTests(unittest.TestCase):
+    def test_loads_json_relative_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'jobs.json')
+            with open(path, 'w') as file:
+                json.dump({'jobs': [{'command': 'make', 'cwd': 'src', 'env': {'N': 1}}]}, file)
+            self.assertEqual(load_jobs(path), [BatchJob('1', 'make', cwd=os.path.join(tmp_dir, 'src'), env={'N': '1'})])
+
+    def test_rejects_unknown_keys(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'jobs.json')
+            with open(path, 'w') as file:
+                json.dump([{'command': 'make', 'dependson': ['x']}], file)
+            with self.assertRaisesRegex(JobFileError, 'unknown keys: dependson'):
+                load_jobs(path)
+
+    def test_rejects_fields_of_the_wrong_type(self):
+        for entry, message in (
+                ({'name': 'test', 'command': 'make', 'depends_on': 'build'}, 'job "test" .*`depends_on` must be a list'),
+                ({'name': 'test', 'command': 'make', 'env': 'N=1'}, 'job "test" .*`env` must be a table'),
+                ({'name': 'test', 'command': 'make', 'env': {'N': [1]}}, '`env` must be a table'),
+                ({'name': 'test', 'command': ['make']}, '`command` must be a string'),
+        ):
+            with self.subTest(entry), tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'jobs.json')
+                with open(path, 'w') as file:
+                    json.dump([entry], file)
+                with self.assertRaisesRegex(JobFileError, message):
+                    load_jobs(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from benchmarks.startup_bench import CK_PATH, parse_importtime
+from tools.ck import main
+
+
+def imported_modules(*args: str) -> set:
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', CK_PATH, *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        # Start outside the repository, like a command on the PATH would.
+        cwd=os.path.dirname(os.path.dirname(CK_PATH)) + '/..',
+        env={key: value for key, value in os.environ.items() if key != 'PYTHONPATH'},
+    )
+    return parse_importtime(process.stderr)[1]
+
+
+class LazyImportTests(unittest.TestCase):
+    def test_help_imports_no_subcommand(self):
+        modules = imported_modules('--help')
+        self.assertFalse({'tools.prettypath', 'tools.schedcom', 'tools.ckcyberbot', 'typing'} & modules)
+
+    def test_sched_doesnt_import_the_bot(self):
+        modules = imported_modules('sched', '--help')
+        self.assertIn('tools.schedcom', modules)
+        self.assertFalse({'tools.ckcyberbot', 'http.client', 'tools.batch', 'tools.spool'} & modules)
+
+    def test_sched_help_doesnt_import_the_runner_or_the_scheduler(self):
+        modules = imported_modules('sched', '--help')
+        self.assertFalse({'tools.cron', 'tools.live', 'tools.runner', 'tools.scheduler', 'socketserver'} & modules)
+
+    def test_path_imports_only_prettypath(self):
+        modules = imported_modules('path')
+        self.assertIn('tools.prettypath', modules)
+        self.assertFalse({'tools.schedcom', 'tools.utils', 'concurrent.futures'} & modules)
+
+
+class DispatchTests(unittest.TestCase):
+    def test_unknown_subcommand(self):
+        with redirect_stderr(io.StringIO()) as stderr:
+            self.assertEqual(main(['nope']), 2)
+        self.assertIn('unknown subcommand "nope"', stderr.getvalue())
+
+    def test_help_lists_subcommands(self):
+        with redirect_stdout(io.StringIO()) as stdout:
+            self.assertEqual(main(['--help']), 0)
+        for name in ('path', 'sched', 'bot'):
+            self.assertIn(f'  {name} ', stdout.getvalue())
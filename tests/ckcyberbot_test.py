@@ -0,0 +1,222 @@
+import gzip
+import io
+import socketserver
+import threading
+import time
+import unittest
+from typing import List
+
+from tools.ckcyberbot import Bot, ConnectionPool, _gzip_chunks, _multipart_envelope, split_message
+from tools.exceptions import TelegramApiError
+from tools.fakebot import FakeBotApi
+
+
+class SplitMessageTests(unittest.TestCase):
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_message('one\ntwo\n'), ['one\ntwo\n'])
+
+    def test_splits_on_line_boundaries(self):
+        self.assertEqual(split_message('aaa\nbbb\nccc\n', limit=8), ['aaa\nbbb\n', 'ccc\n'])
+
+    def test_splits_long_lines(self):
+        self.assertEqual(split_message('a\n' + 'b' * 10, limit=4), ['a\n', 'bbbb', 'bbbb', 'bb'])
+
+    def test_chunks_join_back_to_the_text(self):
+        text = ''.join(f'line {i}\n' for i in range(10000))
+        chunks = split_message(text)
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertEqual(''.join(chunks), text)
+
+
+class UploadTests(unittest.TestCase):
+    def test_gzip_chunks_round_trip(self):
+        chunks = [bytes([i]) * 1000 for i in range(100)]
+        self.assertEqual(gzip.decompress(b''.join(_gzip_chunks(chunks))), b''.join(chunks))
+
+    def test_multipart_envelope(self):
+        head, tail = _multipart_envelope({'chat_id': '42'}, 'document', 'log.txt', 'XYZ')
+        self.assertEqual(head, (
+            b'--XYZ\r\nContent-Disposition: form-data; name="chat_id"\r\n\r\n42\r\n'
+            b'--XYZ\r\nContent-Disposition: form-data; name="document"; filename="log.txt"\r\n'
+            b'Content-Type: application/octet-stream\r\n\r\n'
+        ))
+        self.assertEqual(tail, b'\r\n--XYZ--\r\n')
+
+
+class _KeepAliveHandler(socketserver.StreamRequestHandler):
+    """Answer HTTP requests on one connection until the client hangs up, misbehaving as the server says."""
+
+    def handle(self):
+        server: '_KeepAliveServer' = self.server
+        with server.lock:
+            server.connections += 1
+        requests = 0
+        while True:
+            head = b''
+            while not head.endswith(b'\r\n\r\n'):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                head += line
+            if b'chunked' in head.lower():
+                while not head.endswith(b'0\r\n\r\n'):
+                    head += self.rfile.readline()
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    self.rfile.read(int(line.split(b':')[1]))
+            requests += 1
+            with server.lock:
+                server.requests.append(requests)
+            if requests == server.drop_request:
+                # Hang up without an answer, like a server that closed the connection just as it was reused.
+                return
+            self.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            self.wfile.flush()
+            if server.close_after_response:
+                # Close an idle connection, like a server's keep-alive timeout.
+                return
+
+
+class _KeepAliveServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, drop_request: int = 0, close_after_response: bool = False):
+        super().__init__(('127.0.0.1', 0), _KeepAliveHandler)
+        self.drop_request = drop_request
+        self.close_after_response = close_after_response
+        self.connections = 0
+        # The number of every request within its connection.
+        self.requests: List[int] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def start_server(self, **kwargs) -> _KeepAliveServer:
+        server = _KeepAliveServer(**kwargs)
+        threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def pool(self, server: _KeepAliveServer) -> ConnectionPool:
+        pool = ConnectionPool(server.url, timeout=5)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_reuses_the_connection(self):
+        server = self.start_server()
+        pool = self.pool(server)
+        for _ in range(3):
+            self.assertEqual(pool.request('POST', '/', b'{}'), (200, b'ok'))
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.requests, [1, 2, 3])
+
+    def test_reconnects_after_the_server_closed_an_idle_connection(self):
+        server = self.start_server(close_after_response=True)
+        pool = self.pool(server)
+        self.assertEqual(pool.request('GET', '/'), (200, b'ok'))
+        # Give the server's FIN time to arrive, so that the pool sees the idle connection is stale.
+        time.sleep(0.1)
+        self.assertEqual(pool.request('GET', '/'), (200, b'ok'))
+        self.assertEqual(server.connections, 2)
+
+    def test_retries_an_idempotent_request_dropped_on_a_reused_connection(self):
+        server = self.start_server(drop_request=2)
+        pool = self.pool(server)
+        pool.request('GET', '/')
+        self.assertEqual(pool.request('GET', '/'), (200, b'ok'))
+        self.assertEqual(server.connections, 2)
+        self.assertEqual(server.requests, [1, 2, 1])
+
+    def test_no_retry_once_a_post_was_sent(self):
+        server = self.start_server(drop_request=2)
+        pool = self.pool(server)
+        pool.request('POST', '/', b'first')
+        # The server may have processed it, e.g. sent a message, before hanging up.
+        with self.assertRaises(ConnectionError):
+            pool.request('POST', '/', b'second')
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.requests, [1, 2])
+
+    def test_no_retry_once_a_streamed_body_was_sent(self):
+        server = self.start_server(drop_request=2)
+        pool = self.pool(server)
+        pool.request('POST', '/', b'first')
+        with self.assertRaises(ConnectionError):
+            pool.request('POST', '/', iter([b'streamed ', b'body']))
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(server.requests, [1, 2])
+
+
+class FakeBotApiTests(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeBotApi().start()
+        self.addCleanup(self.api.stop)
+        self.bot = Bot('token', '42', base_url=self.api.url)
+        self.addCleanup(self.bot.close)
+
+    def test_get_me(self):
+        self.assertTrue(self.bot.get_me()['result']['is_bot'])
+
+    def test_send_message_reuses_the_connection(self):
+        for i in range(3):
+            self.bot.send_message(f'message {i}')
+        self.assertEqual([message['text'] for message in self.api.messages], ['message 0', 'message 1', 'message 2'])
+        self.assertEqual(len(self.bot._pool._idle.queue), 1)
+
+    def test_edit_message_text(self):
+        message_id = self.bot.send_message('before')['result']['message_id']
+        self.bot.edit_message_text(message_id, 'after')
+        self.assertEqual(self.api.messages[0]['text'], 'after')
+        with self.assertRaisesRegex(TelegramApiError, 'message is not modified'):
+            self.bot.edit_message_text(message_id, 'after')
+
+    def test_send_long_message_is_split(self):
+        responses = self.bot.send_long_message('line\n' * 1000, document_threshold=10000)
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(''.join(message['text'] for message in self.api.messages), 'line\n' * 1000)
+
+    def test_send_document(self):
+        self.bot.send_document(io.BytesIO(b'log output'), filename='run.log', caption='done')
+        document = self.api.documents[0]
+        self.assertEqual(document['document']['file_name'], 'run.log')
+        self.assertEqual(document['caption'], 'done')
+        self.assertEqual(document['content'], b'log output')
+
+    def test_send_compressed_document_is_chunked(self):
+        self.bot.send_document(io.BytesIO(b'x' * 100000), filename='run.log', compress=True)
+        document = self.api.documents[0]
+        self.assertEqual(document['document']['file_name'], 'run.log.gz')
+        self.assertEqual(gzip.decompress(document['content']), b'x' * 100000)
+
+    def test_get_updates_long_polls(self):
+        threading.Timer(0.2, self.api.add_update, ['/jobs', 42]).start()
+        start = time.monotonic()
+        updates = self.bot.get_updates(timeout=5)['result']
+        self.assertLess(time.monotonic() - start, 4)
+        self.assertEqual(updates[0]['message']['text'], '/jobs')
+        # Confirmed updates aren't returned again.
+        self.assertEqual(self.bot.get_updates(offset=updates[0]['update_id'] + 1)['result'], [])
+
+    def test_rate_limit(self):
+        self.api.rate_limit_rate = 1.0
+        self.api.retry_after = 7
+        with self.assertRaises(TelegramApiError) as cm:
+            self.bot.send_message('hello')
+        self.assertEqual(cm.exception.error_code, 429)
+        self.assertEqual(cm.exception.retry_after, 7)
+
+    def test_server_error(self):
+        self.api.error_rate = 1.0
+        with self.assertRaises(TelegramApiError) as cm:
+            self.bot.send_message('hello')
+        self.assertEqual(cm.exception.error_code, 500)
+        self.assertEqual(self.api.messages, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
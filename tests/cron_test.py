@@ -0,0 +1,55 @@
+import datetime
+import unittest
+
+from tools.cron import CronSchedule, IntervalSchedule
+from tools.exceptions import ScheduleError
+
+
+def next_fire(expression: str, after: str) -> str:
+    timestamp = datetime.datetime.fromisoformat(after).timestamp()
+    return datetime.datetime.fromtimestamp(CronSchedule(expression).next_after(timestamp)).isoformat()
+
+
+class CronScheduleTests(unittest.TestCase):
+    def test_every_quarter_hour(self):
+        self.assertEqual(next_fire('*/15 * * * *', '2021-11-03T10:07:30'), '2021-11-03T10:15:00')
+        self.assertEqual(next_fire('*/15 * * * *', '2021-11-03T10:15:00'), '2021-11-03T10:30:00')
+
+    def test_rolls_over_hour_day_month_and_year(self):
+        self.assertEqual(next_fire('5 * * * *', '2021-11-03T10:59:00'), '2021-11-03T11:05:00')
+        self.assertEqual(next_fire('0 8 * * *', '2021-11-03T09:00:00'), '2021-11-04T08:00:00')
+        self.assertEqual(next_fire('0 0 1 * *', '2021-11-03T09:00:00'), '2021-12-01T00:00:00')
+        self.assertEqual(next_fire('@yearly', '2021-11-03T09:00:00'), '2022-01-01T00:00:00')
+
+    def test_names_ranges_and_lists(self):
+        # 2021-11-05 is a Friday.
+        self.assertEqual(next_fire('0 9 * * mon-fri', '2021-11-05T10:00:00'), '2021-11-08T09:00:00')
+        self.assertEqual(next_fire('30 4 * jan,jul *', '2021-11-05T10:00:00'), '2022-01-01T04:30:00')
+
+    def test_day_of_month_or_day_of_week(self):
+        # Like cron, a job restricted by both day fields runs when either matches: here Sunday the 7th.
+        self.assertEqual(next_fire('0 0 13 * 0', '2021-11-03T10:00:00'), '2021-11-07T00:00:00')
+        self.assertEqual(next_fire('0 0 * * 7', '2021-11-03T10:00:00'), '2021-11-07T00:00:00')
+
+    def test_leap_day(self):
+        self.assertEqual(next_fire('0 0 29 2 *', '2021-11-03T10:00:00'), '2024-02-29T00:00:00')
+
+    def test_invalid_expressions(self):
+        for expression in ('* * * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *', 'x * * * *'):
+            with self.subTest(expression=expression), self.assertRaises(ScheduleError):
+                CronSchedule(expression)
+        with self.assertRaisesRegex(ScheduleError, 'never fires'):
+            next_fire('0 0 30 2 *', '2021-11-03T10:00:00')
+
+
+class IntervalScheduleTests(unittest.TestCase):
+    def test_fires_on_multiples_of_the_interval(self):
+        schedule = IntervalSchedule(60, anchor=1000)
+        self.assertEqual(schedule.next_after(900), 1000)
+        self.assertEqual(schedule.next_after(1000), 1060)
+        self.assertEqual(schedule.next_after(1059), 1060)
+        self.assertEqual(schedule.next_after(1000 + 60 * 1000 + 1), 1000 + 60 * 1001)
+
+
+if __name__ == '__main__':
+    unittest.main()
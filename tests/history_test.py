@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from tools.history import History, RunRecord, format_duration
+
+
+def run(command: str, duration: float, returncode: int = 0, started: float = 1000.0) -> RunRecord:
+    return RunRecord(command, started, started + duration, returncode)
+
+
+class HistoryTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.history = History(os.path.join(tmp_dir.name, 'history.sqlite3'), flush_interval=0.01)
+
+    def record(self, *records: RunRecord):
+        for record in records:
+            self.history.record(record)
+        self.history.close()
+
+    def test_records_runs_in_wal_mode(self):
+        self.record(run('make', 2.0), run('make', 3.0, returncode=2, started=2000.0))
+        records = self.history.recent()
+        self.assertEqual([(record.command, record.duration, record.returncode) for record in records],
+                         [('make', 3.0, 2), ('make', 2.0, 0)])
+        with sqlite3.connect(self.history.path) as connection:
+            self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_stats(self):
+        self.record(*(run('make', float(seconds)) for seconds in range(1, 101)), run('make', 0.5, returncode=1))
+        self.record(run('ls', 0.1))
+        make, = self.history.stats('make')
+        self.assertEqual((make.runs, make.failures), (101, 1))
+        self.assertAlmostEqual(make.failure_rate, 1 / 101)
+        # Failed runs don't count towards the durations.
+        self.assertEqual((make.p50, make.p95), (51.0, 95.0))
+        self.assertEqual([stats.command for stats in self.history.stats()], ['make', 'ls'])
+
+    def test_estimate(self):
+        self.assertIsNone(self.history.estimate('make'))
+        self.record(run('make', 1.0, returncode=1))
+        self.assertIsNone(self.history.estimate('make'))
+        self.record(run('make', 4.0), run('make', 6.0))
+        self.assertEqual(self.history.estimate('make'), (4.0, 6.0))
+
+    def test_recent_filters_by_command(self):
+        self.record(run('make', 1.0), run('ls', 1.0, started=1001.0), run('make', 1.0, started=1002.0))
+        self.assertEqual([record.started for record in self.history.recent(command='make')], [1002.0, 1000.0])
+        self.assertEqual(len(self.history.recent(limit=1)), 1)
+
+
+class FormatDurationTests(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(format_duration(2.54), '2.5 s')
+        self.assertEqual(format_duration(45), '45 s')
+        self.assertEqual(format_duration(200), '3 min 20 s')
+        self.assertEqual(format_duration(2 * 3600 + 300), '2 h 05 min')
@@ -0,0 +1,35 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from benchmarks.hotpath_bench import load_baseline, main
+
+
+class HotpathBenchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.baseline = os.path.join(self.tmp_dir.name, 'state', 'hotpath_baseline.json')
+
+    def run_bench(self, *args: str) -> int:
+        with redirect_stdout(io.StringIO()):
+            return main(['parse_delay', '--repeat', '1', '--baseline', self.baseline, *args])
+
+    def test_save_then_compare(self):
+        self.assertEqual(self.run_bench(), 0)
+        self.assertEqual(self.run_bench('--save-baseline'), 0)
+        self.assertEqual(list(load_baseline(self.baseline)), ['parse_delay'])
+        self.assertEqual(self.run_bench('--threshold', '1000'), 0)
+
+    def test_fails_when_slower_than_the_baseline(self):
+        os.makedirs(os.path.dirname(self.baseline))
+        with open(self.baseline, 'w') as file:
+            json.dump({'results': {'parse_delay': {'seconds': 1e-12, 'unit': 'op'}}}, file)
+        self.assertEqual(self.run_bench(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
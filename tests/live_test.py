@@ -0,0 +1,75 @@
+import time
+import unittest
+from unittest.mock import patch
+
+from tools.ckcyberbot import Bot
+from tools.exceptions import TelegramApiError
+from tools.fakebot import FakeBotApi
+from tools.live import LiveMessage, fit_message, format_elapsed
+from tools.runner import run_command
+
+
+class LiveMessageTests(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeBotApi().start()
+        self.addCleanup(self.api.stop)
+        self.bot = Bot('token', '42', base_url=self.api.url)
+        self.addCleanup(self.bot.close)
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_shows_the_latest_lines_and_becomes_the_completion_message(self):
+        live = LiveMessage(self.bot, 'build', lines=2, interval=0.01).start()
+        self.wait_for(lambda: self.api.messages)
+        live.write(b'one\ntwo\nthree\n')
+        self.wait_for(lambda: self.api.edits)
+        self.assertEqual(self.api.edits[0]['text'], '"build" is running for less than a minute.\n\ntwo\nthree')
+        self.assertTrue(live.finish('"build" executed successfully!', 'three'))
+        self.assertEqual(len(self.api.messages), 1)
+        self.assertEqual(self.api.messages[0]['text'], '"build" executed successfully!\n\nthree')
+
+    def test_skips_unchanged_content(self):
+        live = LiveMessage(self.bot, 'sleep', interval=0.01).start()
+        self.wait_for(lambda: self.api.messages)
+        time.sleep(0.1)
+        self.assertEqual(self.api.edits, [])
+        live.finish('done')
+
+    def test_follows_a_running_command(self):
+        live = LiveMessage(self.bot, 'seq', lines=1, interval=0.01).start()
+        run_command('seq 3; sleep 0.2', tee=False, outputs=[live])
+        self.assertTrue(live.finish('done'))
+        self.assertIn('"seq" is running for less than a minute.\n\n3', [edit['text'] for edit in self.api.edits])
+
+    def test_backs_off_when_rate_limited(self):
+        live = LiveMessage(self.bot, 'cmd', interval=0.01)
+        live.message_id = 1
+        error = TelegramApiError('Too Many Requests', 429, retry_after=7)
+        with patch.object(self.bot, 'edit_message_text', side_effect=error):
+            self.assertEqual(live._edit('new text'), 7)
+
+    def test_finish_without_a_message_falls_back(self):
+        api = FakeBotApi(rate_limit_rate=1.0).start()
+        self.addCleanup(api.stop)
+        with Bot('token', '42', base_url=api.url) as bot, patch('builtins.print'):
+            live = LiveMessage(bot, 'cmd').start()
+            self.assertFalse(live.finish('done'))
+
+    def test_fit_message_keeps_the_end_of_the_output(self):
+        text = fit_message('status', 'x' * 5000 + 'end', limit=100)
+        self.assertEqual(len(text), 100)
+        self.assertTrue(text.startswith('status\n\n…'))
+        self.assertTrue(text.endswith('end'))
+
+    def test_format_elapsed(self):
+        self.assertEqual(format_elapsed(59), 'less than a minute')
+        self.assertEqual(format_elapsed(125), '2 min')
+        self.assertEqual(format_elapsed(3 * 3600 + 300), '3 h 05 min')
+
+
+if __name__ == '__main__':
+    unittest.main()
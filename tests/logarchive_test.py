@@ -0,0 +1,107 @@
+import gzip
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from tools.exceptions import LogArchiveError
+from tools.logarchive import LogArchiveWriter, find_run, list_runs, load_run, new_run_id, prune
+from tools.runner import run_command
+
+
+class LogArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_run(self, run_id: str, data: bytes, log_format: str = 'gzip', **kwargs) -> LogArchiveWriter:
+        writer = LogArchiveWriter(run_id, 'cmd', log_format, self.directory, block_size=100, **kwargs)
+        for start in range(0, len(data), 37):
+            writer.write(data[start:start + 37])
+        writer.close(0)
+        return writer
+
+    def test_round_trip_in_blocks(self):
+        data = b''.join(b'line %d\n' % number for number in range(200))
+        for log_format in ('gzip', 'xz'):
+            with self.subTest(log_format):
+                self.write_run(f'run-{log_format}', data, log_format)
+                run = load_run(f'run-{log_format}', self.directory)
+                self.assertEqual(run.returncode, 0)
+                self.assertEqual(run.size, len(data))
+                self.assertEqual(len(run.blocks), -(-len(data) // 100))
+                self.assertEqual(b''.join(run.iter_bytes()), data)
+
+    def test_segments_are_plain_multi_member_gzip(self):
+        data = os.urandom(1000)
+        self.write_run('run', data)
+        with gzip.open(os.path.join(self.directory, 'run.000.gz')) as file:
+            self.assertEqual(file.read(), data)
+
+    def test_seek_and_tail_only_read_the_blocks_they_need(self):
+        data = b''.join(b'line %d\n' % number for number in range(200))
+        self.write_run('run', data)
+        run = load_run('run', self.directory)
+        with patch('tools.logarchive._decompress', side_effect=lambda _, block: gzip.decompress(block)) as decompress:
+            self.assertEqual(b''.join(run.iter_bytes(250, 260)), data[250:260])
+            self.assertEqual(decompress.call_count, 1)
+            self.assertEqual(run.tail(2), b'line 198\nline 199\n')
+            self.assertLessEqual(decompress.call_count, 2)
+
+    def test_rolls_over_to_new_segments(self):
+        data = os.urandom(1000)
+        self.write_run('run', data, segment_size=250)
+        run = load_run('run', self.directory)
+        self.assertGreater(run.blocks[-1].segment, 0)
+        self.assertEqual(b''.join(run.iter_bytes()), data)
+
+    def test_budget_deletes_the_oldest_runs_then_own_segments(self):
+        self.write_run('1-old', os.urandom(1000))
+        self.write_run('2-new', os.urandom(3000), budget=2000, segment_size=250)
+        self.assertEqual([run.run_id for run in list_runs(self.directory)], ['2-new'])
+        run = load_run('2-new', self.directory)
+        self.assertLessEqual(run.disk_usage(), 2000 + 250)
+        self.assertGreater(run.first_offset, 0)
+        self.assertEqual(b''.join(run.iter_bytes()), b''.join(run.iter_bytes(run.first_offset)))
+
+    def test_prune_deletes_old_runs(self):
+        self.write_run('1-old', b'old')
+        self.write_run('2-new', b'new')
+        old_time = time.time() - 3600
+        for name in os.listdir(self.directory):
+            if name.startswith('1-old'):
+                os.utime(os.path.join(self.directory, name), (old_time, old_time))
+        prune(self.directory, max_age=60)
+        self.assertEqual([run.run_id for run in list_runs(self.directory)], ['2-new'])
+
+    def test_find_run(self):
+        first = new_run_id(1_700_000_000, 'abc')
+        second = new_run_id(1_700_000_100, 'abc')
+        self.write_run(first, b'1')
+        self.write_run(second, b'2')
+        self.assertEqual(find_run('abc', self.directory).run_id, second)
+        self.assertEqual(find_run(first, self.directory).run_id, first)
+        with self.assertRaises(LogArchiveError):
+            find_run('xyz', self.directory)
+
+    def test_run_ids_of_the_same_job_and_second_differ(self):
+        first = new_run_id(1_700_000_000, 'abc')
+        second = new_run_id(1_700_000_000, 'abc')
+        self.assertNotEqual(first, second)
+        self.assertIn('-abc-', first)
+
+    def test_archives_a_command(self):
+        writer = LogArchiveWriter('run', 'cmd', 'xz', self.directory)
+        result = run_command('seq 100000', tee=False, outputs=[writer])
+        writer.close(result.returncode)
+        run = load_run('run', self.directory)
+        self.assertEqual(run.tail(1), b'100000\n')
+        self.assertEqual(run.size, result.stdout.total)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from tools.exceptions import ProcessWaitError
+from tools.pidwait import _wait_polling, read_pid_file, wait_for_exit
+
+
+@unittest.skipIf(sys.platform == 'win32', 'needs POSIX')
+class WaitForExitTests(unittest.TestCase):
+    def start(self, seconds: float) -> subprocess.Popen:
+        process = subprocess.Popen(['sleep', str(seconds)])
+        self.addCleanup(process.kill)
+        return process
+
+    def test_waits_until_the_process_exits(self):
+        for wait in (wait_for_exit, _wait_polling):
+            with self.subTest(wait.__name__):
+                process = self.start(0.3)
+                # A zombie still exists for `kill(pid, 0)`, so reap it like its real parent would.
+                threading.Thread(target=process.wait).start()
+                start = time.monotonic()
+                self.assertTrue(wait(process.pid, timeout=5))
+                self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    def test_timeout(self):
+        process = self.start(5)
+        self.assertFalse(wait_for_exit(process.pid, timeout=0.1))
+
+    def test_process_that_is_gone(self):
+        process = self.start(0)
+        process.wait()
+        self.assertTrue(wait_for_exit(process.pid, timeout=1))
+
+
+class ReadPidFileTests(unittest.TestCase):
+    def test_read_pid_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'app.pid')
+            with open(path, 'w') as file:
+                file.write('1234\n')
+            self.assertEqual(read_pid_file(path), 1234)
+            with open(path, 'w') as file:
+                file.write('not a pid')
+            with self.assertRaises(ProcessWaitError):
+                read_pid_file(path)
+            with self.assertRaises(ProcessWaitError):
+                read_pid_file(os.path.join(tmp_dir, 'missing.pid'))
+
+
+if __name__ == '__main__':
+    unittest.main()
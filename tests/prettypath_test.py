@@ -0,0 +1,119 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from tools.prettypath import PathIndex, analyze, optimized_dirs, path_dirs
+
+
+class PathIndexTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.first = os.path.join(tmp_dir.name, 'first')
+        self.second = os.path.join(tmp_dir.name, 'second')
+        self.cache_path = os.path.join(tmp_dir.name, 'cache', 'index.json')
+        for directory in (self.first, self.second):
+            os.mkdir(directory)
+        self.add_executable(self.first, 'tool')
+        self.add_executable(self.second, 'tool')
+        self.add_executable(self.second, 'other')
+        with open(os.path.join(self.second, 'data.txt'), 'w'):
+            pass
+        os.mkdir(os.path.join(self.second, 'subdir'))
+
+    @staticmethod
+    def add_executable(directory: str, name: str):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as file:
+            file.write('#!/bin/sh\n')
+        os.chmod(path, 0o755)
+        # Make sure the directory's mtime changes, even on file systems with coarse timestamps.
+        st = os.stat(directory)
+        os.utime(directory, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    def index(self, dirs=None) -> PathIndex:
+        return PathIndex(dirs or [self.first, self.second], self.cache_path)
+
+    def test_indexes_only_executables(self):
+        index = self.index()
+        self.assertEqual(index.names, {'tool': [self.first, self.second], 'other': [self.second]})
+
+    def test_which_lists_the_first_match_first(self):
+        index = self.index([self.second, self.first])
+        self.assertEqual(index.which('tool'), [os.path.join(self.second, 'tool'), os.path.join(self.first, 'tool')])
+        self.assertEqual(index.which('missing'), [])
+
+    def test_shadowed(self):
+        self.assertEqual(self.index().shadowed(), {'tool': [self.first, self.second]})
+
+    def test_uses_the_cache_until_a_directory_changes(self):
+        self.assertEqual(self.index().rescanned, [self.first, self.second])
+        self.assertEqual(self.index().rescanned, [])
+        self.add_executable(self.first, 'new')
+        index = self.index()
+        self.assertEqual(index.rescanned, [self.first])
+        self.assertEqual(index.which('new'), [os.path.join(self.first, 'new')])
+
+    def test_missing_and_duplicate_dirs(self):
+        index = self.index([self.first, os.path.join(self.first, 'missing'), self.first])
+        self.assertEqual(index.which('tool'), [os.path.join(self.first, 'tool')])
+
+
+class AnalyzeTests(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.bin = os.path.join(tmp_dir.name, 'bin')
+        self.empty = os.path.join(tmp_dir.name, 'empty')
+        self.link = os.path.join(tmp_dir.name, 'link')
+        self.missing = os.path.join(tmp_dir.name, 'missing')
+        os.mkdir(self.bin)
+        os.mkdir(self.empty)
+        os.symlink(self.bin, self.link)
+        PathIndexTests.add_executable(self.bin, 'tool')
+
+    def test_flags_problems(self):
+        healths = analyze([self.bin, self.missing, self.link, self.empty, self.bin + '/'])
+        self.assertEqual([health.problems(slow=60) for health in healths], [
+            [],
+            ['missing'],
+            ['duplicate of #1'],
+            ['empty'],
+            ['duplicate of #1'],
+        ])
+        self.assertEqual(healths[0].executables, 1)
+        self.assertIsNotNone(healths[0].lookup_seconds)
+
+    def test_optimized_dirs_keep_the_first_occurrence(self):
+        healths = analyze([self.missing, self.link, self.empty, self.bin])
+        self.assertEqual(optimized_dirs(healths), [self.link, self.empty])
+        self.assertEqual(optimized_dirs(healths, drop_empty=True), [self.link])
+
+    def test_timed_out_dirs_are_kept(self):
+        with patch('tools.prettypath.probe_dir', side_effect=lambda _: time.sleep(1)):
+            healths = analyze([self.bin], timeout=0.05)
+        self.assertEqual(healths[0].problems(), ['timed out'])
+        self.assertEqual(optimized_dirs(healths), [self.bin])
+
+    def test_flags_empty_entries_as_the_current_directory(self):
+        with patch.dict(os.environ, {'PATH': os.pathsep.join(['', self.bin, '', self.bin, ''])}):
+            healths = analyze(path_dirs(keep_empty=True))
+        self.assertEqual([health.problems(slow=60) for health in healths], [
+            ['current directory'],
+            [],
+            ['current directory'],
+            ['duplicate of #2'],
+            ['current directory'],
+        ])
+        self.assertEqual(optimized_dirs(healths), [self.bin])
+
+
+class PathDirsTests(unittest.TestCase):
+    @patch.dict(os.environ, {'PATH': os.pathsep.join(['/usr/bin', '', '/mnt/c/Windows', '/bin'])})
+    def test_filters_and_skips_empty_entries(self):
+        self.assertEqual(path_dirs(), ['/usr/bin', '/mnt/c/Windows', '/bin'])
+        self.assertEqual(path_dirs(ignore_pattern='/mnt/c/'), ['/usr/bin', '/bin'])
+        self.assertEqual(path_dirs(search_pattern='^/usr'), ['/usr/bin'])
+        self.assertEqual(path_dirs(keep_empty=True), ['/usr/bin', '', '/mnt/c/Windows', '/bin'])
@@ -0,0 +1,110 @@
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from tools.runner import TIMEOUT_EXIT_CODE, Limits, OutputBuffer, run_command
+
+
+class OutputBufferTests(unittest.TestCase):
+    def test_keeps_everything_under_the_limit(self):
+        buffer = OutputBuffer(10)
+        buffer.write(b'abc')
+        buffer.write(b'defg')
+        self.assertEqual(buffer.text(), 'abcdefg')
+        self.assertEqual(buffer.omitted, 0)
+
+    def test_keeps_head_and_tail_over_the_limit(self):
+        buffer = OutputBuffer(6)
+        for char in b'abcdefghijklmnop':
+            buffer.write(bytes([char]))
+        self.assertEqual(buffer.head, b'abc')
+        self.assertEqual(buffer.tail, b'nop')
+        self.assertEqual(buffer.text(), 'abc\n[... 10 bytes omitted ...]\nnop')
+
+    def test_decodes_output(self):
+        buffer = OutputBuffer()
+        buffer.write('héllo\nwörld\n'.encode())
+        self.assertEqual(buffer.text(), 'héllo\nwörld\n')
+
+
+class RunCommandTests(unittest.TestCase):
+    def test_captures_and_logs_streams(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'run.log')
+            result = run_command('echo out; echo err >&2; exit 3', tee=False, log_path=log_path)
+            self.assertEqual(result.returncode, 3)
+            self.assertEqual(result.stdout.text(), 'out\n')
+            self.assertEqual(result.stderr.text(), 'err\n')
+            with open(log_path) as file:
+                self.assertEqual(sorted(file.read().splitlines()), ['err', 'out'])
+
+    def test_memory_is_bounded(self):
+        result = run_command('head -c 5000000 /dev/zero', tee=False, output_limit=100)
+        self.assertEqual(result.stdout.total, 5000000)
+        self.assertEqual(len(result.stdout.head) + len(result.stdout.tail), 100)
+
+    @unittest.skipUnless(hasattr(os, 'wait4'), 'needs os.wait4()')
+    def test_measures_resource_usage(self):
+        result = run_command('sleep 0.2; head -c 50000000 /dev/zero | tail -c 1 > /dev/null', tee=False)
+        self.assertEqual(result.returncode, 0)
+        self.assertGreaterEqual(result.usage.wall, 0.2)
+        self.assertGreater(result.usage.user + result.usage.sys, 0)
+        self.assertGreater(result.usage.max_rss, 0)
+        self.assertIn('peak RSS', result.usage.format())
+
+
+@unittest.skipUnless(os.name == 'posix', 'needs process groups and rlimits')
+class LimitsTests(unittest.TestCase):
+    def test_timeout_kills_the_whole_process_group(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = os.path.join(tmp_dir, 'survived')
+            start = time.monotonic()
+            # The grandchild ignores SIGTERM and holds no pipe, so only SIGKILL to its group can stop it.
+            result = run_command(
+                f'(trap "" TERM; sleep 1; touch {marker}) > /dev/null 2>&1 & sleep 10',
+                tee=False,
+                limits=Limits(timeout=0.2),
+                kill_grace=0.2,
+            )
+            self.assertLess(time.monotonic() - start, 2)
+            self.assertEqual(result.returncode, TIMEOUT_EXIT_CODE)
+            self.assertEqual(result.cause, 'timed out after 0.2 s')
+            time.sleep(1.2)
+            self.assertFalse(os.path.exists(marker))
+
+    def test_no_cause_within_the_limits(self):
+        result = run_command('true', tee=False, limits=Limits(timeout=10, max_rss=2 ** 30, cpu_seconds=10))
+        self.assertEqual(result.returncode, 0)
+        self.assertIsNone(result.cause)
+
+    def test_cpu_seconds(self):
+        result = run_command('while :; do :; done', tee=False, limits=Limits(timeout=10, cpu_seconds=1))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(result.cause, 'exceeded the CPU time limit of 1 s')
+
+    def test_max_rss(self):
+        result = run_command(
+            'python3 -c "bytearray(512 * 2 ** 20)"', tee=False, limits=Limits(max_rss=256 * 2 ** 20)
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(result.cause, 'ran out of memory with a limit of 256 MiB')
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        start = time.monotonic()
+        result = run_command('sleep 10', tee=False, cancel=cancel)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(result.cause, 'was cancelled')
+
+    def test_signal_is_reported(self):
+        result = run_command('kill -USR1 $$', tee=False)
+        self.assertEqual(result.returncode, -signal.SIGUSR1)
+        self.assertEqual(result.cause, 'killed by SIGUSR1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from tools.exceptions import DaemonNotRunningError
+from tools.runner import run_command
+from tools.scheduler import MISFIRE_GRACE, Job, JobQueue, SchedulerDaemon, plan_runs, send_request
+
+
+class JobQueueTests(unittest.TestCase):
+    def test_pops_due_jobs_in_deadline_order(self):
+        queue = JobQueue()
+        late = queue.push(Job('late', deadline=30))
+        early = queue.push(Job('early', deadline=10))
+        queue.push(Job('future', deadline=100))
+        self.assertEqual(queue.pop_due(now=50), [early, late])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.next_deadline(), 100)
+
+    def test_equal_deadlines_are_fifo(self):
+        queue = JobQueue()
+        first = queue.push(Job('first', deadline=10))
+        second = queue.push(Job('second', deadline=10))
+        self.assertEqual(queue.pop_due(now=10), [first, second])
+
+    def test_cancelled_jobs_are_skipped(self):
+        queue = JobQueue()
+        job = queue.push(Job('cancel me', deadline=10))
+        queue.push(Job('keep me', deadline=20))
+        self.assertTrue(queue.cancel(job.id))
+        self.assertFalse(queue.cancel(job.id))
+        self.assertEqual(queue.next_deadline(), 20)
+        self.assertEqual([job.command for job in queue.pop_due(now=50)], ['keep me'])
+
+    def test_persists_across_instances(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'queue.json')
+            queue = JobQueue(path)
+            job = queue.push(Job('echo hi', deadline=10, notify=True, cwd='/tmp'))
+            queue.push(Job('cancelled', deadline=20))
+            queue.cancel(queue.list()[-1].id)
+            self.assertEqual(JobQueue(path).list(), [job])
+
+
+class PlanRunsTests(unittest.TestCase):
+    def test_one_shot_job_runs_once(self):
+        self.assertEqual(plan_runs(Job('x', deadline=100), now=5000), (1, None))
+
+    def test_on_time_recurring_job(self):
+        job = Job('x', deadline=1000, every=60, misfire='skip')
+        self.assertEqual(plan_runs(job, now=1000 + MISFIRE_GRACE), (1, 1060 + MISFIRE_GRACE))
+
+    def test_misfire_policies(self):
+        # Three runs were due (at 1000, 1060 and 1120) by the time the daemon woke up at 1150.
+        for policy, runs in (('once', 1), ('all', 3), ('skip', 0)):
+            with self.subTest(policy=policy):
+                job = Job('x', deadline=1000, every=60, misfire=policy)
+                self.assertEqual(plan_runs(job, now=1150), (runs, 1180))
+
+
+class SchedulerDaemonTests(unittest.TestCase):
+    def test_client_without_daemon_raises(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(DaemonNotRunningError):
+                send_request({'op': 'ping'}, os.path.join(tmp_dir, 'missing.sock'))
+
+    def test_submit_list_cancel_and_run(self):
+        ran = threading.Event()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'schedcom.sock')
+            daemon = SchedulerDaemon(lambda job: ran.set(), JobQueue(), socket_path)
+            thread = threading.Thread(target=daemon.serve_forever)
+            thread.start()
+            try:
+                while not os.path.exists(socket_path):
+                    time.sleep(0.01)
+                pending = send_request({'op': 'submit', 'job': Job('later', deadline=1e12).to_dict()}, socket_path)
+                send_request({'op': 'submit', 'job': Job('now', deadline=0).to_dict()}, socket_path)
+                self.assertTrue(ran.wait(5))
+                jobs = send_request({'op': 'list'}, socket_path)['jobs']
+                self.assertEqual([job['command'] for job in jobs], ['later'])
+                self.assertTrue(send_request({'op': 'cancel', 'id': pending['job']['id']}, socket_path)['ok'])
+                self.assertFalse(send_request({'op': 'cancel', 'id': 'missing'}, socket_path)['ok'])
+            finally:
+                daemon.shutdown()
+                thread.join()
+
+    def test_submit_right_after_reading_the_deadline_wakes_the_timer(self):
+        ran = threading.Event()
+        queue = JobQueue()
+        daemon = SchedulerDaemon(lambda job: ran.set(), queue, 'unused.sock')
+        next_deadline = queue.next_deadline
+        submitters = []
+
+        def next_deadline_then_submit():
+            deadline = next_deadline()
+            if not submitters:
+                # Submit from another thread between reading the deadline and waiting for it.
+                request = {'op': 'submit', 'job': Job('now', 0).to_dict()}
+                submitter = threading.Thread(target=daemon.handle_request, args=(request,))
+                submitters.append(submitter)
+                submitter.start()
+                submitter.join(0.2)
+            return deadline
+
+        queue.next_deadline = next_deadline_then_submit
+        thread = threading.Thread(target=daemon._timer_loop)
+        thread.start()
+        try:
+            self.assertTrue(ran.wait(5))
+        finally:
+            daemon.shutdown()
+            thread.join()
+            submitters[0].join()
+
+    def test_job_runs_with_the_client_environment(self):
+        results = []
+        done = threading.Event()
+
+        def run(job: Job):
+            results.append(run_command(job.command, env=job.env, tee=False))
+            done.set()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, 'schedcom.sock')
+            queue = JobQueue(os.path.join(tmp_dir, 'queue.json'))
+            daemon = SchedulerDaemon(run, queue, socket_path)
+            thread = threading.Thread(target=daemon.serve_forever)
+            thread.start()
+            try:
+                while not os.path.exists(socket_path):
+                    time.sleep(0.01)
+                env = {**os.environ, 'MYVAR': 'from_client'}
+                send_request({'op': 'submit', 'job': Job('echo "MYVAR=$MYVAR"', 1e12, env=env).to_dict()}, socket_path)
+                self.assertEqual(JobQueue(queue.path).list()[0].env['MYVAR'], 'from_client')
+                self.assertEqual(os.stat(queue.path).st_mode & 0o777, 0o600)
+                send_request({'op': 'submit', 'job': Job('echo "MYVAR=$MYVAR"', 0, env=env).to_dict()}, socket_path)
+                self.assertTrue(done.wait(5))
+            finally:
+                daemon.shutdown()
+                thread.join()
+        self.assertEqual(results[0].stdout.text(), 'MYVAR=from_client\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from tools.exceptions import TelegramApiError
+from tools.spool import Spool, SpooledMessage, SpoolFlusher, coalesce
+
+
+def message(chat_id: str, text: str, message_id: str = None) -> SpooledMessage:
+    return SpooledMessage(chat_id, text, message_id or text, 0.0)
+
+
+class CoalesceTests(unittest.TestCase):
+    def test_joins_messages_per_chat_in_order(self):
+        batches = coalesce([message('a', 'one'), message('b', 'two'), message('a', 'three')])
+        self.assertEqual([(batch.chat_id, batch.text, batch.ids) for batch in batches], [
+            ('a', 'one\n\nthree', ['one', 'three']),
+            ('b', 'two', ['two']),
+        ])
+
+    def test_respects_the_length_limit(self):
+        messages = [message('a', 'x' * 6, '1'), message('a', 'y' * 6, '2'), message('a', 'z' * 20, '3'),
+                    message('a', 'w', '4')]
+        batches = coalesce(messages, limit=14)
+        self.assertEqual([batch.text for batch in batches], ['xxxxxx\n\nyyyyyy', 'z' * 20, 'w'])
+
+    def test_never_joins_documents(self):
+        messages = [message('a', 'one'), SpooledMessage('a', 'caption', 'doc', 0.0, '/tmp/log.txt'),
+                    message('a', 'two')]
+        batches = coalesce(messages)
+        self.assertEqual([(batch.text, batch.document) for batch in batches],
+                         [('one', None), ('caption', '/tmp/log.txt'), ('two', None)])
+
+
+class SpoolTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.spool = Spool(self.tmp_dir.name, fsync_interval=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_survives_reopening_and_acks(self):
+        first = self.spool.enqueue('first', '1')
+        self.spool.enqueue('second', '1')
+        self.spool.close()
+        reopened = Spool(self.tmp_dir.name)
+        self.assertEqual([m.text for m in reopened.pending()], ['first', 'second'])
+        reopened.ack([first])
+        self.assertEqual([m.text for m in reopened.pending()], ['second'])
+
+    def test_compacts_delivered_messages(self):
+        ids = [self.spool.enqueue(f'message {i}', '1') for i in range(3)]
+        self.spool.close()
+        self.spool.ack(ids[:2])
+        with patch('tools.spool.COMPACT_SIZE', 0):
+            self.spool.compact()
+        self.assertEqual([m.text for m in self.spool.pending()], ['message 2'])
+        with open(self.spool.path) as file:
+            self.assertEqual(len(file.readlines()), 1)
+
+    def test_flusher_coalesces_and_retries(self):
+        sent = []
+        failures = [TelegramApiError('Too Many Requests', 429, retry_after=0)]
+
+        def send(text, chat_id):
+            if failures:
+                raise failures.pop()
+            sent.append((chat_id, text))
+
+        for text in ('one', 'two', 'three'):
+            self.spool.enqueue(text, '1')
+        self.spool.close()
+        SpoolFlusher(self.spool, send, window=0).run(until_empty=True)
+        self.assertEqual(sent, [('1', 'one\n\ntwo\n\nthree')])
+        self.assertEqual(self.spool.pending(), [])
+
+    def test_flusher_drops_permanently_rejected_messages(self):
+        def send(text, chat_id):
+            raise TelegramApiError('Bad Request: chat not found', 400)
+
+        self.spool.enqueue('lost', '1')
+        self.spool.close()
+        with patch('builtins.print'):
+            SpoolFlusher(self.spool, send, window=0).run(until_empty=True)
+        self.assertEqual(self.spool.pending(), [])
+
+    def test_flusher_only_retries_the_unsent_parts(self):
+        sent = []
+        failures = [TelegramApiError('Internal Server Error', 500)]
+
+        def send(text, chat_id):
+            if text == 'two' and failures:
+                raise failures.pop()
+            sent.append(text)
+
+        self.spool.enqueue('one|two|three', '1')
+        self.spool.close()
+        flusher = SpoolFlusher(self.spool, send, split=lambda text: text.split('|'), window=0)
+        with patch('tools.spool.RETRY_BASE', 0), patch('builtins.print'):
+            self.assertEqual(flusher.flush_once(), 0.0)
+            self.assertEqual([m.parts_sent for m in Spool(self.tmp_dir.name).pending()], [1])
+            flusher.run(until_empty=True)
+        self.assertEqual(sent, ['one', 'two', 'three'])
+        self.assertEqual(self.spool.pending(), [])
+
+    def test_only_one_flusher_at_a_time(self):
+        flusher = SpoolFlusher(self.spool, lambda *_: None)
+        fd = flusher._try_lock()
+        self.assertIsNotNone(fd)
+        try:
+            self.assertIsNone(SpoolFlusher(self.spool, lambda *_: None)._try_lock())
+        finally:
+            os.close(fd)
+
+    def test_flusher_waits_for_another_flusher(self):
+        sent = []
+        self.spool.enqueue('hello', '1')
+        self.spool.close()
+        other = SpoolFlusher(self.spool, lambda *_: None)
+        fd = other._try_lock()
+        flusher = SpoolFlusher(self.spool, lambda text, chat_id: sent.append((chat_id, text)), window=0,
+                               poll_interval=0.01)
+        thread = threading.Thread(target=flusher.run)
+        thread.start()
+        try:
+            time.sleep(0.05)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(sent, [])
+            os.close(fd)
+            deadline = time.monotonic() + 5
+            while not sent and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(sent, [('1', 'hello')])
+        finally:
+            flusher.stop()
+            thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
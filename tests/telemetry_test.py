@@ -0,0 +1,116 @@
+import json
+import os
+import tempfile
+import unittest
+from multiprocessing import Process
+
+from tools.ckcyberbot import Bot
+from tools.exceptions import TelegramApiError
+from tools.fakebot import FakeBotApi
+from tools.spool import Spool, SpoolFlusher
+from tools.telemetry import MetricsFile, Telemetry
+
+
+def emit_finished(metrics_file: str, count: int):
+    telemetry = Telemetry(metrics_file=metrics_file)
+    for _ in range(count):
+        telemetry.emit('job_finished', command='make', status='succeeded', returncode=0, duration=2.0)
+
+
+class TelemetryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.event_log = os.path.join(self.tmp_dir.name, 'events.jsonl')
+        self.metrics_file = os.path.join(self.tmp_dir.name, 'ck.prom')
+        self.telemetry = Telemetry(self.event_log, self.metrics_file)
+        self.addCleanup(self.telemetry.close)
+
+    def events(self) -> list:
+        with open(self.event_log) as file:
+            return [json.loads(line) for line in file]
+
+    def metrics(self) -> str:
+        with open(self.metrics_file) as file:
+            return file.read()
+
+    def test_events_are_json_lines(self):
+        self.telemetry.emit('job_started', job_id='abc', command='make')
+        self.telemetry.emit('job_finished', job_id='abc', command='make', status='failed', returncode=2,
+                            duration=3.5)
+        events = self.events()
+        self.assertEqual([event['event'] for event in events], ['job_started', 'job_finished'])
+        self.assertEqual(events[1]['returncode'], 2)
+        self.assertEqual(events[1]['pid'], os.getpid())
+        self.assertEqual(os.stat(self.event_log).st_mode & 0o777, 0o600)
+
+    def test_job_metrics(self):
+        self.telemetry.emit('job_scheduled', command='make')
+        self.telemetry.emit('job_finished', command='make', status='succeeded', returncode=0, duration=3.0)
+        self.telemetry.emit('job_finished', command='make', status='failed', returncode=2, duration=100.0)
+        metrics = self.metrics()
+        self.assertIn('# TYPE ck_job_duration_seconds histogram', metrics)
+        self.assertIn('ck_jobs_scheduled_total 1', metrics)
+        self.assertIn('ck_job_runs_total{command="make",status="failed"} 1', metrics)
+        self.assertIn('ck_job_duration_seconds_bucket{command="make",le="5"} 1', metrics)
+        self.assertIn('ck_job_duration_seconds_bucket{command="make",le="300"} 2', metrics)
+        self.assertIn('ck_job_duration_seconds_bucket{command="make",le="+Inf"} 2', metrics)
+        self.assertIn('ck_job_duration_seconds_sum{command="make"} 103.0', metrics)
+        self.assertIn('ck_job_last_exit_code{command="make"} 2', metrics)
+        self.assertIn('ck_job_last_success_timestamp_seconds{command="make"}', metrics)
+        self.assertFalse(os.path.exists(f'{self.metrics_file}.tmp'))
+
+    def test_labels_are_escaped(self):
+        self.telemetry.emit('job_finished', command='echo "a\\b"\nc', status='succeeded', returncode=0,
+                            duration=1.0)
+        self.assertIn('ck_job_last_exit_code{command="echo \\"a\\\\b\\"\\nc"} 0', self.metrics())
+
+    def test_processes_share_the_metrics(self):
+        processes = [Process(target=emit_finished, args=(self.metrics_file, 20)) for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertIn('ck_job_runs_total{command="make",status="succeeded"} 80', self.metrics())
+
+    def test_bot_reports_api_calls(self):
+        with FakeBotApi() as api, Bot('token', '42', base_url=api.url, on_call=self.telemetry.api_call) as bot:
+            bot.get_me()
+            with self.assertRaises(TelegramApiError):
+                bot.call('sendMessage', {'text': 'no chat'})
+        calls = [(event['method'], event['status']) for event in self.events() if event['event'] == 'api_call']
+        self.assertEqual(calls, [('getMe', 200), ('sendMessage', 400)])
+        self.assertIn('ck_bot_requests_total{method="sendMessage",status="400"} 1', self.metrics())
+
+    def test_flusher_reports_deliveries(self):
+        failures = [TelegramApiError('Too Many Requests', 429, retry_after=0)]
+
+        def send(*_):
+            if failures:
+                raise failures.pop()
+
+        spool = Spool(os.path.join(self.tmp_dir.name, 'spool'))
+        spool.enqueue('one', '1')
+        spool.enqueue('two', '1')
+        spool.close()
+        SpoolFlusher(spool, send, window=0, emit=self.telemetry.emit).run(until_empty=True)
+        self.assertEqual([event['event'] for event in self.events()], ['notification_failed', 'notification_sent'])
+        metrics = self.metrics()
+        self.assertIn('ck_notifications_total{result="sent"} 2', metrics)
+        self.assertIn('ck_notification_retries_total 2', metrics)
+        self.assertIn('ck_notification_delivery_seconds_count 1', metrics)
+
+    def test_state_survives_a_new_writer(self):
+        MetricsFile(self.metrics_file).update([('ck_jobs_scheduled_total', {}, 1)])
+        MetricsFile(self.metrics_file).update([('ck_jobs_scheduled_total', {}, 1)])
+        self.assertIn('ck_jobs_scheduled_total 2', self.metrics())
+
+    def test_from_env(self):
+        self.assertIsNone(Telemetry.from_env({}))
+        telemetry = Telemetry.from_env({'CK_METRICS_FILE': self.metrics_file})
+        self.assertIsNone(telemetry.event_log)
+        self.assertIsNotNone(telemetry.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.updates import UpdatePoller
+
+
+class FakeBot:
+    chat_id = '42'
+
+    def __init__(self, updates):
+        self.updates = updates
+        self.sent = []
+        self.offsets = []
+
+    def get_updates(self, allowed_updates=None, timeout=0, offset=0):
+        self.offsets.append(offset)
+        return {'ok': True, 'result': [update for update in self.updates if update['update_id'] >= offset]}
+
+    def send_message(self, text, chat_id=None):
+        self.sent.append((chat_id, text))
+
+
+def update(update_id: int, text: str, chat_id: int = 42) -> dict:
+    return {'update_id': update_id, 'message': {'text': text, 'chat': {'id': chat_id}}}
+
+
+class UpdatePollerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.offset_path = os.path.join(self.tmp_dir.name, 'offset.json')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def poll(self, bot: FakeBot) -> UpdatePoller:
+        poller = UpdatePoller(bot, self.offset_path)
+
+        @poller.command('echo')
+        def echo(_bot, _message, args):
+            return ' '.join(args)
+
+        with ThreadPoolExecutor() as pool:
+            poller.poll_once(pool)
+        return poller
+
+    def test_dispatches_commands_and_replies(self):
+        bot = FakeBot([update(1, '/echo hello world'), update(2, '/echo@CkBot hi'), update(3, 'no command')])
+        self.poll(bot)
+        self.assertEqual(sorted(bot.sent), [('42', 'hello world'), ('42', 'hi')])
+
+    def test_ignores_other_chats(self):
+        bot = FakeBot([update(1, '/echo hi', chat_id=666)])
+        self.poll(bot)
+        self.assertEqual(bot.sent, [])
+
+    def test_unknown_command(self):
+        bot = FakeBot([update(1, '/nope')])
+        self.poll(bot)
+        self.assertEqual(bot.sent, [('42', 'Unknown command "/nope". Try /echo.')])
+
+    def test_persists_the_offset(self):
+        bot = FakeBot([update(7, '/echo once')])
+        self.poll(bot)
+        self.poll(bot)
+        self.assertEqual(bot.offsets, [0, 8])
+        self.assertEqual(bot.sent, [('42', 'once')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 import os
+import tempfile
 import unittest
 from unittest.mock import patch, mock_open, MagicMock
 from typing import cast
 
-from tools.utils import yes_or_no, load_env_file, using_dir
+from tools import utils
+from tools.utils import yes_or_no, load_env_file, update_env_file, using_dir
 
 
 class ExpectedTestError(Exception):
@@ -145,6 +147,12 @@ class TestLoadEnvFile(unittest.TestCase):
         'TELEGRAM_CHAT_ID': '0123456789'
     }
 
+    def setUp(self):
+        # The cache is keyed by the real file's `os.stat()`, which `mock_open` doesn't patch: a `.env` in the
+        # working directory would otherwise serve one test's contents to the next.
+        utils._env_cache.clear()
+        self.addCleanup(utils._env_cache.clear)
+
     @patch('builtins.open', new_callable=mock_open, read_data=valid_env_str_data)
     def test_loads_env_data(self, _: MagicMock):
         self.assertEqual(load_env_file('.env'), self.valid_env_dict_data)
@@ -161,6 +169,89 @@ class TestLoadEnvFile(unittest.TestCase):
     def test_ignores_whitespace_line(self, _: MagicMock):
         self.assertEqual(load_env_file('.env'), self.valid_env_dict_data)
 
+    @patch('builtins.open', new_callable=mock_open, read_data=(
+        'export A=1\n'
+        'B = two words # comment\n'
+        'C="quoted # not a comment"\n'
+        "D='single \\n literal'\n"
+        'E="line one\n'
+        'line two\\n"\n'
+        'URL=https://example.com/#fragment\n'
+        'EMPTY= # comment\n'
+        'HASH=#not a comment\n'
+    ))
+    def test_parses_quotes_export_and_multiline_values(self, _: MagicMock):
+        self.assertEqual(load_env_file('.env'), {
+            'A': '1',
+            'B': 'two words',
+            'C': 'quoted # not a comment',
+            'D': 'single \\n literal',
+            'E': 'line one\nline two\n',
+            'URL': 'https://example.com/#fragment',
+            'EMPTY': '',
+            'HASH': '#not a comment',
+        })
+
+    def test_caches_until_the_file_changes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, '.env')
+            with open(path, 'w') as file:
+                file.write('A=1\n')
+            self.assertEqual(load_env_file(path), {'A': '1'})
+            with patch('builtins.open', side_effect=AssertionError('read again')):
+                self.assertEqual(load_env_file(path), {'A': '1'})
+            with open(path, 'w') as file:
+                file.write('A=22\n')
+            self.assertEqual(load_env_file(path), {'A': '22'})
+
+    @patch('builtins.open', new_callable=mock_open, read_data='A="never closed\nB=1\n')
+    def test_raises_on_unterminated_quote(self, _: MagicMock):
+        with self.assertRaises(ValueError):
+            load_env_file('.env')
+
+
+class UpdateEnvFileTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, '.env')
+
+    def write(self, text: str):
+        with open(self.path, 'w') as file:
+            file.write(text)
+
+    def read(self) -> str:
+        with open(self.path) as file:
+            return file.read()
+
+    def test_replaces_only_the_given_key(self):
+        self.write('# Telegram\nTELEGRAM_TOKEN=123:abc\nTELEGRAM_CHAT_ID=111\nPORT=8080\n')
+        update_env_file(self.path, {'TELEGRAM_CHAT_ID': '222'})
+        self.assertEqual(self.read(), '# Telegram\nTELEGRAM_TOKEN=123:abc\nTELEGRAM_CHAT_ID=222\nPORT=8080\n')
+
+    def test_appends_new_keys_and_creates_the_file(self):
+        update_env_file(self.path, {'A': '1'})
+        update_env_file(self.path, {'B': 'two words'})
+        self.assertEqual(self.read(), 'A=1\nB="two words"\n')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(load_env_file(self.path), {'A': '1', 'B': 'two words'})
+
+    def test_replaces_multiline_values(self):
+        self.write('export KEY="one\ntwo"\nOTHER=1\n')
+        update_env_file(self.path, {'KEY': 'new'})
+        self.assertEqual(self.read(), 'export KEY=new\nOTHER=1\n')
+
+    def test_load_sees_updates(self):
+        self.write('A=1\n')
+        self.assertEqual(load_env_file(self.path), {'A': '1'})
+        update_env_file(self.path, {'A': '2'})
+        self.assertEqual(load_env_file(self.path), {'A': '2'})
+
+    def test_cached_result_is_a_copy(self):
+        self.write('A=1\n')
+        load_env_file(self.path)['A'] = 'changed'
+        self.assertEqual(load_env_file(self.path), {'A': '1'})
+
 
 class UsingDirTests(unittest.TestCase):
     # If you make `test_` methods static, they won't work.
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from tools.exceptions import WatchError
+from tools.watch import Watcher
+
+
+def later(delay: float, action):
+    timer = threading.Timer(delay, action)
+    timer.start()
+    return timer
+
+
+def touch(path: str):
+    with open(path, 'a'):
+        pass
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'needs inotify')
+class WatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+        os.makedirs(os.path.join(self.root, 'a', 'b'))
+        os.makedirs(os.path.join(self.root, '.git'))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, *names: str) -> str:
+        return os.path.join(self.root, *names)
+
+    def test_watches_recursively_and_debounces(self):
+        with Watcher([self.root]) as watcher:
+            # The root, a and a/b, but not .git.
+            self.assertEqual(watcher.watch_count, 3)
+
+            def changes():
+                touch(self.path('a', 'b', 'one'))
+                time.sleep(0.05)
+                touch(self.path('two'))
+
+            later(0.05, changes)
+            self.assertEqual(watcher.wait(debounce=0.2), [self.path('a', 'b', 'one'), self.path('two')])
+            self.assertEqual(watcher.wait(debounce=0.2, timeout=0.1), [])
+
+    def test_watches_new_directories(self):
+        with Watcher([self.root]) as watcher:
+            later(0, lambda: os.mkdir(self.path('new')))
+            self.assertEqual(watcher.wait(debounce=0.1), [self.path('new')])
+            later(0, lambda: touch(self.path('new', 'file')))
+            self.assertEqual(watcher.wait(debounce=0.1), [self.path('new', 'file')])
+
+    def test_ignores(self):
+        with Watcher([self.root], ignore=[self.path('run.log')]) as watcher:
+            touch(self.path('run.log'))
+            touch(self.path('.git', 'index'))
+            self.assertEqual(watcher.wait(debounce=0.1, timeout=0.2), [])
+
+    def test_watches_files_through_their_directory(self):
+        touch(self.path('watched'))
+        with Watcher([self.path('watched')]) as watcher:
+            touch(self.path('other'))
+            self.assertEqual(watcher.wait(debounce=0.1, timeout=0.2), [])
+            # Like an editor that writes a new file and renames it over the old one.
+            touch(self.path('watched.tmp'))
+            os.replace(self.path('watched.tmp'), self.path('watched'))
+            self.assertEqual(watcher.wait(debounce=0.1), [self.path('watched')])
+
+    def test_missing_path(self):
+        with self.assertRaises(WatchError):
+            Watcher([self.path('missing')])
+
+
+if __name__ == '__main__':
+    unittest.main()
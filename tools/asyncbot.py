@@ -0,0 +1,272 @@
+import asyncio
+import json
+import random
+import ssl
+import time
+from typing import Dict, Iterable, List, Tuple, Union
+from urllib.parse import urlsplit
+
+from tools.ckcyberbot import API_URL
+from tools.exceptions import ChatIdMissingError, TelegramApiError
+
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+GLOBAL_RATE = 30.0
+PER_CHAT_RATE = 1.0
+
+# Backoff for connection errors and 5xx responses: BACKOFF_BASE * 2 ** attempt, capped, with full jitter.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+
+class TokenBucket:
+    """Allow `rate` acquisitions per second on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float):
+        """Don't hand out any tokens for `seconds`, e.g. after a "429 Too Many Requests"."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Tokens only accrue again from the end of the pause, so it doesn't end with a burst.
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        # Waiters are served one at a time, in order, so nobody starves.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _Connection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one host for asyncio, at most `size` of them open at once."""
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 30.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'unsupported URL scheme "{parts.scheme}"')
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.netloc = parts.netloc
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.timeout = timeout
+        self._idle: List[_Connection] = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _checkout(self) -> Tuple[_Connection, bool]:
+        while self._idle:
+            connection = self._idle.pop()
+            # An idle connection that already saw EOF was closed by the server.
+            if not connection.reader.at_eof():
+                return connection, True
+            connection.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        return _Connection(reader, writer), False
+
+    async def _exchange(self, connection: _Connection, request: bytes) -> Tuple[int, bytes, bool]:
+        connection.writer.write(request)
+        await connection.writer.drain()
+        status_line = await connection.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('the server closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await connection.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await connection.reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await connection.reader.readline()
+                    break
+                body += await connection.reader.readexactly(size)
+                await connection.reader.readline()
+            body = bytes(body)
+        elif 'content-length' in headers:
+            body = await connection.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await connection.reader.read()
+            headers['connection'] = 'close'
+        keep_alive = headers.get('connection', '').lower() != 'close'
+        return status, body, keep_alive
+
+    async def request(self, method: str, path: str, body: bytes = b'', content_type: str = 'application/json') \
+            -> Tuple[int, bytes]:
+        """Send a request and return the status code and body of the response."""
+        request = (
+            f'{method} {path} HTTP/1.1\r\n'
+            f'Host: {self.netloc}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            '\r\n'
+        ).encode('latin-1') + body
+        async with self._slots:
+            connection, reused = await self._checkout()
+            try:
+                try:
+                    status, data, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, request), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not reused:
+                        raise
+                    # A stale keep-alive connection: retry once on a fresh one.
+                    connection.close()
+                    connection, _ = await self._checkout()
+                    status, data, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, request), self.timeout
+                    )
+            except BaseException:
+                connection.close()
+                raise
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection.close()
+            return status, data
+
+    async def close(self):
+        while self._idle:
+            connection = self._idle.pop()
+            connection.close()
+            try:
+                await connection.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+class AsyncBot:
+    """An asyncio counterpart to `tools.ckcyberbot.Bot` for sending to many chats concurrently.
+
+    Every message waits for a token from a global bucket and from its chat's bucket, so Telegram's flood limits
+    are respected up front. A "429 Too Many Requests" pauses the chat for `retry_after` seconds plus some jitter
+    before the message is retried. Connection errors and 5xx responses are retried with exponential backoff.
+    """
+
+    def __init__(
+            self,
+            token: str,
+            chat_id: str = None,
+            base_url: str = API_URL,
+            global_rate: float = GLOBAL_RATE,
+            per_chat_rate: float = PER_CHAT_RATE,
+            max_connections: int = 8,
+            max_retries: int = 5,
+    ):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url.rstrip('/')
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self._pool = AsyncConnectionPool(self.base_url, max_connections)
+        self._path_prefix = urlsplit(self.base_url).path
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def close(self):
+        await self._pool.close()
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    async def call(self, method_str: str, post_data: dict = None, chat_id: str = None) -> dict:
+        """Call a Bot API method, waiting for the rate limits and retrying as described in the class docstring.
+
+        Raises `TelegramApiError` if the API still answers with an error after `max_retries` retries.
+        """
+        path = f'{self._path_prefix}/bot{self.token}/{method_str}'
+        body = json.dumps(post_data or {}).encode()
+        attempt = 0
+        while True:
+            # The chat's token first: waiting for it while holding a global token would leave that token
+            # unused, and let the global ones pile up into a burst.
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self._global_bucket.acquire()
+            try:
+                status, data = await self._pool.request('POST', path, body)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if attempt >= self.max_retries:
+                    raise TelegramApiError(f'{method_str}: {e!r}') from e
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+                attempt += 1
+                continue
+            try:
+                response = json.loads(data)
+            except ValueError:
+                response = {'ok': False, 'error_code': status, 'description': f'HTTP {status} with a non-JSON body'}
+            if response.get('ok'):
+                return response
+            error = TelegramApiError(
+                f'{method_str}: {response.get("description", f"HTTP {status}")}',
+                response.get('error_code', status),
+                response.get('parameters', {}).get('retry_after'),
+            )
+            if attempt >= self.max_retries or not (error.retry_after or status >= 500):
+                raise error
+            if error.retry_after:
+                # Jitter keeps every throttled message from retrying at the same instant.
+                delay = error.retry_after + random.uniform(0, 1)
+                (self._chat_bucket(chat_id) if chat_id is not None else self._global_bucket).pause(delay)
+            else:
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
+
+    async def get_me(self) -> dict:
+        return await self.call('getMe')
+
+    async def send_message(self, text: str, chat_id: str = None) -> dict:
+        chat_id = chat_id or self.chat_id
+        if not chat_id:
+            raise ChatIdMissingError
+        return await self.call('sendMessage', {'chat_id': chat_id, 'text': text}, chat_id=str(chat_id))
+
+    async def send_to_many(self, text: str, chat_ids: Iterable[str]) -> Dict[str, Union[dict, Exception]]:
+        """Send `text` to every chat concurrently. Return each chat's response, or the exception it failed with."""
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(
+            *(self.send_message(text, chat_id) for chat_id in chat_ids),
+            return_exceptions=True,
+        )
+        return dict(zip(chat_ids, results))
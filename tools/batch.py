@@ -0,0 +1,245 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from tools.exceptions import JobFileError
+from tools.runner import DEFAULT_OUTPUT_LIMIT, Limits, RunResult, run_command
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+@dataclass
+class BatchJob:
+    name: str
+    command: str
+    cwd: Optional[str] = None
+    env: Dict[str, str] = field(default_factory=dict)
+    depends_on: List[str] = field(default_factory=list)
+    log: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    job: BatchJob
+    status: str
+    result: Optional[RunResult] = None
+    duration: float = 0.0
+    # For skipped jobs: the dependency that failed or was skipped itself.
+    blocked_by: Optional[str] = None
+
+
+def load_jobs(path: str) -> List[BatchJob]:
+    """Load the jobs of a `.toml` or `.json` job file.
+
+    Both formats hold a list of tables/objects under `jobs`, each with a `command` and optionally a `name`,
+    `cwd`, `env`, `depends_on` and `log`. Relative `cwd` and `log` paths are relative to the job file.
+    """
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise JobFileError('TOML job files require Python 3.11 or newer. Use a JSON job file instead.')
+        with open(path, 'rb') as file:
+            try:
+                data = tomllib.load(file)
+            except tomllib.TOMLDecodeError as e:
+                raise JobFileError(f'"{path}" is not valid TOML: {e}') from e
+    else:
+        with open(path) as file:
+            try:
+                data = json.load(file)
+            except json.JSONDecodeError as e:
+                raise JobFileError(f'"{path}" is not valid JSON: {e}') from e
+
+    entries = data.get('jobs') if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        raise JobFileError(f'"{path}" must contain a non-empty list of `jobs`')
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or 'command' not in entry:
+            raise JobFileError(f'job #{index + 1} in "{path}" has no `command`')
+        unknown = set(entry) - set(BatchJob.__dataclass_fields__)
+        if unknown:
+            raise JobFileError(f'job #{index + 1} in "{path}" has unknown keys: {", ".join(sorted(unknown))}')
+        job = BatchJob(**{'name': str(index + 1), **entry})
+        check_fields(job, f'job "{job.name}" in "{path}"')
+        job.env = {key: str(value) for key, value in job.env.items()}
+        if job.cwd:
+            job.cwd = os.path.join(base_dir, os.path.expanduser(job.cwd))
+        if job.log:
+            job.log = os.path.join(base_dir, os.path.expanduser(job.log))
+        jobs.append(job)
+
+    check_dependencies(jobs)
+    return jobs
+
+
+def check_fields(job: BatchJob, description: str):
+    """Raise `JobFileError` if a field of a job loaded from a file has the wrong type."""
+    for name in ('name', 'command', 'cwd', 'log'):
+        value = getattr(job, name)
+        if value is not None and not isinstance(value, str):
+            raise JobFileError(f'{description}: `{name}` must be a string')
+    if not isinstance(job.depends_on, list) or not all(isinstance(name, str) for name in job.depends_on):
+        raise JobFileError(f'{description}: `depends_on` must be a list of job names')
+    # Numbers are fine too, e.g. `env = { JOBS = 4 }` in TOML. They are passed on as strings.
+    if not isinstance(job.env, dict) or not all(
+            isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in job.env.values()
+    ):
+        raise JobFileError(f'{description}: `env` must be a table of strings')
+
+
+def check_dependencies(jobs: List[BatchJob]):
+    """Raise `JobFileError` if job names are duplicated, a dependency doesn't exist or there is a cycle."""
+    names = {}
+    for job in jobs:
+        if job.name in names:
+            raise JobFileError(f'more than one job is named "{job.name}"')
+        names[job.name] = job
+    for job in jobs:
+        for dependency in job.depends_on:
+            if dependency not in names:
+                raise JobFileError(f'job "{job.name}" depends on "{dependency}", which doesn\'t exist')
+
+    # Kahn's algorithm: if some jobs never become ready, they are part of a cycle.
+    remaining = {job.name: len(set(job.depends_on)) for job in jobs}
+    dependents = _dependents(jobs)
+    ready = [name for name, count in remaining.items() if not count]
+    while ready:
+        name = ready.pop()
+        del remaining[name]
+        for dependent in dependents[name]:
+            remaining[dependent] -= 1
+            if not remaining[dependent]:
+                ready.append(dependent)
+    if remaining:
+        raise JobFileError(f'dependency cycle between jobs: {", ".join(sorted(remaining))}')
+
+
+def _dependents(jobs: List[BatchJob]) -> Dict[str, List[str]]:
+    dependents: Dict[str, List[str]] = {job.name: [] for job in jobs}
+    for job in jobs:
+        for dependency in set(job.depends_on):
+            dependents[dependency].append(job.name)
+    return dependents
+
+
+def run_job(
+        job: BatchJob,
+        output_limit: int = DEFAULT_OUTPUT_LIMIT,
+        limits: Limits = None,
+        outputs: List[BinaryIO] = None,
+) -> RunResult:
+    """Run one batch job. The working directory and environment are passed to the child process only,
+    because `os.chdir()` and `os.environ` are shared by every worker thread."""
+    env = {**os.environ, **job.env} if job.env else None
+    return run_command(
+        job.command,
+        cwd=job.cwd,
+        env=env,
+        tee=False,
+        log_path=job.log,
+        output_limit=output_limit,
+        limits=limits,
+        outputs=outputs,
+    )
+
+
+def run_batch(
+        jobs: List[BatchJob],
+        max_parallel: int = None,
+        runner: Callable[[BatchJob], RunResult] = run_job,
+        on_done: Callable[[BatchResult], None] = None,
+) -> List[BatchResult]:
+    """Run `jobs` on a pool of at most `max_parallel` workers, each as soon as all of its dependencies succeeded.
+
+    Jobs whose dependencies failed or were skipped are skipped too. The results are returned in the order of `jobs`.
+    """
+    check_dependencies(jobs)
+    by_name = {job.name: job for job in jobs}
+    dependents = _dependents(jobs)
+    waiting_on = {job.name: len(set(job.depends_on)) for job in jobs}
+    results: Dict[str, BatchResult] = {}
+
+    def finish(batch_result: BatchResult):
+        results[batch_result.job.name] = batch_result
+        if on_done:
+            on_done(batch_result)
+
+    def timed_run(job: BatchJob) -> BatchResult:
+        start = time.monotonic()
+        result = runner(job)
+        status = FAILED if result.returncode else SUCCEEDED
+        return BatchResult(job, status, result, time.monotonic() - start)
+
+    def skip_dependents(name: str):
+        # Iterative, so that long dependency chains can't hit the recursion limit.
+        stack = [name]
+        while stack:
+            blocker = stack.pop()
+            for dependent in dependents[blocker]:
+                if dependent not in results:
+                    finish(BatchResult(by_name[dependent], SKIPPED, blocked_by=blocker))
+                    stack.append(dependent)
+
+    with ThreadPoolExecutor(max_workers=max_parallel or os.cpu_count()) as pool:
+        running: Dict[Future, str] = {}
+
+        def submit_ready(names: List[str]):
+            for name in names:
+                if not waiting_on[name] and name not in results:
+                    running[pool.submit(timed_run, by_name[name])] = name
+
+        submit_ready([job.name for job in jobs])
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    batch_result = future.result()
+                except OSError as e:
+                    print(f'Error: job "{name}" could not be started: {e}')
+                    batch_result = BatchResult(by_name[name], FAILED)
+                finish(batch_result)
+                if batch_result.status == SUCCEEDED:
+                    for dependent in dependents[name]:
+                        waiting_on[dependent] -= 1
+                    submit_ready(dependents[name])
+                else:
+                    skip_dependents(name)
+
+    return [results[job.name] for job in jobs]
+
+
+def summarize(results: List[BatchResult], title: str) -> str:
+    """Describe a finished batch in one message: a count per status, then one line per job."""
+    counts = {status: 0 for status in (SUCCEEDED, FAILED, SKIPPED)}
+    for batch_result in results:
+        counts[batch_result.status] += 1
+    lines = [f'{title}: ' + ', '.join(f'{count} {status}' for status, count in counts.items() if count)]
+    for batch_result in results:
+        job = batch_result.job
+        if batch_result.status == SUCCEEDED:
+            lines.append(f'✔ {job.name} ({batch_result.duration:.1f} s)')
+        elif batch_result.status == FAILED:
+            exit_status = f'exit {batch_result.result.returncode}' if batch_result.result else 'not started'
+            if batch_result.result and batch_result.result.cause:
+                exit_status += f', {batch_result.result.cause}'
+            lines.append(f'✘ {job.name} ({exit_status}, {batch_result.duration:.1f} s)')
+            stderr = batch_result.result.stderr.text().strip() if batch_result.result else ''
+            if stderr:
+                lines.append('    ' + stderr.replace('\n', '\n    '))
+        else:
+            lines.append(f'- {job.name} (skipped because "{batch_result.blocked_by}" did not succeed)')
+    return '\n'.join(lines)
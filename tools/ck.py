@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+
+if not __package__:
+    # Run as a script, e.g. through the `tools/ck` symlink: make the `tools` package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+
+# Subcommand -> (module, description). A module is only imported once its subcommand is run, so every
+# subcommand pays for its own imports only, and `ck --help` for none of them.
+SUBCOMMANDS = {
+    'path': ('tools.prettypath', 'print, search and analyze the PATH variable (`prettypath`)'),
+    'sched': ('tools.schedcom', 'schedule a command and/or get notified when it finishes (`schedcom`)'),
+    'bot': ('tools.ckcyberbot', 'set up the Telegram bot that sends the notifications'),
+}
+
+USAGE = 'usage: ck [-h] {' + ','.join(SUBCOMMANDS) + '} ...'
+
+
+def print_help():
+    print(USAGE)
+    print('\nCK-CLI Tools\n\nsubcommands:')
+    for name, (_, description) in SUBCOMMANDS.items():
+        print(f'  {name:<8}{description}')
+    print('\nRun `ck SUBCOMMAND --help` for the options of a subcommand.')
+
+
+# Annotated with `list` rather than `typing.List`: `typing` alone would double the time `ck --help` takes.
+def main(argv: list = None) -> int:
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h', '--help'):
+        print_help()
+        return 0 if argv else 2
+    name, *args = argv
+    if name not in SUBCOMMANDS:
+        print(f'{USAGE}\nck: error: unknown subcommand "{name}"', file=sys.stderr)
+        return 2
+
+    # argparse names the program after `sys.argv[0]`, so that the subcommand's usage reads "ck sched ...".
+    sys.argv = [f'ck {name}', *args]
+    # Unlike `importlib.import_module()`, `__import__()` shows up in `python -X importtime`.
+    module = __import__(SUBCOMMANDS[name][0], fromlist=['main'])
+    return module.main(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
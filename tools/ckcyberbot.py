@@ -1,33 +1,231 @@
 #!/usr/bin/env python3
 
 import json
-from urllib.request import urlopen, Request
 import argparse
-from typing import Dict, List
+import http.client
+import io
+import itertools
+import queue
+import secrets
+import select
+import stat
+import threading
+import time
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from secrets import randbelow
-from http.client import HTTPResponse
-import re
+from urllib.parse import urlsplit
 import os
+import sys
 
-from tools.utils import load_env_file, yes_or_no
-from tools.exceptions import ChatIdMissingError
+if not __package__:
+    # Run as a script: make the `tools` package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from tools.utils import load_env_file, update_env_file, yes_or_no
+from tools.exceptions import ChatIdMissingError, TelegramApiError
 
 
 # Telegram Bot API Documentation
 # https://core.telegram.org/bots/api
 
+API_URL = 'https://api.telegram.org'
+
+# https://core.telegram.org/bots/api#sendmessage
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+# `send_long_message()` sends longer texts as a file instead of as many messages.
+DOCUMENT_THRESHOLD = 4 * MAX_MESSAGE_LENGTH
+# With `compress=None`, `send_document()` gzips files larger than this.
+COMPRESS_THRESHOLD = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_TIMEOUT = 300.0
+# Requests that may be sent again when it's unknown whether the server processed them.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ConnectionPool:
+    """A thread-safe pool of keep-alive HTTP(S) connections to a single host.
+
+    At most `size` connections are open at once. `connection()` blocks until one is free, reusing the most
+    recently returned connection first, so a single-threaded caller always gets the same one.
+    """
+
+    def __init__(self, url: str, size: int = 4, timeout: float = 30.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'unsupported URL scheme "{parts.scheme}"')
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self._idle: 'queue.LifoQueue[http.client.HTTPConnection]' = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return connection_class(self.netloc, timeout=self.timeout)
+
+    @staticmethod
+    def _is_stale(connection: http.client.HTTPConnection) -> bool:
+        # An idle keep-alive socket only becomes readable when the server has closed it.
+        if connection.sock is None:
+            return False
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+        return bool(readable)
+
+    @contextmanager
+    def connection(self) -> Iterator[http.client.HTTPConnection]:
+        self._slots.acquire()
+        connection = None
+        try:
+            try:
+                connection = self._idle.get_nowait()
+                if self._is_stale(connection):
+                    connection.close()
+            except queue.Empty:
+                connection = self._new_connection()
+            yield connection
+        except BaseException:
+            # The state of the connection is unknown, so don't hand it out again.
+            if connection:
+                connection.close()
+            connection = None
+            raise
+        finally:
+            if connection:
+                self._idle.put(connection)
+            self._slots.release()
+
+    def request(
+            self,
+            method: str,
+            path: str,
+            body: Union[bytes, Iterable[bytes]] = None,
+            headers: Dict[str, str] = None,
+            timeout: float = None,
+    ) -> Tuple[int, bytes]:
+        """Send a request and return the status code and body of the response.
+
+        `body` may be an iterable of chunks, which are streamed. Without a Content-Length header, they are sent
+        with chunked transfer encoding.
+        """
+        with self.connection() as connection:
+            connection.timeout = timeout or self.timeout
+            if connection.sock:
+                connection.sock.settimeout(connection.timeout)
+            # A connection from the pool may still have been closed by the server in the meantime, so a request
+            # that fails on a reused connection is retried once on a fresh one. A streamed body can't be sent twice.
+            # If the request went out completely, the server may have processed it before hanging up, so only an
+            # idempotent request is retried then: sending a message again could send it twice.
+            reused = connection.sock is not None
+            replayable = body is None or isinstance(body, bytes)
+            try:
+                connection.request(method, path, body, headers or {})
+            except (ConnectionResetError, BrokenPipeError):
+                if not reused or not replayable:
+                    raise
+                connection.close()
+                connection.request(method, path, body, headers or {})
+                reused = False
+            try:
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError):
+                if not reused or not replayable or method not in IDEMPOTENT_METHODS:
+                    raise
+                connection.close()
+                connection.request(method, path, body, headers or {})
+                response = connection.getresponse()
+            data = response.read()
+            if response.will_close:
+                connection.close()
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
 
 class Bot:
-    def __init__(self, token: str, chat_id: str = None):
+    def __init__(
+            self,
+            token: str,
+            chat_id: str = None,
+            base_url: str = API_URL,
+            pool_size: int = 4,
+            on_call: Callable[[str, Optional[int], float], None] = None,
+    ):
+        """`on_call(method, status, duration)` is called after every request, with the HTTP status, or None if
+        there was no response, and the duration in seconds."""
         self.token = token
         self.chat_id = chat_id
+        self.base_url = base_url.rstrip('/')
+        self.on_call = on_call
+        self._pool = ConnectionPool(self.base_url, pool_size)
+        self._path_prefix = urlsplit(self.base_url).path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Close the idle connections to the Bot API."""
+        self._pool.close()
 
     def get_url(self, method_str: str) -> str:
-        return f'https://api.telegram.org/bot{self.token}/{method_str}'
+        return f'{self.base_url}/bot{self.token}/{method_str}'
+
+    def call(
+            self,
+            method_str: str,
+            post_data: dict = None,
+            timeout: float = None,
+            body: Iterable[bytes] = None,
+            headers: Dict[str, str] = None,
+    ) -> dict:
+        """Call a Bot API method over a pooled keep-alive connection and return the decoded response.
+
+        The parameters are sent as JSON `post_data`, or as a raw `body` with its `headers`, e.g. for uploads.
+        Raises `TelegramApiError` if the API answers with an error.
+        """
+        path = f'{self._path_prefix}/bot{self.token}/{method_str}'
+        status = None
+        start = time.monotonic()
+        try:
+            if body is not None:
+                status, data = self._pool.request('POST', path, body, headers, timeout=timeout)
+            elif post_data is None:
+                status, data = self._pool.request('GET', path, timeout=timeout)
+            else:
+                status, data = self._pool.request(
+                    'POST',
+                    path,
+                    json.dumps(post_data).encode(),
+                    {'Content-Type': 'application/json'},
+                    timeout=timeout,
+                )
+        finally:
+            if self.on_call:
+                self.on_call(method_str, status, time.monotonic() - start)
+        try:
+            response = json.loads(data)
+        except ValueError:
+            raise TelegramApiError(f'{method_str}: HTTP {status} with a non-JSON body', status) from None
+        if not response.get('ok'):
+            raise TelegramApiError(
+                f'{method_str}: {response.get("description", f"HTTP {status}")}',
+                response.get('error_code', status),
+                response.get('parameters', {}).get('retry_after'),
+            )
+        return response
 
     def get_me(self) -> dict:
-        with urlopen(self.get_url('getMe')) as response:
-            return json.load(response)
+        return self.call('getMe')
 
     def get_updates(
             self,
@@ -46,41 +244,147 @@ class Bot:
             'offset': offset,
         }
 
-        post_data_encoded = json.dumps(post_data).encode('ascii')
-
-        request = Request(
-            self.get_url('getUpdates'),
-            post_data_encoded,
-            {'Content-Type': 'application/json'},
-        )
+        # Long polling keeps the request open for up to `timeout` seconds, so the socket has to wait longer.
+        return self.call('getUpdates', post_data, timeout=self._pool.timeout + timeout)
 
-        with urlopen(request) as response:
-            return json.load(response)
-
-    def send_message(self, text: str) -> HTTPResponse:
-        if not self.chat_id:
+    def send_message(self, text: str, chat_id: str = None) -> dict:
+        """Send `text` to `chat_id`, or to `Bot.chat_id` by default."""
+        chat_id = chat_id or self.chat_id
+        if not chat_id:
             raise ChatIdMissingError
 
         post_data = {
-            'chat_id': self.chat_id,
+            'chat_id': chat_id,
             'text': text,
             # https://core.telegram.org/bots/api#html-style
             # 'parse_mode': 'HTML'
         }
 
-        post_data_encoded = json.dumps(post_data).encode('ascii')
+        return self.call('sendMessage', post_data)
 
-        request = Request(
-            self.get_url('sendMessage'),
-            post_data_encoded,
-            {'Content-Type': 'application/json'},
-        )
+    def edit_message_text(self, message_id: int, text: str, chat_id: str = None) -> dict:
+        """Replace the text of a message that the bot sent to `chat_id`, or to `Bot.chat_id` by default."""
+        chat_id = chat_id or self.chat_id
+        if not chat_id:
+            raise ChatIdMissingError
 
-        with urlopen(request) as response:
-            return response
+        return self.call('editMessageText', {'chat_id': chat_id, 'message_id': message_id, 'text': text})
 
+    def send_long_message(
+            self,
+            text: str,
+            chat_id: str = None,
+            document_threshold: int = DOCUMENT_THRESHOLD,
+            filename: str = 'message.txt',
+    ) -> List[dict]:
+        """Send text of any length: as one message, as several messages split on line boundaries, or as a
+        document once it is longer than `document_threshold` characters."""
+        if len(text) > document_threshold:
+            return [self.send_document(io.BytesIO(text.encode()), chat_id, filename=filename)]
+        return [self.send_message(chunk, chat_id) for chunk in split_message(text)]
 
-if __name__ == '__main__':
+    def send_document(
+            self,
+            document: Union[str, BinaryIO],
+            chat_id: str = None,
+            filename: str = None,
+            caption: str = None,
+            compress: Optional[bool] = False,
+    ) -> dict:
+        """Upload a file, given by its path or as a binary file object such as a pipe, with `sendDocument`.
+
+        The multipart body is streamed in chunks and never held in memory as a whole. With `compress`, the file
+        is gzipped on the fly; with `compress=None`, only if it is larger than `COMPRESS_THRESHOLD`.
+        """
+        chat_id = chat_id or self.chat_id
+        if not chat_id:
+            raise ChatIdMissingError
+
+        with ExitStack() as stack:
+            if isinstance(document, str):
+                filename = filename or os.path.basename(document)
+                document = stack.enter_context(open(document, 'rb'))
+            filename = filename or 'document'
+            size = _remaining_size(document)
+            if compress is None:
+                compress = size is None or size > COMPRESS_THRESHOLD
+
+            chunks = iter(lambda: document.read(UPLOAD_CHUNK_SIZE), b'')
+            if compress:
+                chunks = _gzip_chunks(chunks)
+                filename += '.gz'
+                size = None
+
+            fields = {'chat_id': str(chat_id)}
+            if caption:
+                fields['caption'] = caption[:MAX_CAPTION_LENGTH]
+            boundary = secrets.token_hex(16)
+            head, tail = _multipart_envelope(fields, 'document', filename, boundary)
+            headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+            if size is not None:
+                headers['Content-Length'] = str(len(head) + size + len(tail))
+            return self.call(
+                'sendDocument',
+                body=itertools.chain([head], chunks, [tail]),
+                headers=headers,
+                timeout=UPLOAD_TIMEOUT,
+            )
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split `text` into ordered chunks of at most `limit` characters, on line boundaries where possible."""
+    chunks = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        if len(current) + len(line) > limit and current:
+            chunks.append(current)
+            current = ''
+        while len(line) > limit:
+            chunks.append(line[:limit])
+            line = line[limit:]
+        current += line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _multipart_envelope(fields: Dict[str, str], file_field: str, filename: str, boundary: str) -> Tuple[bytes, bytes]:
+    """Return what comes before and after the file's content in a multipart/form-data body."""
+    lines = []
+    for name, value in fields.items():
+        lines += [f'--{boundary}', f'Content-Disposition: form-data; name="{name}"', '', value]
+    quoted_filename = filename.replace('"', '%22')
+    lines += [
+        f'--{boundary}',
+        f'Content-Disposition: form-data; name="{file_field}"; filename="{quoted_filename}"',
+        'Content-Type: application/octet-stream',
+        '',
+        '',
+    ]
+    return '\r\n'.join(lines).encode(), f'\r\n--{boundary}--\r\n'.encode()
+
+
+def _remaining_size(file: BinaryIO) -> Optional[int]:
+    """Return how many bytes are left to read from a regular file or `BytesIO`, or None for pipes and the like."""
+    if isinstance(file, io.BytesIO):
+        return len(file.getbuffer()) - file.tell()
+    try:
+        file_stat = os.fstat(file.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return file_stat.st_size - file.tell() if stat.S_ISREG(file_stat.st_mode) else None
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def main(argv: List[str] = None):
     parser = argparse.ArgumentParser(
         description='Generate a .env file with the required variables to use `ckcyberbot`'
                     ' in other modules. If a `.env` file already exists and does not'
@@ -103,7 +407,7 @@ if __name__ == '__main__':
              ' This can be helpful if the existing chat ID is invalid.',
         action='store_true'
     )
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     bot = Bot(args.token, args.chat_id)
 
@@ -133,42 +437,25 @@ if __name__ == '__main__':
         print('Bot code didn\'t match. Exiting...')
         exit(2)
 
-    # create or append to the .env file
-    env: Dict[str, str] = {
-        'TELEGRAM_TOKEN': '',
-        'TELEGRAM_CHAT_ID': '',
-    }
-    is_updating_existing_file = True
+    # Create or update the .env file. Only the Telegram variables are touched; everything else is kept as is.
     try:
-        env.update(load_env_file('.env'))
+        env = load_env_file('.env')
+        is_updating_existing_file = True
         print('Existing .env file found. Updating with Telegram varaibles...')
     except FileNotFoundError:
+        env = {}
         is_updating_existing_file = False
         print('Existing .env file not found. Creating new .env file...')
-        with open('.env', 'w'):
-            pass
-
-    with open('.env', 'r+') as file:
-        file.seek(0, os.SEEK_END)
-        if not env['TELEGRAM_TOKEN']:
-            file.write(f'TELEGRAM_TOKEN={bot.token}\n')
-        if not env['TELEGRAM_CHAT_ID']:
-            file.write(f'TELEGRAM_CHAT_ID={bot.chat_id}\n')
-        else:
-            # Replace the existing TELGRAM_CHAT_ID in the file
-            file.seek(0)
-            old_content = file.read()
-            updated_content = re.sub(
-                r'(?!TELEGRAM_CHAT_ID=)\d+',
-                bot.chat_id,
-                old_content,
-                flags=re.MULTILINE
-            )
-            file.seek(0)
-            file.write(updated_content)
-            file.truncate()
+
+    updates = {} if env.get('TELEGRAM_TOKEN') else {'TELEGRAM_TOKEN': bot.token}
+    updates['TELEGRAM_CHAT_ID'] = bot.chat_id
+    update_env_file('.env', updates)
 
     if is_updating_existing_file:
         print('Successfully updated .env file!')
     else:
         print('Successfully created new .env file!')
+
+
+if __name__ == '__main__':
+    main()
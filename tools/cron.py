@@ -0,0 +1,145 @@
+import bisect
+import datetime
+import math
+from functools import lru_cache
+from typing import List, Tuple
+
+from tools.exceptions import ScheduleError
+
+
+MONTH_NAMES = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+DAY_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+ALIASES = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+# Give up looking for the next fire time after this many years, e.g. for "0 0 30 2 *" (February 30th).
+MAX_YEARS = 8
+
+
+def _parse_field(field: str, low: int, high: int, names: List[str] = None) -> Tuple[List[int], bool]:
+    """Return the sorted values matched by one cron field and whether the field is a bare `*`."""
+
+    def parse_value(value: str) -> int:
+        if names and value.lower() in names:
+            return names.index(value.lower()) + low
+        try:
+            number = int(value)
+        except ValueError:
+            raise ScheduleError(f'"{value}" is not a valid cron value') from None
+        if not low <= number <= high:
+            raise ScheduleError(f'{number} is out of range {low}-{high}')
+        return number
+
+    values = set()
+    for part in field.split(','):
+        range_str, _, step_str = part.partition('/')
+        step = parse_value(step_str) if step_str else 1
+        if step < 1:
+            raise ScheduleError(f'"{part}" has a step of less than 1')
+        if range_str == '*':
+            start, end = low, high
+        elif '-' in range_str:
+            start_str, end_str = range_str.split('-', 1)
+            start, end = parse_value(start_str), parse_value(end_str)
+        else:
+            start = parse_value(range_str)
+            end = high if step_str else start
+        if start > end:
+            raise ScheduleError(f'"{part}" is an empty range')
+        values.update(range(start, end + 1, step))
+    return sorted(values), field == '*'
+
+
+class CronSchedule:
+    """A standard five-field cron expression: minute, hour, day of month, month and day of week.
+
+    `next_after()` jumps straight to the next allowed month, hour and minute with a binary search over each
+    field's values, so finding the next fire time never steps through the calendar minute by minute.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip().lower(), expression).split()
+        if len(fields) != 5:
+            raise ScheduleError(f'"{expression}" must have 5 fields: minute hour day-of-month month day-of-week')
+        self.minutes, _ = _parse_field(fields[0], 0, 59)
+        self.hours, _ = _parse_field(fields[1], 0, 23)
+        self.days, days_any = _parse_field(fields[2], 1, 31)
+        self.months, _ = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+        weekdays, weekdays_any = _parse_field(fields[4], 0, 7, DAY_NAMES)
+        # Both 0 and 7 mean Sunday. Python counts weekdays from Monday = 0, hence the shift.
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        # Like cron, match either field if both day fields are restricted, otherwise the restricted one.
+        self.days_or_weekdays = not days_any and not weekdays_any
+
+    def _day_matches(self, date: datetime.date) -> bool:
+        day_ok = date.day in self.days
+        weekday_ok = date.weekday() in self.weekdays
+        if self.days_or_weekdays:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, timestamp: float) -> float:
+        """Return the first fire time strictly after `timestamp`, in seconds since the epoch (local time)."""
+        t = datetime.datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0)
+        t += datetime.timedelta(minutes=1)
+        limit_year = t.year + MAX_YEARS
+        while t.year <= limit_year:
+            if t.month not in self.months:
+                index = bisect.bisect_left(self.months, t.month)
+                if index == len(self.months):
+                    t = datetime.datetime(t.year + 1, self.months[0], 1)
+                else:
+                    t = datetime.datetime(t.year, self.months[index], 1)
+                continue
+            if not self._day_matches(t.date()):
+                # At most 31 steps per month, and only whole days at a time.
+                t = datetime.datetime(t.year, t.month, t.day) + datetime.timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                index = bisect.bisect_left(self.hours, t.hour)
+                if index == len(self.hours):
+                    t = datetime.datetime(t.year, t.month, t.day) + datetime.timedelta(days=1)
+                else:
+                    t = t.replace(hour=self.hours[index], minute=0)
+                continue
+            index = bisect.bisect_left(self.minutes, t.minute)
+            if index == len(self.minutes):
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            return t.replace(minute=self.minutes[index]).timestamp()
+        raise ScheduleError(f'"{self.expression}" never fires')
+
+    def __str__(self):
+        return f'cron "{self.expression}"'
+
+
+class IntervalSchedule:
+    """Fire every `seconds` seconds, at `anchor` and at whole multiples of the interval after it."""
+
+    def __init__(self, seconds: float, anchor: float):
+        if seconds <= 0:
+            raise ScheduleError('the interval must be positive')
+        self.seconds = seconds
+        self.anchor = anchor
+
+    def next_after(self, timestamp: float) -> float:
+        periods = math.floor((timestamp - self.anchor) / self.seconds) + 1
+        return self.anchor + max(periods, 0) * self.seconds
+
+    def __str__(self):
+        return f'every {self.seconds:g} s'
+
+
+@lru_cache(maxsize=4096)
+def parse_cron(expression: str) -> CronSchedule:
+    """Parse a cron expression once. Daemons with thousands of recurring jobs reuse the parsed schedules."""
+    return CronSchedule(expression)
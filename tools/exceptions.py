@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class CkError(Exception):
     """Base class for exceptions in this module"""
     pass
@@ -6,3 +9,48 @@ class CkError(Exception):
 class ChatIdMissingError(CkError):
     """Raised when trying to use a `Bot` method that requires `Bot.chat_id` when `Bot.chat_id` is None."""
     pass
+
+
+class SchedulerError(CkError):
+    """Raised when the `schedcom` daemon can't carry out a request."""
+    pass
+
+
+class DaemonNotRunningError(SchedulerError):
+    """Raised when a client can't reach a `schedcom` daemon on its socket."""
+    pass
+
+
+class JobFileError(CkError):
+    """Raised when a `schedcom --jobs` file can't be loaded or its dependencies are invalid."""
+    pass
+
+
+class ScheduleError(CkError):
+    """Raised when a recurring schedule, e.g. a cron expression, is invalid."""
+    pass
+
+
+class LogArchiveError(CkError):
+    """Raised when an archived run log can't be found or read."""
+    pass
+
+
+class WatchError(CkError):
+    """Raised when the paths of `schedcom --on-change` can't be watched."""
+    pass
+
+
+class ProcessWaitError(CkError):
+    """Raised when the process of `schedcom --after-pid` or `--after-pid-file` can't be waited for."""
+    pass
+
+
+class TelegramApiError(CkError):
+    """Raised when the Telegram Bot API answers a request with an error."""
+
+    def __init__(self, message: str, error_code: int = None, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.error_code = error_code
+        # Set for "429 Too Many Requests": how many seconds to wait before retrying.
+        self.retry_after = retry_after
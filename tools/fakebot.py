@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+
+import argparse
+import email.parser
+import email.policy
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+
+# A local stand-in for the Telegram Bot API, for integration tests and benchmarks of `tools.ckcyberbot`.
+# https://core.telegram.org/bots/api
+
+PATH_PATTERN = re.compile(r'^/bot(?P<token>[^/]+)/(?P<method>\w+)$')
+
+
+class FakeBotApi:
+    """A threaded HTTP server that implements `getMe`, `getUpdates`, `sendMessage`, `editMessageText` and
+    `sendDocument`.
+
+    Every request waits `latency` seconds before it is answered. A `rate_limit_rate` fraction of the sending
+    requests is answered with "429 Too Many Requests" and `retry_after`, and an `error_rate` fraction with
+    "500 Internal Server Error". Everything that was sent is recorded in `messages` and `documents`, edits
+    change the text of the message in `messages` and are recorded in `edits`, and `add_update()` queues an
+    incoming message for `getUpdates`, which long-polls like the real API.
+    """
+
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            latency: float = 0.0,
+            error_rate: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            retry_after: int = 1,
+            seed: int = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.messages: List[dict] = []
+        self.documents: List[dict] = []
+        self.edits: List[dict] = []
+        self.request_count = 0
+        self._updates: List[dict] = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._random = random.Random(seed)
+        self._lock = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeBotApi':
+        # A short poll interval keeps `stop()`, and with it every test's teardown, fast.
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={'poll_interval': 0.05},
+            name='fakebot',
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            self._lock.notify_all()
+
+    def __enter__(self) -> 'FakeBotApi':
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def add_update(self, text: str, chat_id: int = 1) -> dict:
+        """Queue an incoming text message from `chat_id` for `getUpdates`."""
+        with self._lock:
+            update = {
+                'update_id': self._next_update_id,
+                'message': {
+                    'message_id': self._next_message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': text,
+                },
+            }
+            self._next_update_id += 1
+            self._next_message_id += 1
+            self._updates.append(update)
+            self._lock.notify_all()
+        return update
+
+    def _new_message(self, chat_id, **fields) -> dict:
+        with self._lock:
+            message = {
+                'message_id': self._next_message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id},
+                **fields,
+            }
+            self._next_message_id += 1
+        return message
+
+    def handle(self, method: str, params: dict) -> Tuple[int, dict]:
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            roll = self._random.random()
+            if roll < self.rate_limit_rate:
+                return 429, {
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            if roll < self.rate_limit_rate + self.error_rate:
+                return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+            if 'chat_id' not in params:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat_id is empty'}
+
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'FakeBot'}}
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+        if method == 'sendMessage':
+            text = str(params.get('text', ''))
+            if not text or len(text) > 4096:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is invalid'}
+            message = self._new_message(params['chat_id'], text=text)
+            with self._lock:
+                self.messages.append(message)
+            return 200, {'ok': True, 'result': message}
+        if method == 'editMessageText':
+            return self._edit_message_text(params)
+        if method == 'sendDocument':
+            document = params.get('document')
+            if not isinstance(document, dict):
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: there is no document'}
+            message = self._new_message(
+                params['chat_id'],
+                caption=params.get('caption'),
+                document={'file_name': document['file_name'], 'file_size': len(document['content'])},
+            )
+            with self._lock:
+                self.documents.append({**message, 'content': document['content']})
+            return 200, {'ok': True, 'result': message}
+        return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def _edit_message_text(self, params: dict) -> Tuple[int, dict]:
+        text = str(params.get('text', ''))
+        if not text or len(text) > 4096:
+            return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is invalid'}
+        with self._lock:
+            for message in self.messages:
+                if message['message_id'] == params.get('message_id') and message['chat']['id'] == params['chat_id']:
+                    break
+            else:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+            if message['text'] == text:
+                # Like the real API, which rejects edits that change nothing.
+                return 400, {
+                    'ok': False,
+                    'error_code': 400,
+                    'description': 'Bad Request: message is not modified: specified new message content and'
+                                   ' reply markup are exactly the same as a current content and reply markup'
+                                   ' of the message',
+                }
+            message['text'] = text
+            message['edit_date'] = int(time.time())
+            self.edits.append({'message_id': message['message_id'], 'text': text})
+            return 200, {'ok': True, 'result': dict(message)}
+
+    def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._lock:
+            if offset < 0:
+                # Like the real API, a negative offset counts from the end of the queue.
+                self._updates = self._updates[offset:]
+            else:
+                # Updates before the offset are confirmed and forgotten.
+                self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return self._updates[:limit]
+
+
+def _read_body(handler: BaseHTTPRequestHandler) -> bytes:
+    if handler.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int(handler.rfile.readline().split(b';')[0], 16)
+            if not size:
+                handler.rfile.readline()
+                break
+            chunks.append(handler.rfile.read(size))
+            handler.rfile.readline()
+        return b''.join(chunks)
+    return handler.rfile.read(int(handler.headers.get('Content-Length') or 0))
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            content = part.get_payload(decode=True)
+            params[name] = {'file_name': filename, 'content': content} if filename else content.decode()
+        return params
+    raise ValueError(f'unsupported content type "{content_type}"')
+
+
+def _make_handler(api: FakeBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _respond(self):
+            match = PATH_PATTERN.match(self.path.split('?', 1)[0])
+            try:
+                params = _parse_params(self.headers.get('Content-Type', ''), _read_body(self))
+            except ValueError as e:
+                status, response = 400, {'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}
+            else:
+                if match:
+                    status, response = api.handle(match['method'], params)
+                else:
+                    status, response = 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+            data = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            # Unlike `end_headers()`, send the headers and the body with one write. Two small writes make the
+            # client wait for a delayed ACK (Nagle's algorithm), which would dominate the measured latency.
+            self._headers_buffer.append(b'\r\n')
+            self.wfile.write(b''.join(self._headers_buffer) + data)
+            self._headers_buffer = []
+
+        do_GET = _respond
+        do_POST = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Telegram Bot API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=0, help='the port to listen on. Default: any free port')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of sends that fail with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of sends that get a 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='the `retry_after` of a 429, in seconds')
+    args = parser.parse_args()
+
+    fake_api = FakeBotApi(
+        args.host,
+        args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+    )
+    # The first line tells scripts, e.g. benchmarks, where to send their requests.
+    print(fake_api.url, flush=True)
+    try:
+        fake_api.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,264 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from tools.runner import RunResult
+from tools.utils import get_state_dir
+
+
+# Keep this many characters of a run's output, from the end.
+OUTPUT_TAIL_LENGTH = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT,
+    command TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    returncode INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    user_time REAL,
+    sys_time REAL,
+    max_rss INTEGER,
+    in_blocks INTEGER,
+    out_blocks INTEGER,
+    output_tail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE INDEX IF NOT EXISTS runs_command_started ON runs (command, started);
+-- Percentiles are read from this index with ORDER BY duration LIMIT 1 OFFSET n, see `History._percentile()`.
+CREATE INDEX IF NOT EXISTS runs_succeeded_duration ON runs (command, duration) WHERE returncode = 0;
+
+-- Kept up to date by the trigger, so that statistics never have to count the runs.
+CREATE TABLE IF NOT EXISTS command_stats (
+    command TEXT PRIMARY KEY,
+    runs INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    total_duration REAL NOT NULL,
+    last_started REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS runs_update_stats AFTER INSERT ON runs BEGIN
+    INSERT INTO command_stats (command, runs, failures, total_duration, last_started)
+    VALUES (NEW.command, 1, NEW.returncode != 0, NEW.duration, NEW.started)
+    ON CONFLICT (command) DO UPDATE SET
+        runs = runs + 1,
+        failures = failures + (NEW.returncode != 0),
+        total_duration = total_duration + NEW.duration,
+        last_started = max(last_started, NEW.started);
+END;
+'''
+
+
+def default_history_path() -> str:
+    return os.path.join(get_state_dir(), 'history.sqlite3')
+
+
+@dataclass
+class RunRecord:
+    command: str
+    started: float
+    finished: float
+    returncode: int
+    user_time: Optional[float] = None
+    sys_time: Optional[float] = None
+    max_rss: Optional[int] = None
+    in_blocks: Optional[int] = None
+    out_blocks: Optional[int] = None
+    output_tail: str = ''
+    job_id: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+    @classmethod
+    def from_result(cls, result: RunResult, started: float, job_id: str = None) -> 'RunRecord':
+        output = result.stderr.text() if result.returncode else result.stdout.text()
+        usage = result.usage
+        return cls(
+            command=result.command,
+            started=started,
+            finished=started + usage.wall,
+            returncode=result.returncode,
+            user_time=usage.user,
+            sys_time=usage.sys,
+            max_rss=usage.max_rss,
+            in_blocks=usage.in_blocks,
+            out_blocks=usage.out_blocks,
+            output_tail=output[-OUTPUT_TAIL_LENGTH:],
+            job_id=job_id,
+        )
+
+
+@dataclass
+class CommandStats:
+    command: str
+    runs: int
+    failures: int
+    total_duration: float
+    last_started: float
+    # Of the successful runs only, since failures often end early.
+    p50: Optional[float] = None
+    p95: Optional[float] = None
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.runs if self.runs else 0.0
+
+
+class History:
+    """A SQLite database of every run, with per-command statistics.
+
+    `record()` only hands the run to a writer thread, which inserts everything recorded within `flush_interval`
+    seconds in one transaction. The database is in WAL mode, so readers never block the writer and several
+    processes can record runs at the same time.
+    """
+
+    def __init__(self, path: str = None, flush_interval: float = 0.5):
+        self.path = path or default_history_path()
+        self.flush_interval = flush_interval
+        self._buffer: List[RunRecord] = []
+        self._buffer_lock = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._closing = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode = WAL')
+        # In WAL mode, a crash can lose the last transactions, but never corrupt the database.
+        connection.execute('PRAGMA synchronous = NORMAL')
+        return connection
+
+    def _insert(self, connection: sqlite3.Connection, records: List[RunRecord]):
+        with connection:
+            connection.executemany(
+                'INSERT INTO runs (job_id, command, started, finished, returncode, duration, user_time, sys_time,'
+                ' max_rss, in_blocks, out_blocks, output_tail) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (record.job_id, record.command, record.started, record.finished, record.returncode,
+                     record.duration, record.user_time, record.sys_time, record.max_rss, record.in_blocks,
+                     record.out_blocks, record.output_tail)
+                    for record in records
+                ],
+            )
+
+    def _write_loop(self):
+        connection = self._connect()
+        try:
+            while True:
+                with self._buffer_lock:
+                    while not self._buffer and not self._closing:
+                        self._buffer_lock.wait()
+                    if not self._buffer:
+                        return
+                # Give concurrent runs a moment to join this transaction.
+                if not self._closing:
+                    time.sleep(self.flush_interval)
+                with self._buffer_lock:
+                    records, self._buffer = self._buffer, []
+                try:
+                    self._insert(connection, records)
+                except sqlite3.Error as e:
+                    print(f'Warning: could not record {len(records)} run(s) in {self.path}: {e}')
+        finally:
+            connection.close()
+
+    def record(self, record: RunRecord):
+        """Queue a run for writing without waiting for the database."""
+        with self._buffer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+                self._writer.start()
+            self._buffer.append(record)
+            self._buffer_lock.notify_all()
+
+    def close(self):
+        """Write everything recorded so far and stop the writer thread."""
+        with self._buffer_lock:
+            self._closing = True
+            self._buffer_lock.notify_all()
+        if self._writer:
+            self._writer.join()
+            self._writer = None
+        self._closing = False
+
+    def _query(self, sql: str, parameters: tuple = ()) -> List[tuple]:
+        connection = self._connect()
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def _percentile(self, connection: sqlite3.Connection, command: str, successes: int, percent: float) \
+            -> Optional[float]:
+        """Return a duration percentile of the command's successful runs, read straight from an index."""
+        if successes < 1:
+            return None
+        offset = round((successes - 1) * percent / 100)
+        row = connection.execute(
+            'SELECT duration FROM runs INDEXED BY runs_succeeded_duration'
+            ' WHERE command = ? AND returncode = 0 ORDER BY duration LIMIT 1 OFFSET ?',
+            (command, offset),
+        ).fetchone()
+        return row[0] if row else None
+
+    def stats(self, command: str = None) -> List[CommandStats]:
+        """Return the statistics of `command`, or of every command, the most recently run first."""
+        connection = self._connect()
+        try:
+            sql = 'SELECT command, runs, failures, total_duration, last_started FROM command_stats'
+            if command is None:
+                rows = connection.execute(sql + ' ORDER BY last_started DESC').fetchall()
+            else:
+                rows = connection.execute(sql + ' WHERE command = ?', (command,)).fetchall()
+            stats = [CommandStats(*row) for row in rows]
+            for stat in stats:
+                successes = stat.runs - stat.failures
+                stat.p50 = self._percentile(connection, stat.command, successes, 50)
+                stat.p95 = self._percentile(connection, stat.command, successes, 95)
+            return stats
+        finally:
+            connection.close()
+
+    def recent(self, limit: int = 20, command: str = None) -> List[RunRecord]:
+        """Return the last `limit` runs, of `command` or of every command, the most recent first."""
+        columns = ('command, started, finished, returncode, user_time, sys_time, max_rss, in_blocks, out_blocks,'
+                   ' output_tail, job_id')
+        if command is None:
+            rows = self._query(f'SELECT {columns} FROM runs ORDER BY started DESC LIMIT ?', (limit,))
+        else:
+            rows = self._query(
+                f'SELECT {columns} FROM runs WHERE command = ? ORDER BY started DESC LIMIT ?', (command, limit)
+            )
+        return [RunRecord(*row) for row in rows]
+
+    def estimate(self, command: str) -> Optional[Tuple[float, float]]:
+        """Return the p50 and p95 durations of the command's successful runs, if it ever succeeded."""
+        stats = self.stats(command)
+        if not stats or stats[0].p50 is None:
+            return None
+        return stats[0].p50, stats[0].p95
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration like "2.5 s", "45 s", "3 min 20 s" or "2 h 05 min"."""
+    if seconds < 10:
+        return f'{seconds:.1f} s'
+    seconds = round(seconds)
+    if seconds < 60:
+        return f'{seconds} s'
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f'{minutes} min {seconds:02d} s'
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours} h {minutes:02d} min'
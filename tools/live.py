@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from tools.exceptions import TelegramApiError
+
+if TYPE_CHECKING:
+    from tools.ckcyberbot import Bot
+
+
+# Show this many of the latest output lines by default.
+LIVE_LINES = 10
+# Edit the message at most this often. Telegram allows about one message per second to the same chat, and
+# edits count towards that too, so this leaves room for other notifications.
+EDIT_INTERVAL = 5.0
+MAX_MESSAGE_LENGTH = 4096
+# Only the end of the output is kept to find the latest lines in.
+TAIL_SIZE = 16 * 1024
+# How often to try the final edit, which turns the message into the completion message.
+FINAL_ATTEMPTS = 3
+# Telegram rejects edits that change nothing with this error, which means that the message is up to date.
+NOT_MODIFIED = 'message is not modified'
+
+
+def format_elapsed(seconds: float) -> str:
+    """Format the time since the start in whole minutes, so that the message only changes once a minute
+    while the command is quiet."""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return 'less than a minute'
+    if minutes < 60:
+        return f'{minutes} min'
+    return f'{minutes // 60} h {minutes % 60:02d} min'
+
+
+def fit_message(head: str, output: str, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    """Join `head` and `output` into one message, dropping the start of `output` if it would be too long."""
+    if not output:
+        return head[:limit]
+    room = limit - len(head) - 2
+    if room <= 1:
+        return head[:limit]
+    if len(output) > room:
+        output = '…' + output[-(room - 1):]
+    return f'{head}\n\n{output}'
+
+
+class LiveMessage:
+    """One Telegram message that shows how long a command has been running and its latest output lines.
+
+    Pass it in the `outputs` of `run_command()`, call `start()` when the command starts and `finish()` once it
+    finished. The message is sent and edited from a background thread, so the command never waits for
+    Telegram: at most every `interval` seconds, only when the text changed, and no sooner than a 429's
+    `retry_after` allows.
+    """
+
+    def __init__(
+            self,
+            bot: 'Bot',
+            command: str,
+            lines: int = LIVE_LINES,
+            interval: float = EDIT_INTERVAL,
+            chat_id: str = None,
+    ):
+        self.bot = bot
+        self.command = command
+        self.lines = lines
+        self.interval = interval
+        self.chat_id = chat_id or bot.chat_id
+        self.message_id: Optional[int] = None
+        self._text: Optional[str] = None
+        self._tail = bytearray()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='live-message', daemon=True)
+
+    def start(self) -> 'LiveMessage':
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def write(self, data: bytes):
+        with self._lock:
+            self._tail += data
+            if len(self._tail) > TAIL_SIZE:
+                del self._tail[:-TAIL_SIZE]
+
+    def flush(self):
+        pass
+
+    def render(self) -> str:
+        with self._lock:
+            tail = bytes(self._tail)
+        lines = tail.decode(errors='replace').splitlines()[-self.lines:] if self.lines else []
+        head = f'"{self.command}" is running for {format_elapsed(time.monotonic() - self._started)}.'
+        return fit_message(head, '\n'.join(lines))
+
+    def _edit(self, text: str) -> float:
+        """Show `text`, unless it's shown already, and return how long to wait before the next edit."""
+        if text == self._text:
+            return self.interval
+        try:
+            self.bot.edit_message_text(self.message_id, text, self.chat_id)
+        except TelegramApiError as e:
+            if NOT_MODIFIED not in str(e):
+                return max(self.interval, e.retry_after or 0)
+        except OSError:
+            return self.interval
+        self._text = text
+        return self.interval
+
+    def _run(self):
+        text = self.render()
+        try:
+            self.message_id = self.bot.send_message(text, self.chat_id)['result']['message_id']
+        except (TelegramApiError, OSError) as e:
+            print(f'Warning: could not send the live message: {e}')
+            return
+        self._text = text
+        wait = self.interval
+        while not self._done.wait(wait):
+            wait = self._edit(self.render())
+
+    def finish(self, status: str, output: str = '') -> bool:
+        """Stop updating the message and replace it with `status` and the end of `output`.
+
+        Return False if the message couldn't be sent or edited, and the completion message should be sent as
+        a new message instead.
+        """
+        self._done.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self.message_id is None:
+            return False
+        text = fit_message(status, output)
+        for _ in range(FINAL_ATTEMPTS):
+            try:
+                self.bot.edit_message_text(self.message_id, text, self.chat_id)
+            except TelegramApiError as e:
+                if NOT_MODIFIED in str(e):
+                    return True
+                if e.retry_after is None:
+                    return False
+                time.sleep(e.retry_after)
+                continue
+            except OSError:
+                return False
+            return True
+        return False
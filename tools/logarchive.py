@@ -0,0 +1,378 @@
+import bisect
+import gzip
+import json
+import lzma
+import os
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from tools.exceptions import LogArchiveError
+from tools.utils import get_state_dir
+
+
+# The output of a run is compressed in independent blocks of this many bytes: gzip members or xz streams,
+# concatenated into segment files. The index records where each block starts, so that reading any part of a
+# log only decompresses the blocks it overlaps, and `gzip -dc`/`xz -dc` still read a whole segment.
+BLOCK_SIZE = 256 * 1024
+# A partial block is written anyway once it is this old, so that a crash loses at most this much output.
+FLUSH_INTERVAL = 5.0
+# A log rolls over to a new segment file once its current one holds this many compressed bytes.
+SEGMENT_SIZE = 64 * 2 ** 20
+
+# Once the archive uses more than this, the oldest runs are deleted, and then the oldest segments of the
+# run being written.
+DEFAULT_BUDGET = 2 ** 30
+# Runs are deleted once their log wasn't written to for this long.
+DEFAULT_MAX_AGE = 30 * 24 * 3600.0
+
+# Format -> file extension.
+FORMATS = {'gzip': '.gz', 'xz': '.xz'}
+
+INDEX_EXTENSION = '.idx'
+
+
+def default_archive_dir() -> str:
+    return os.path.join(get_state_dir(), 'logs')
+
+
+def new_run_id(started: float, job_id: str = None) -> str:
+    """Return an ID that sorts by start time, e.g. "20240131T174502-2a4768d8", with the job's ID in the middle if
+    given. The random suffix keeps the runs of a recurring job that start in the same second apart."""
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.localtime(started))
+    suffix = uuid.uuid4().hex[:8]
+    return f'{stamp}-{job_id}-{suffix}' if job_id else f'{stamp}-{suffix}'
+
+
+def _compress(log_format: str, data: bytes) -> bytes:
+    if log_format == 'gzip':
+        return gzip.compress(data, mtime=0)
+    return lzma.compress(data, format=lzma.FORMAT_XZ)
+
+
+def _decompress(log_format: str, data: bytes) -> bytes:
+    if log_format == 'gzip':
+        return gzip.decompress(data)
+    return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+
+@dataclass
+class Block:
+    # Where the block's data starts in the log, and how many bytes it holds.
+    offset: int
+    size: int
+    # Where its compressed data is: which segment file, at what position, and how long.
+    segment: int
+    position: int
+    length: int
+
+
+@dataclass
+class RunLog:
+    """The archived output of one run, read from its index."""
+    directory: str
+    run_id: str
+    command: str
+    started: float
+    format: str
+    job_id: Optional[str] = None
+    finished: Optional[float] = None
+    returncode: Optional[int] = None
+    blocks: List[Block] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        """The size of the log, including the parts that were already deleted."""
+        return self.blocks[-1].offset + self.blocks[-1].size if self.blocks else 0
+
+    @property
+    def first_offset(self) -> int:
+        """Where the part of the log that wasn't deleted yet starts."""
+        for block in self.blocks:
+            if os.path.exists(self.segment_path(block.segment)):
+                return block.offset
+        return self.size
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f'{self.run_id}.{segment:03d}{FORMATS[self.format]}')
+
+    def disk_usage(self) -> int:
+        return sum(os.path.getsize(path) for path in _run_files(self.directory, self.run_id))
+
+    def read_block(self, block: Block) -> Optional[bytes]:
+        """Decompress one block, or return None if its segment was deleted."""
+        try:
+            with open(self.segment_path(block.segment), 'rb') as file:
+                file.seek(block.position)
+                data = file.read(block.length)
+        except FileNotFoundError:
+            return None
+        try:
+            return _decompress(self.format, data)
+        except (OSError, EOFError, lzma.LZMAError, zlib.error) as e:
+            raise LogArchiveError(f'block at offset {block.offset} of run {self.run_id} is corrupt: {e}') from e
+
+    def iter_bytes(self, start: int = 0, end: int = None) -> Iterator[bytes]:
+        """Yield the log from `start` to `end`, block by block, decompressing only the blocks in between.
+        Deleted parts are left out."""
+        end = self.size if end is None else min(end, self.size)
+        index = max(0, bisect.bisect_right([block.offset for block in self.blocks], start) - 1)
+        for block in self.blocks[index:]:
+            if block.offset >= end:
+                break
+            data = self.read_block(block)
+            if data is not None:
+                yield data[max(0, start - block.offset):end - block.offset]
+
+    def tail(self, lines: int) -> bytes:
+        """Return the last `lines` lines, decompressing blocks from the end until there are enough of them."""
+        chunks: List[bytes] = []
+        newlines = 0
+        for block in reversed(self.blocks):
+            data = self.read_block(block)
+            if data is None:
+                break
+            chunks.append(data)
+            # A trailing newline ends the last line rather than starting another one.
+            newlines += data.count(b'\n')
+            if newlines > lines:
+                break
+        text = b''.join(reversed(chunks))
+        end = len(text) - 1 if text.endswith(b'\n') else len(text)
+        start = end
+        for _ in range(lines):
+            start = text.rfind(b'\n', 0, start)
+            if start < 0:
+                break
+        return text[start + 1:] if lines else b''
+
+
+def _run_files(directory: str, run_id: str) -> List[str]:
+    prefix = f'{run_id}.'
+    return [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(prefix)]
+
+
+def load_run(run_id: str, directory: str = None) -> RunLog:
+    """Read a run's index. A run that is still being written, or crashed, has no `finished` yet."""
+    directory = directory or default_archive_dir()
+    try:
+        with open(os.path.join(directory, run_id + INDEX_EXTENSION)) as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        raise LogArchiveError(f'no archived run "{run_id}"') from None
+    run: Optional[RunLog] = None
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # The last line may be cut short by a crash.
+            continue
+        if run is None:
+            run = RunLog(directory, entry['run'], entry['command'], entry['started'], entry['format'],
+                         entry.get('job_id'))
+        elif 'block' in entry:
+            run.blocks.append(Block(*entry['block']))
+        elif 'finished' in entry:
+            run.finished = entry['finished']
+            run.returncode = entry['returncode']
+    if run is None:
+        raise LogArchiveError(f'the index of run "{run_id}" is empty')
+    return run
+
+
+def list_runs(directory: str = None) -> List[RunLog]:
+    """Return every archived run, the oldest first."""
+    directory = directory or default_archive_dir()
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    runs = []
+    for name in names:
+        if name.endswith(INDEX_EXTENSION):
+            try:
+                runs.append(load_run(name[:-len(INDEX_EXTENSION)], directory))
+            except (LogArchiveError, KeyError, TypeError):
+                continue
+    return runs
+
+
+def find_run(query: str, directory: str = None) -> RunLog:
+    """Find a run by its ID, a prefix of it, e.g. its date, or the ID of its job. The latest match wins."""
+    directory = directory or default_archive_dir()
+    try:
+        run_ids = sorted(name[:-len(INDEX_EXTENSION)] for name in os.listdir(directory)
+                         if name.endswith(INDEX_EXTENSION))
+    except FileNotFoundError:
+        run_ids = []
+    matches = [run_id for run_id in run_ids
+               if run_id == query or run_id.startswith(query) or f'-{query}-' in run_id or run_id.endswith(f'-{query}')]
+    if not matches:
+        raise LogArchiveError(f'no archived run matches "{query}"')
+    return load_run(query if query in matches else matches[-1], directory)
+
+
+def prune(
+        directory: str = None,
+        budget: int = DEFAULT_BUDGET,
+        max_age: float = DEFAULT_MAX_AGE,
+        keep: str = None,
+        now: float = None,
+) -> int:
+    """Delete the runs that are older than `max_age`, then the oldest runs until the archive fits `budget`.
+
+    The run `keep`, i.e. the one being written, is never deleted here. Return how many bytes the archive uses.
+    """
+    directory = directory or default_archive_dir()
+    now = time.time() if now is None else now
+    runs: Dict[str, List[os.stat_result]] = {}
+    paths: Dict[str, List[str]] = {}
+    for entry in os.scandir(directory):
+        run_id = entry.name.split('.', 1)[0]
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        runs.setdefault(run_id, []).append(stat)
+        paths.setdefault(run_id, []).append(entry.path)
+    usage = sum(stat.st_size for stats in runs.values() for stat in stats)
+    # Run IDs start with the time the run started, so they sort the oldest first.
+    for run_id in sorted(runs):
+        if run_id == keep:
+            continue
+        expired = now - max(stat.st_mtime for stat in runs[run_id]) > max_age
+        if not expired and usage <= budget:
+            continue
+        for path in paths[run_id]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        usage -= sum(stat.st_size for stat in runs[run_id])
+    return usage
+
+
+class LogArchiveWriter:
+    """Compress the output of one run into its segment files as it is produced, and index every block.
+
+    Pass it to `run_command()` in `outputs`, which serializes the writes of stdout and stderr. Call `close()` once
+    the run is over. The archive is pruned when the writer is created and whenever it starts a new segment; if
+    this run alone exceeds `budget`, its own oldest segments are deleted, so that the end of the output is kept.
+    """
+
+    def __init__(
+            self,
+            run_id: str,
+            command: str,
+            log_format: str = 'gzip',
+            directory: str = None,
+            job_id: str = None,
+            budget: int = DEFAULT_BUDGET,
+            max_age: float = DEFAULT_MAX_AGE,
+            block_size: int = BLOCK_SIZE,
+            segment_size: int = SEGMENT_SIZE,
+    ):
+        if log_format not in FORMATS:
+            raise LogArchiveError(f'unknown log format "{log_format}"')
+        self.run = RunLog(directory or default_archive_dir(), run_id, command, time.time(), log_format, job_id)
+        self.budget = budget
+        self.max_age = max_age
+        self.block_size = block_size
+        self.segment_size = segment_size
+        self._buffer = bytearray()
+        self._offset = 0
+        self._last_block = time.monotonic()
+        self._segment = 0
+        self._position = 0
+        self._failed = False
+        os.makedirs(self.run.directory, exist_ok=True)
+        prune(self.run.directory, budget, max_age, keep=run_id)
+        self._index: BinaryIO = open(os.path.join(self.run.directory, run_id + INDEX_EXTENSION), 'ab')
+        self._write_index({'run': run_id, 'command': command, 'started': self.run.started, 'format': log_format,
+                           'job_id': job_id})
+        self._file: BinaryIO = open(self.run.segment_path(0), 'ab')
+
+    @property
+    def run_id(self) -> str:
+        return self.run.run_id
+
+    def _write_index(self, entry: dict):
+        self._index.write(json.dumps(entry).encode() + b'\n')
+        # Readers, e.g. `schedcom logs` while the job runs, see every block as soon as it is written.
+        self._index.flush()
+
+    def _next_segment(self):
+        self._file.close()
+        self._segment += 1
+        self._position = 0
+        self._file = open(self.run.segment_path(self._segment), 'ab')
+        usage = prune(self.run.directory, self.budget, self.max_age, keep=self.run_id)
+        for segment in range(self._segment):
+            if usage <= self.budget:
+                break
+            path = self.run.segment_path(segment)
+            try:
+                usage -= os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _write_block(self, data: bytes):
+        compressed = _compress(self.run.format, data)
+        if self._position and self._position + len(compressed) > self.segment_size:
+            self._next_segment()
+        self._file.write(compressed)
+        self._file.flush()
+        block = Block(self._offset, len(data), self._segment, self._position, len(compressed))
+        self.run.blocks.append(block)
+        self._write_index({'block': [block.offset, block.size, block.segment, block.position, block.length]})
+        self._offset += len(data)
+        self._position += len(compressed)
+        self._last_block = time.monotonic()
+
+    def write(self, data: bytes):
+        if self._failed:
+            return
+        self._buffer += data
+        try:
+            while len(self._buffer) >= self.block_size:
+                self._write_block(bytes(self._buffer[:self.block_size]))
+                del self._buffer[:self.block_size]
+            if self._buffer and time.monotonic() - self._last_block >= FLUSH_INTERVAL:
+                self._write_block(bytes(self._buffer))
+                self._buffer.clear()
+        except OSError as e:
+            # E.g. a full disk. Raising here would stop `run_command()` from reading the output of the job.
+            print(f'Warning: could not archive the output of run {self.run_id}: {e}')
+            self._failed = True
+            self._buffer.clear()
+
+    def flush(self):
+        # `run_command()` flushes after every chunk of output. Compressing each of them on its own would ruin the
+        # compression ratio, so blocks are only written once they are full or `FLUSH_INTERVAL` old.
+        pass
+
+    def close(self, returncode: int = None):
+        """Write what is left of the output and mark the run as finished."""
+        if self._file.closed:
+            return
+        try:
+            if self._buffer and not self._failed:
+                self._write_block(bytes(self._buffer))
+                self._buffer.clear()
+            self.run.finished = time.time()
+            self.run.returncode = returncode
+            self._write_index({'finished': self.run.finished, 'returncode': returncode})
+        finally:
+            self._file.close()
+            self._index.close()
@@ -0,0 +1,109 @@
+import os
+import select
+import sys
+import time
+from typing import Optional
+
+from tools.exceptions import ProcessWaitError
+
+
+# Without pidfds or kqueue, check whether the process still exists this often: first quickly, so that short
+# waits stay short, and then less and less often.
+POLL_MIN_INTERVAL = 0.01
+POLL_MAX_INTERVAL = 1.0
+
+
+def read_pid_file(path: str) -> int:
+    """Read a PID from a file like the ones daemons write to /run, or raise `ProcessWaitError`."""
+    try:
+        with open(path) as file:
+            content = file.read().strip()
+    except OSError as e:
+        raise ProcessWaitError(f'could not read "{path}": {e.strerror}') from e
+    if not content.isdigit() or int(content) < 1:
+        raise ProcessWaitError(f'"{path}" does not contain a PID')
+    return int(content)
+
+
+def process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It exists, but belongs to someone else.
+        pass
+    return True
+
+
+def describe_process(pid: int) -> Optional[str]:
+    """Return the command line of a process, if the system tells."""
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as file:
+            arguments = file.read().rstrip(b'\0').split(b'\0')
+    except OSError:
+        return None
+    return ' '.join(os.fsdecode(argument) for argument in arguments) or None
+
+
+def _wait_pidfd(pid: int, timeout: Optional[float]) -> bool:
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    try:
+        poller = select.poll()
+        # The pidfd becomes readable once the process exited. It refers to this very process, so the wait can't
+        # be fooled by the PID being reused.
+        poller.register(fd, select.POLLIN)
+        return bool(poller.poll(None if timeout is None else int(timeout * 1000)))
+    finally:
+        os.close(fd)
+
+
+def _wait_kqueue(pid: int, timeout: Optional[float]) -> bool:
+    kqueue = select.kqueue()
+    try:
+        event = select.kevent(pid, filter=select.KQ_FILTER_PROC, flags=select.KQ_EV_ADD | select.KQ_EV_ONESHOT,
+                              fflags=select.KQ_NOTE_EXIT)
+        try:
+            return bool(kqueue.control([event], 1, timeout))
+        except ProcessLookupError:
+            return True
+    finally:
+        kqueue.close()
+
+
+def _wait_polling(pid: int, timeout: Optional[float]) -> bool:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    interval = POLL_MIN_INTERVAL
+    while process_exists(pid):
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_MAX_INTERVAL)
+    return True
+
+
+def wait_for_exit(pid: int, timeout: float = None) -> bool:
+    """Block until the process `pid`, which doesn't have to be a child of this one, exited.
+
+    Return False if it is still running after `timeout` seconds. Uses a pidfd on Linux 5.3+ and kqueue on macOS
+    and the BSDs, which both wake up exactly once, when the process exits. Elsewhere, the process is polled with
+    an increasing interval. The exit status of a process that isn't our child can't be known in any case.
+    """
+    if sys.platform == 'win32':
+        # `os.kill(pid, 0)` would send CTRL_C_EVENT there.
+        raise ProcessWaitError('waiting for a process is not supported on Windows')
+    if hasattr(os, 'pidfd_open'):
+        try:
+            return _wait_pidfd(pid, timeout)
+        except OSError:
+            # E.g. ENOSYS on kernels before 5.3, or EPERM in some sandboxes.
+            pass
+    if hasattr(select, 'kqueue'):
+        return _wait_kqueue(pid, timeout)
+    return _wait_polling(pid, timeout)
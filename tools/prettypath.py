@@ -2,12 +2,34 @@
 
 import os
 import argparse
+import json
 import re
+import shlex
+import stat
 import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
+# Bump this when the layout of the cache file changes.
+INDEX_VERSION = 1
 
-def prettypath(search_pattern: str = None, ignore_pattern: str = None):
-    folders = os.environ['PATH'].split(';' if sys.platform == 'win32' else ':')
+# Scan this many PATH directories at once. Slow mounts, e.g. `/mnt/c` on WSL, are mostly spent waiting.
+MAX_WORKERS = 16
+
+# `--analyze` gives up on a directory after this many seconds, e.g. on a hung network mount.
+ANALYZE_TIMEOUT = 2.0
+# A directory is slow if looking up a command that isn't there takes longer than this, in seconds.
+SLOW_LOOKUP = 0.005
+
+
+def path_dirs(search_pattern: str = None, ignore_pattern: str = None, keep_empty: bool = False) -> List[str]:
+    """Return the directories of `PATH` in order, optionally filtered by regular expressions.
+
+    Empty entries, which mean the current directory, are left out unless `keep_empty` is set.
+    """
+    folders = [folder for folder in os.environ.get('PATH', '').split(os.pathsep) if folder or keep_empty]
 
     # Windows directory and file names are case-insensitive.
     case_insensitive = False if sys.platform.startswith('linux') else True
@@ -20,14 +42,319 @@ def prettypath(search_pattern: str = None, ignore_pattern: str = None):
         compiled_pattern = re.compile(ignore_pattern, re.IGNORECASE if case_insensitive else 0)
         folders = [folder for folder in folders if not compiled_pattern.search(folder)]
 
-    for folder in folders:
-        if folder:
-            print(folder)
+    return folders
 
 
-if __name__ == '__main__':
+def prettypath(search_pattern: str = None, ignore_pattern: str = None):
+    for folder in path_dirs(search_pattern, ignore_pattern):
+        print(folder)
+
+
+def default_index_path() -> str:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ck', 'path_index.json')
+
+
+def _is_executable(entry: os.DirEntry) -> bool:
+    try:
+        if not entry.is_file():
+            return False
+    except OSError:
+        return False
+    if sys.platform == 'win32':
+        extensions = os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').lower().split(';')
+        return os.path.splitext(entry.name)[1].lower() in extensions
+    return os.access(entry.path, os.X_OK)
+
+
+def scan_dir(directory: str) -> List[str]:
+    """Return the sorted names of the executables in `directory`."""
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entry.name for entry in entries if _is_executable(entry))
+    except OSError:
+        return []
+
+
+def _dir_mtime(directory: str) -> Optional[int]:
+    try:
+        st = os.stat(directory)
+    except OSError:
+        return None
+    return st.st_mtime_ns if stat.S_ISDIR(st.st_mode) else None
+
+
+class PathIndex:
+    """An index of every executable on `PATH` to the directories that provide it, in `PATH` order.
+
+    The names found in each directory are cached on disk together with the directory's mtime, which changes
+    whenever a file is added, removed or renamed in it. A repeated lookup therefore only has to stat every
+    directory, concurrently, and rescans just the ones that changed. Making an existing file executable doesn't
+    change its directory's mtime; use `refresh=True` for that.
+    """
+
+    def __init__(self, dirs: List[str], cache_path: str = None, refresh: bool = False):
+        # A directory listed twice provides nothing new the second time.
+        self.dirs = list(dict.fromkeys(dirs))
+        self.cache_path = cache_path or default_index_path()
+        self.names: Dict[str, List[str]] = {}
+        self.rescanned: List[str] = []
+        self._build(refresh)
+
+    def _load_cache(self) -> Dict[str, dict]:
+        try:
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict) or cache.get('version') != INDEX_VERSION:
+            return {}
+        return cache.get('dirs', {})
+
+    def _save_cache(self, cached: Dict[str, dict]):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f'{self.cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': INDEX_VERSION, 'dirs': cached}, file)
+        os.replace(tmp_path, self.cache_path)
+
+    def _build(self, refresh: bool):
+        # Imported here, so that plain `prettypath` doesn't pay for it.
+        from concurrent.futures import ThreadPoolExecutor
+
+        cached = {} if refresh else self._load_cache()
+
+        def lookup(directory: str) -> Tuple[Optional[int], List[str], bool]:
+            mtime = _dir_mtime(directory)
+            entry = cached.get(directory)
+            if entry and entry.get('mtime_ns') == mtime:
+                return mtime, entry['names'], False
+            return mtime, scan_dir(directory) if mtime is not None else [], True
+
+        with ThreadPoolExecutor(min(MAX_WORKERS, len(self.dirs) or 1)) as pool:
+            results = list(pool.map(lookup, self.dirs))
+
+        for directory, (mtime, names, rescanned) in zip(self.dirs, results):
+            if rescanned:
+                self.rescanned.append(directory)
+                cached[directory] = {'mtime_ns': mtime, 'names': names}
+            for name in names:
+                self.names.setdefault(name, []).append(directory)
+
+        if self.rescanned:
+            try:
+                self._save_cache(cached)
+            except OSError as e:
+                print(f'Warning: could not save the executable index: {e}', file=sys.stderr)
+
+    def which(self, name: str) -> List[str]:
+        """Return every path `name` resolves to, the one the shell would run first."""
+        return [os.path.join(directory, name) for directory in self.names.get(name, [])]
+
+    def shadowed(self) -> Dict[str, List[str]]:
+        """Return the commands that more than one directory provides, with all of their directories."""
+        return {name: dirs for name, dirs in sorted(self.names.items()) if len(dirs) > 1}
+
+
+@dataclass
+class DirHealth:
+    """What `--analyze` found out about one `PATH` entry."""
+    directory: str
+    is_dir: bool = False
+    realpath: Optional[str] = None
+    executables: int = 0
+    # How long a shell pays here for every command found further down the PATH, or not at all.
+    lookup_seconds: Optional[float] = None
+    scan_seconds: Optional[float] = None
+    timed_out: bool = False
+    # The position of an earlier entry that is the same directory, e.g. through a symlink.
+    duplicate_of: Optional[int] = None
+
+    def problems(self, slow: float = SLOW_LOOKUP) -> List[str]:
+        if not self.directory:
+            # An empty entry runs whatever the current directory has, e.g. a planted `ls`.
+            return ['current directory']
+        if self.timed_out:
+            return ['timed out']
+        problems = []
+        if not self.is_dir:
+            problems.append('missing')
+        if self.duplicate_of is not None:
+            problems.append(f'duplicate of #{self.duplicate_of + 1}')
+        if self.is_dir and not self.executables:
+            problems.append('empty')
+        if self.lookup_seconds is not None and self.lookup_seconds > slow:
+            problems.append('slow')
+        return problems
+
+
+def probe_dir(directory: str) -> DirHealth:
+    health = DirHealth(directory)
+    health.is_dir = _dir_mtime(directory) is not None
+    if not health.is_dir:
+        return health
+    health.realpath = os.path.realpath(directory)
+    # This is what a shell does in every directory before the one that has the command.
+    start = time.perf_counter()
+    os.path.exists(os.path.join(directory, f'.prettypath-probe-{os.getpid()}'))
+    health.lookup_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    health.executables = len(scan_dir(directory))
+    health.scan_seconds = time.perf_counter() - start
+    return health
+
+
+def analyze(dirs: List[str], timeout: float = ANALYZE_TIMEOUT) -> List[DirHealth]:
+    """Probe every directory concurrently, giving up on the ones that take longer than `timeout` seconds."""
+    results: Dict[int, DirHealth] = {}
+
+    def probe(i: int, directory: str):
+        results[i] = probe_dir(directory) if directory else DirHealth(directory)
+
+    # Daemon threads, because a thread stuck on a dead mount can't be cancelled and mustn't block the exit.
+    threads = [threading.Thread(target=probe, args=(i, directory), daemon=True) for i, directory in enumerate(dirs)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+    healths = [results.get(i) or DirHealth(directory, timed_out=True) for i, directory in enumerate(dirs)]
+    seen: Dict[str, int] = {}
+    for i, health in enumerate(healths):
+        if not health.directory:
+            continue
+        key = health.realpath or os.path.normpath(health.directory)
+        if key in seen:
+            health.duplicate_of = seen[key]
+        else:
+            seen[key] = i
+    return healths
+
+
+def optimized_dirs(healths: List[DirHealth], drop_empty: bool = False) -> List[str]:
+    """Return the directories without the missing and duplicate ones and the empty entries, in the same order.
+
+    Only later duplicates are dropped, so every command still resolves to the same executable. Directories that
+    timed out are kept, since nothing is known about them.
+    """
+    dirs = []
+    for health in healths:
+        if health.timed_out:
+            dirs.append(health.directory)
+        elif health.is_dir and health.duplicate_of is None and (health.executables or not drop_empty):
+            dirs.append(health.directory)
+    return dirs
+
+
+def _format_ms(seconds: Optional[float]) -> str:
+    return f'{seconds * 1000:.2f}' if seconds is not None else '-'
+
+
+def print_analysis(healths: List[DirHealth], slow: float = SLOW_LOOKUP):
+    print(f'{"#":>3}  {"lookup ms":>9}  {"scan ms":>9}  {"exes":>5}  directory')
+    for i, health in enumerate(healths, 1):
+        problems = health.problems(slow)
+        executables = str(health.executables) if health.is_dir else '-'
+        line = (
+            f'{i:>3}  {_format_ms(health.lookup_seconds):>9}  {_format_ms(health.scan_seconds):>9}'
+            f'  {executables:>5}  {health.directory or "(empty entry)"}'
+        )
+        if problems:
+            line += f'  [{", ".join(problems)}]'
+        print(line)
+
+    removable = len(healths) - len(optimized_dirs(healths))
+    miss_seconds = sum(health.lookup_seconds or 0.0 for health in healths)
+    print(
+        f'\n{removable} of {len(healths)} entries are missing, duplicates or the current directory.'
+        f' Looking up a command that isn\'t on the PATH takes {miss_seconds * 1000:.2f} ms.'
+    )
+
+
+def print_which(index: PathIndex, name: str) -> int:
+    paths = index.which(name)
+    if not paths:
+        print(f'{name} not found on PATH', file=sys.stderr)
+        return 1
+    print(paths[0])
+    for path in paths[1:]:
+        print(f'  shadows {path}')
+    return 0
+
+
+def print_shadowed(index: PathIndex):
+    for name, dirs in index.shadowed().items():
+        print(f'{name}: {os.path.join(dirs[0], name)}')
+        for directory in dirs[1:]:
+            print(f'  shadows {os.path.join(directory, name)}')
+
+
+def main(argv: List[str] = None) -> int:
     parser = argparse.ArgumentParser(description='Print the `PATH` variable in a human-readable way.')
     parser.add_argument('-s', '--search', help='Only show path directories matching this pattern')
     parser.add_argument('-i', '--ignore', help='Ignore path directories matching this pattern')
-    args = parser.parse_args()
-    prettypath(search_pattern=args.search, ignore_pattern=args.ignore)
+    index_options = parser.add_mutually_exclusive_group()
+    index_options.add_argument(
+        '-w', '--which',
+        metavar='NAME',
+        help='Show which executable NAME runs, and which ones it shadows further down the PATH',
+    )
+    index_options.add_argument(
+        '--shadowed',
+        action='store_true',
+        help='List the commands that are provided by more than one path directory',
+    )
+    index_options.add_argument(
+        '-a', '--analyze',
+        action='store_true',
+        help='Time every path directory and flag missing, duplicate, empty and slow ones, and empty entries,'
+             ' which mean the current directory',
+    )
+    index_options.add_argument(
+        '--emit-optimized',
+        action='store_true',
+        help='Print an `export PATH=...` command without the missing and duplicate path directories and the'
+             ' empty entries',
+    )
+    parser.add_argument(
+        '--drop-empty',
+        action='store_true',
+        help='With --emit-optimized, also leave out path directories without executables',
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=ANALYZE_TIMEOUT,
+        help=f'Give up on path directories that take longer than this many seconds. Default: {ANALYZE_TIMEOUT}',
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Rescan every path directory instead of using the cached executable index',
+    )
+    args = parser.parse_args(argv)
+
+    if args.analyze or args.emit_optimized:
+        healths = analyze(path_dirs(args.search, args.ignore, keep_empty=True), args.timeout)
+        if args.analyze:
+            print_analysis(healths)
+        else:
+            for health in healths:
+                if not health.directory:
+                    print('Warning: dropped an empty entry, which means the current directory', file=sys.stderr)
+                elif health.timed_out:
+                    print(f'Warning: kept {health.directory}, which timed out', file=sys.stderr)
+            print(f'export PATH={shlex.quote(os.pathsep.join(optimized_dirs(healths, args.drop_empty)))}')
+    elif args.which or args.shadowed:
+        index = PathIndex(path_dirs(args.search, args.ignore), refresh=args.refresh)
+        if args.which:
+            return print_which(index, args.which)
+        print_shadowed(index)
+    else:
+        prettypath(search_pattern=args.search, ignore_pattern=args.ignore)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
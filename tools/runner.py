@@ -0,0 +1,393 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+
+# Telegram messages are limited to 4096 characters, so there is no point in keeping more than this by default.
+DEFAULT_OUTPUT_LIMIT = 3000
+
+CHUNK_SIZE = 64 * 1024
+
+# After a timeout, the job's process group gets SIGTERM, and SIGKILL if it is still running this much later.
+KILL_GRACE = 5.0
+# How often a run checks whether it was cancelled, see `run_command()`.
+CANCEL_POLL_INTERVAL = 0.1
+# The exit code of a run that timed out, like that of `timeout(1)`.
+TIMEOUT_EXIT_CODE = 124
+
+# What programs typically print when an allocation fails, e.g. because of `Limits.max_rss`.
+OUT_OF_MEMORY_PATTERN = re.compile(r'MemoryError|[Cc]annot allocate memory|[Oo]ut of memory|bad_alloc')
+
+
+class OutputBuffer:
+    """Keep the first and last `limit // 2` bytes of a stream, no matter how much is written to it."""
+
+    def __init__(self, limit: int = DEFAULT_OUTPUT_LIMIT):
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        if len(self.head) < self.head_limit:
+            room = self.head_limit - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+        if data and self.tail_limit:
+            self.tail += data[-self.tail_limit:]
+            excess = len(self.tail) - self.tail_limit
+            if excess > 0:
+                del self.tail[:excess]
+
+    @property
+    def omitted(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self, encoding: str = 'utf-8') -> str:
+        """Decode the kept output, marking where bytes were left out."""
+        head = self.head.decode(encoding, errors='replace')
+        if not self.tail:
+            return head
+        tail = self.tail.decode(encoding, errors='replace')
+        if self.omitted:
+            return f'{head}\n[... {self.omitted} bytes omitted ...]\n{tail}'
+        return head + tail
+
+
+@dataclass
+class ResourceUsage:
+    """What a run cost. Everything but `wall` covers the child and all the descendants it waited for.
+
+    Only `wall` is measured on platforms without `os.wait4()`, e.g. Windows. The other fields are None there.
+    """
+    wall: float
+    user: Optional[float] = None
+    sys: Optional[float] = None
+    max_rss: Optional[int] = None
+    in_blocks: Optional[int] = None
+    out_blocks: Optional[int] = None
+    voluntary_switches: Optional[int] = None
+    involuntary_switches: Optional[int] = None
+
+    @classmethod
+    def from_rusage(cls, wall: float, rusage) -> 'ResourceUsage':
+        # `ru_maxrss` is in kilobytes on Linux, but already in bytes on macOS.
+        max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        return cls(
+            wall=wall,
+            user=rusage.ru_utime,
+            sys=rusage.ru_stime,
+            max_rss=max_rss,
+            in_blocks=rusage.ru_inblock,
+            out_blocks=rusage.ru_oublock,
+            voluntary_switches=rusage.ru_nvcsw,
+            involuntary_switches=rusage.ru_nivcsw,
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def format(self) -> str:
+        """Describe the usage in one human-readable line."""
+        parts = [f'wall {self.wall:.2f} s']
+        if self.user is not None:
+            parts += [
+                f'CPU {self.user:.2f} s user + {self.sys:.2f} s sys',
+                f'peak RSS {self.max_rss / 2 ** 20:.1f} MiB',
+                f'I/O {self.in_blocks} blocks in / {self.out_blocks} out',
+                f'context switches {self.voluntary_switches} voluntary / {self.involuntary_switches} involuntary',
+            ]
+        return ', '.join(parts)
+
+
+@dataclass
+class Limits:
+    """Resource limits of a run. Each of them is off if None.
+
+    `max_rss` is enforced as `RLIMIT_AS`, the size of the address space, in bytes: Linux ignores `RLIMIT_RSS`.
+    Allocations beyond it fail. `cpu_seconds` is the CPU time after which the kernel sends SIGXCPU, and SIGKILL
+    one second later. Both apply to every process of the job on their own, and are ignored where the `resource`
+    module isn't available, e.g. on Windows.
+    """
+    timeout: Optional[float] = None
+    max_rss: Optional[int] = None
+    cpu_seconds: Optional[int] = None
+
+    def rlimits(self) -> Dict[str, Tuple[int, int]]:
+        """Return the `resource.RLIMIT_*` names and (soft, hard) limits to set in the child process."""
+        rlimits = {}
+        if self.max_rss is not None:
+            rlimits['RLIMIT_AS'] = (self.max_rss, self.max_rss)
+        if self.cpu_seconds is not None:
+            rlimits['RLIMIT_CPU'] = (self.cpu_seconds, self.cpu_seconds + 1)
+        return rlimits
+
+    def preexec_fn(self) -> Optional[Callable[[], None]]:
+        """Return a function that applies the limits between `fork()` and `exec()`, or None if there are none."""
+        rlimits = self.rlimits()
+        if not rlimits:
+            return None
+        try:
+            import resource
+        except ImportError:
+            return None
+        # Resolved before forking: the child should only call `setrlimit()`, which takes no locks.
+        resolved = [(getattr(resource, name), limit) for name, limit in rlimits.items()]
+
+        def apply():
+            for resource_id, limit in resolved:
+                resource.setrlimit(resource_id, limit)
+
+        return apply
+
+
+@dataclass
+class RunResult:
+    command: str
+    returncode: int
+    stdout: OutputBuffer
+    stderr: OutputBuffer
+    usage: Optional[ResourceUsage] = None
+    # Why the run was stopped or failed, if it was because of its `Limits` or a signal, e.g. "timed out after 60 s".
+    cause: Optional[str] = None
+
+
+def _wait(process: subprocess.Popen, start: float) -> ResourceUsage:
+    """Wait for `process` to exit and measure what it used."""
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return ResourceUsage(time.monotonic() - start)
+    # Unlike `getrusage(RUSAGE_CHILDREN)`, this only counts this child, even when other jobs run in parallel.
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return ResourceUsage.from_rusage(wall, rusage)
+
+
+def _pump(pipe: BinaryIO, buffer: OutputBuffer, outputs: List[BinaryIO], lock: threading.Lock):
+    with pipe:
+        while True:
+            data = pipe.read1(CHUNK_SIZE)
+            if not data:
+                break
+            buffer.write(data)
+            with lock:
+                for output in outputs:
+                    output.write(data)
+                    output.flush()
+
+
+def _signal_group(process: subprocess.Popen, sig: int):
+    """Send `sig` to every process of the job, including the grandchildren that the shell started."""
+    if os.name != 'posix':
+        process.kill()
+        return
+    try:
+        # The child leads its own session, so its process group ID is its PID. The group outlives the shell
+        # as long as any of its processes runs, and the PID can't be reused until then.
+        os.killpg(process.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _group_alive(process: subprocess.Popen) -> bool:
+    """Return whether any process of the job's group is still running, not counting zombies."""
+    if os.name != 'posix':
+        return False
+    if os.path.isdir('/proc/self'):
+        # `killpg(pgid, 0)` also succeeds for zombies, which a container's init may take long to reap.
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/stat', 'rb') as file:
+                    # The command name in parentheses may contain spaces, so split after its closing one.
+                    fields = file.read().rsplit(b')', 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            if int(fields[2]) == process.pid and fields[0] != b'Z':
+                return True
+        return False
+    try:
+        os.killpg(process.pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Watchdog:
+    """Stop a run's whole process group once `timeout` expires, `cancel` is set or `interrupt()` is called:
+    SIGTERM first, then SIGKILL for whatever is still running `grace` seconds later."""
+
+    def __init__(
+            self,
+            process: subprocess.Popen,
+            timeout: Optional[float],
+            grace: float,
+            cancel: threading.Event = None,
+    ):
+        self.process = process
+        self.timeout = timeout
+        self.grace = grace
+        self.cancel = cancel
+        self.timed_out = False
+        self.cancelled = False
+        self._wake = threading.Event()
+        self._finished = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'watchdog-{process.pid}', daemon=True)
+        self._thread.start()
+
+    def _wait_for_trigger(self) -> bool:
+        """Wait until the run has to be stopped or is over. Return whether the timeout expired."""
+        if self.cancel is None:
+            return not self._wake.wait(self.timeout)
+        # Nothing can wait for two events at once, so check `cancel` every CANCEL_POLL_INTERVAL.
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self.cancel.is_set():
+            interval = CANCEL_POLL_INTERVAL
+            if deadline is not None:
+                interval = min(interval, deadline - time.monotonic())
+                if interval <= 0:
+                    return True
+            if self._wake.wait(interval):
+                return False
+        return False
+
+    def _run(self):
+        expired = self._wait_for_trigger()
+        if self._finished.is_set():
+            return
+        self.timed_out = expired
+        self.cancelled = not expired and self.cancel is not None and self.cancel.is_set()
+        _signal_group(self.process, signal.SIGTERM)
+        # Even once the shell was reaped, grandchildren that ignore SIGTERM may still be running.
+        deadline = time.monotonic() + self.grace
+        while _group_alive(self.process) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        _signal_group(self.process, signal.SIGKILL)
+
+    def interrupt(self):
+        self._wake.set()
+
+    def finish(self):
+        """Call once the run is over and its process was reaped. Waits for the group to be gone if it was stopped."""
+        self._finished.set()
+        self._wake.set()
+        self._thread.join()
+
+
+def _describe_cause(returncode: int, stderr: OutputBuffer, usage: ResourceUsage, limits: Limits) \
+        -> Optional[str]:
+    """Explain a failed run that didn't time out, if it was killed by a signal or hit one of its limits."""
+    if not returncode:
+        return None
+    cpu = (usage.user or 0.0) + (usage.sys or 0.0)
+    xcpu = getattr(signal, 'SIGXCPU', 0)
+    # A shell reports a child killed by a signal as 128 + the signal number.
+    if limits.cpu_seconds is not None and (returncode in (-xcpu, 128 + xcpu) or cpu >= limits.cpu_seconds):
+        return f'exceeded the CPU time limit of {limits.cpu_seconds} s'
+    if limits.max_rss is not None and OUT_OF_MEMORY_PATTERN.search(stderr.text()):
+        return f'ran out of memory with a limit of {limits.max_rss / 2 ** 20:.0f} MiB'
+    if returncode < 0:
+        try:
+            return f'killed by {signal.Signals(-returncode).name}'
+        except ValueError:
+            return f'killed by signal {-returncode}'
+    return None
+
+
+def run_command(
+        command: str,
+        cwd: str = None,
+        env: Dict[str, str] = None,
+        tee: bool = True,
+        log_path: str = None,
+        output_limit: int = DEFAULT_OUTPUT_LIMIT,
+        limits: Limits = None,
+        kill_grace: float = KILL_GRACE,
+        outputs: List[BinaryIO] = None,
+        cancel: threading.Event = None,
+) -> RunResult:
+    """Run `command` in a shell, streaming its stdout and stderr as they are produced.
+
+    `cwd` and `env` apply to the child process only, so it's safe to call this from several threads at once.
+    The output is copied to this process' stdout/stderr if `tee` is True, to `log_path` if given and to every
+    file-like object in `outputs`, e.g. a `LogArchiveWriter`. Writes to them never overlap.
+    Only a bounded excerpt of each stream is kept in memory; see `OutputBuffer`.
+
+    The command runs in a new session with `limits` applied. If it is still running after `limits.timeout`
+    seconds, once `cancel` is set, or if this process is interrupted, e.g. by Ctrl+C, its whole process group is
+    terminated. A run that timed out returns `TIMEOUT_EXIT_CODE`.
+    """
+    limits = limits or Limits()
+    stdout, stderr = OutputBuffer(output_limit), OutputBuffer(output_limit)
+    log_file: Optional[BinaryIO] = open(log_path, 'ab') if log_path else None
+    extra_outputs = outputs or []
+    lock = threading.Lock()
+    # Anything already printed has to come out before the child's output, which bypasses the text layer.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        start = time.monotonic()
+        process = subprocess.Popen(
+            command,
+            shell=True,
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=os.name == 'posix',
+            preexec_fn=limits.preexec_fn(),
+        )
+        pumps = []
+        for pipe, buffer, terminal in (
+                (process.stdout, stdout, getattr(sys.stdout, 'buffer', None)),
+                (process.stderr, stderr, getattr(sys.stderr, 'buffer', None)),
+        ):
+            pump_outputs = [output for output in (terminal if tee else None, log_file) if output] + extra_outputs
+            pump = threading.Thread(target=_pump, args=(pipe, buffer, pump_outputs, lock), daemon=True)
+            pump.start()
+            pumps.append(pump)
+
+        watchdog = None
+        if limits.timeout is not None or cancel is not None:
+            watchdog = _Watchdog(process, limits.timeout, kill_grace, cancel)
+        try:
+            for pump in pumps:
+                pump.join()
+            usage = _wait(process, start)
+        except BaseException:
+            # The child is in its own session, so it doesn't get the terminal's SIGINT. Take it down with us.
+            if watchdog:
+                watchdog.interrupt()
+            else:
+                watchdog = _Watchdog(process, 0, kill_grace)
+            for pump in pumps:
+                pump.join()
+            _wait(process, start)
+            raise
+        finally:
+            if watchdog:
+                watchdog.finish()
+    finally:
+        if log_file:
+            log_file.close()
+
+    if watchdog and watchdog.timed_out:
+        return RunResult(
+            command, TIMEOUT_EXIT_CODE, stdout, stderr, usage, f'timed out after {limits.timeout:g} s'
+        )
+    if watchdog and watchdog.cancelled:
+        return RunResult(command, process.returncode, stdout, stderr, usage, 'was cancelled')
+    cause = _describe_cause(process.returncode, stderr, usage, limits)
+    return RunResult(command, process.returncode, stdout, stderr, usage, cause)
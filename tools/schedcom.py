@@ -2,22 +2,80 @@
 
 import argparse
 import datetime
+import json
 import re
 import time
 import subprocess
 import os
-from typing import Optional, Union
+import signal
+import sys
+import threading
+from typing import TYPE_CHECKING, List, Optional, Union
 
-from utils import load_env_file, print_and_exit
-from tools.ckcyberbot import Bot
+if not __package__:
+    # Run as a script, e.g. through the `tools/schedcom` symlink: make the `tools` package importable.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+from tools.exceptions import DaemonNotRunningError, JobFileError, ScheduleError, SchedulerError
+from tools.utils import load_env_file, print_and_exit
 
-def parse_args():
+# Only what parsing the arguments needs is imported up front. The runner, the scheduler and its daemon client,
+# the Telegram bot (`http.client`, `ssl`, `email`), the notification spool and the batch runner are imported
+# where they are used, so that e.g. `--help` or a job without `--notify` doesn't pay for them. That's why the
+# defaults in the help texts below are spelled out. See `benchmarks/startup_bench.py`.
+if TYPE_CHECKING:
+    from tools.batch import BatchJob, BatchResult
+    from tools.ckcyberbot import Bot
+    from tools.history import History
+    from tools.live import LiveMessage
+    from tools.logarchive import LogArchiveWriter
+    from tools.runner import Limits, RunResult
+    from tools.scheduler import Job, SchedulerDaemon
+    from tools.spool import Spool, SpoolFlusher
+    from tools.telemetry import Telemetry
+    from tools.updates import UpdatePoller
+    from tools.watch import Watcher
+
+
+ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+
+# If the first argument is one of these, it's treated as a subcommand instead of a command to schedule.
+SUBCOMMANDS = ('daemon', 'list', 'cancel', 'spool', 'history', 'stats', 'logs')
+
+# Notifications are queued here and sent by a `SpoolFlusher`, so that jobs never wait for Telegram.
+_spool: Optional['Spool'] = None
+
+# Every run is recorded here, see `get_history()`.
+_history: Optional['History'] = None
+
+# Events and metrics for monitoring, if configured, see `get_telemetry()`.
+_telemetry: Optional['Telemetry'] = None
+_telemetry_loaded = False
+
+# Exit codes for errors in the command line options.
+EXIT_BAD_SCHEDULE = 5
+
+
+def parse_args(argv: List[str] = None):
     parser = argparse.ArgumentParser(description='Schedule a task and/or get notified when it finishes')
     parser.add_argument(
         'command',
+        nargs='?',
         help='The command to be scheduled. Surround the command with quotation marks if it contains spaces.'
     )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='run every job of a TOML or JSON job file instead of a single command, respecting their `depends_on`',
+        metavar='JOBFILE'
+    )
+    parser.add_argument(
+        '-p',
+        '--max-parallel',
+        help='with `--jobs`, the maximum number of jobs to run at the same time. Default: the number of CPUs',
+        type=int,
+        metavar='N'
+    )
 
     parser.add_argument(
         '-n',
@@ -25,8 +83,26 @@ def parse_args():
         help='Send a notification message via Telegram after the command is finished executing',
         action='store_true'
     )
+    parser.add_argument(
+        '--notify-start',
+        help='Also send a notification when the command starts, with an estimate of when it will finish'
+             ' based on its previous runs',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--live',
+        help='send one message when the command starts and keep editing it to show the elapsed time and the'
+             ' latest output lines, until it becomes the completion message. Implies `--notify`',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--live-lines',
+        help='with `--live`, how many of the latest output lines to show. Default: 10',
+        type=int,
+        metavar='N'
+    )
 
-    # `--at` and `--in` are mutually exclusive. They can't both be used in the same command.
+    # `--at`, `--in`, `--cron` and `--every` are mutually exclusive. Only one can be used in the same command.
     delay_options = parser.add_mutually_exclusive_group()
     delay_options.add_argument(
         '-a',
@@ -41,27 +117,888 @@ def parse_args():
         metavar='DELAY',
         help='run the command after a delay. Example: "1d3h36m34s"'
     )
+    delay_options.add_argument(
+        '-c',
+        '--cron',
+        help='run the command repeatedly on a cron schedule. Requires a running `schedcom daemon`.'
+             ' Example: "*/15 9-17 * * mon-fri"',
+        metavar='EXPRESSION'
+    )
+    delay_options.add_argument(
+        '-e',
+        '--every',
+        help='run the command repeatedly at this interval, the first time after one interval. Requires a running'
+             ' `schedcom daemon`. Example: "15m"',
+        metavar='DELAY'
+    )
+    delay_options.add_argument(
+        '-w',
+        '--on-change',
+        help='run the command whenever one of these files, or anything in these directories, changes, until'
+             ' stopped with Ctrl+C. Separate several paths with commas. Requires Linux',
+        metavar='PATH[,PATH...]'
+    )
+    delay_options.add_argument(
+        '--after-pid',
+        help='run the command and/or send the `--notify` message once the process with this PID, which may have'
+             ' been started anywhere, exits',
+        type=int,
+        metavar='PID'
+    )
+    delay_options.add_argument(
+        '--after-pid-file',
+        help='like `--after-pid`, with the PID read from a file, e.g. /run/nginx.pid',
+        metavar='FILE'
+    )
+    parser.add_argument(
+        '--debounce',
+        help='with `--on-change`, wait until nothing changed for this many seconds, so that a burst of changes'
+             ' starts only one run. Default: 0.5',
+        type=float,
+        metavar='SECONDS'
+    )
+    parser.add_argument(
+        '--restart',
+        help='with `--on-change`, stop a run that is still going when more changes arrive, and start over',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--misfire',
+        help='what to do with the runs a recurring command missed while the daemon or the machine was down:'
+             ' run it "once" (default), run "all" of them or "skip" them',
+        choices=('once', 'all', 'skip'),
+        default='once'
+    )
+
+    parser.add_argument(
+        '-l',
+        '--log',
+        help='also append the command\'s stdout and stderr to this file',
+        metavar='LOGFILE'
+    )
+    parser.add_argument(
+        '--attach-log',
+        help='with `--notify` and `--log`, also send the log file. Files over 1 MiB are gzipped',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--archive',
+        help='also keep the whole output of the run, compressed with FORMAT, in ~/.local/state/ck/logs.'
+             ' See `schedcom logs`',
+        # See `tools.logarchive.FORMATS`, which isn't imported up front.
+        choices=('gzip', 'xz'),
+        metavar='FORMAT'
+    )
+    parser.add_argument(
+        '--archive-budget',
+        help='with `--archive`, delete the oldest archived runs once all of them take up more than this.'
+             ' Default: 1G',
+        metavar='SIZE'
+    )
+    parser.add_argument(
+        '--archive-max-age',
+        help='with `--archive`, delete the archived runs that are older than this. Default: "30d"',
+        metavar='DELAY'
+    )
+    parser.add_argument(
+        '--output-limit',
+        help='how many bytes of stdout or stderr to keep for the final message (first and last half).'
+             ' Default: 3000',
+        type=int,
+        metavar='BYTES'
+    )
 
-    return parser.parse_args()
+    parser.add_argument(
+        '--usage-json',
+        help='write the wall time, CPU time, peak RSS, block I/O and context switches of the run as JSON:'
+             ' to stdout if FILE is "-", or else appended to FILE as one line per run',
+        metavar='FILE'
+    )
 
+    parser.add_argument(
+        '-t',
+        '--timeout',
+        help='stop the command and everything it started if it runs longer than this:'
+             ' SIGTERM first, then SIGKILL 5 s later. Example: "1h30m"',
+        metavar='DELAY'
+    )
+    parser.add_argument(
+        '--max-rss',
+        help='limit the memory of each process of the command. Allocations beyond it fail.'
+             ' Example: "512M". Units: K, M, G',
+        metavar='SIZE'
+    )
+    parser.add_argument(
+        '--cpu-seconds',
+        help='kill each process of the command once it used this much CPU time',
+        type=int,
+        metavar='SECONDS'
+    )
 
-if __name__ == '__main__':
-    args = parse_args()
+    parser.add_argument(
+        '--no-daemon',
+        help='wait for the delay in this process, even if a `schedcom daemon` is running',
+        action='store_true'
+    )
 
-    delay: Union[int, float] = 0
+    args = parser.parse_args(argv)
+    if args.command and args.jobs:
+        parser.error('either a command or `--jobs` is required, but not both')
+    if not args.command and not args.jobs:
+        if args.after_pid is None and not args.after_pid_file:
+            parser.error('either a command or `--jobs` is required, but not both')
+        if not args.notify:
+            parser.error('`--after-pid` and `--after-pid-file` require a command, `--jobs` or `--notify`')
+    if args.max_parallel is not None and args.max_parallel < 1:
+        parser.error('`--max-parallel` must be at least 1')
+    if args.attach_log and not args.log:
+        parser.error('`--attach-log` requires `--log`')
+    if (args.debounce is not None or args.restart) and not args.on_change:
+        parser.error('`--debounce` and `--restart` require `--on-change`')
+    if args.on_change and args.jobs:
+        parser.error('`--on-change` can\'t be combined with `--jobs`')
+    if args.live:
+        if args.jobs:
+            parser.error('`--live` can\'t be combined with `--jobs`')
+        if args.live_lines is not None and args.live_lines < 0:
+            parser.error('`--live-lines` must be at least 0')
+        args.notify = True
+    if (args.archive_budget or args.archive_max_age) and not args.archive:
+        parser.error('`--archive-budget` and `--archive-max-age` require `--archive`')
+    if args.archive_budget is not None:
+        args.archive_budget = parse_size(args.archive_budget)
+        if not args.archive_budget:
+            parser.error('`--archive-budget` must be a size like "512M" or "2G"')
+    if args.archive_max_age is not None:
+        args.archive_max_age = parse_delay(args.archive_max_age)
+        if not args.archive_max_age:
+            parser.error('`--archive-max-age` must be a delay like "30d" or "12h"')
+    if args.timeout is not None:
+        args.timeout = parse_delay(args.timeout)
+        if not args.timeout:
+            parser.error('`--timeout` must be a delay like "90s" or "1h30m"')
+    if args.max_rss is not None:
+        args.max_rss = parse_size(args.max_rss)
+        if not args.max_rss:
+            parser.error('`--max-rss` must be a size like "512M" or "2G"')
+    if args.cpu_seconds is not None and args.cpu_seconds < 1:
+        parser.error('`--cpu-seconds` must be at least 1')
+    return args
 
-    if args.notify:
-        env = {}
-        env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+
+def parse_subcommand_args(argv: List[str]):
+    parser = argparse.ArgumentParser(description='Manage the schedcom daemon and its jobs')
+    subparsers = parser.add_subparsers(dest='subcommand', required=True)
+    daemon_parser = subparsers.add_parser(
+        'daemon',
+        help='run the scheduler daemon in the foreground. `--at` and `--in` jobs are then submitted to it'
+    )
+    daemon_parser.add_argument(
+        '--chat-commands',
+        help='answer /jobs and /cancel ID messages sent to the Telegram bot from its chat',
+        action='store_true'
+    )
+    subparsers.add_parser('list', help='list the jobs pending in the daemon')
+    cancel_parser = subparsers.add_parser('cancel', help='cancel a job pending in the daemon')
+    cancel_parser.add_argument('id', help='the ID of the job, as shown by `schedcom list`')
+    spool_parser = subparsers.add_parser(
+        'spool',
+        help='show the notifications waiting to be sent, or send them now'
+    )
+    spool_parser.add_argument('action', choices=('status', 'flush'), nargs='?', default='status')
+    history_parser = subparsers.add_parser('history', help='list the most recent runs')
+    history_parser.add_argument('command', nargs='?', help='only list the runs of this command')
+    history_parser.add_argument('-n', '--limit', type=int, default=20, help='how many runs to list. Default: 20')
+    stats_parser = subparsers.add_parser(
+        'stats',
+        help='show the number of runs, failure rate and p50/p95 durations of every command'
+    )
+    stats_parser.add_argument('command', nargs='?', help='only show the statistics of this command')
+    logs_parser = subparsers.add_parser(
+        'logs',
+        help='list the runs archived with `--archive`, or print the output of one of them'
+    )
+    logs_parser.add_argument(
+        'run',
+        nargs='?',
+        help='the ID of the run, the start of it, e.g. a date like 20240131, or the ID of its job for its latest run'
+    )
+    logs_range = logs_parser.add_mutually_exclusive_group()
+    logs_range.add_argument('-n', '--tail', type=int, help='only print the last LINES lines', metavar='LINES')
+    logs_range.add_argument('--offset', type=int, default=0, help='start printing at this byte', metavar='BYTES')
+    logs_parser.add_argument('--length', type=int, help='print at most this many bytes', metavar='BYTES')
+    return parser.parse_args(argv)
+
+
+def parse_delay(in_str: str) -> Optional[float]:
+    """Convert a delay string like "1d3h36m34s" to seconds. Return None if it isn't a valid delay."""
+    match = re.match(r'^(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$', in_str)
+
+    if not match:
+        return None
+
+    days, hours, minutes, seconds = match.groups()
+
+    td = datetime.timedelta(
+        days=int(days) if days else 0,
+        hours=int(hours) if hours else 0,
+        minutes=int(minutes) if minutes else 0,
+        seconds=int(seconds) if seconds else 0
+    )
+
+    return td.total_seconds()
+
+
+def parse_size(size_str: str) -> Optional[int]:
+    """Convert a size like "512M" or "2G" to bytes. A number without a unit is in bytes. Return None if it isn't
+    a valid size."""
+    match = re.match(r'^(\d+)(?:([KMG])i?)?B?$', size_str.strip(), re.IGNORECASE)
+    if not match:
+        return None
+    number, unit = match.groups()
+    return int(number) * 1024 ** ' KMG'.index(unit.upper() if unit else ' ')
+
+
+def load_bot() -> 'Bot':
+    """Create a `Bot` from the `.env` file next to this script, or exit with an error message."""
+    from tools.ckcyberbot import API_URL, Bot
+
+    env = {}
+    try:
+        env = load_env_file(ENV_PATH)
+    except FileNotFoundError:
+        print_and_exit(f'Error: "{ENV_PATH}" not found')
+    telemetry = get_telemetry()
+    try:
+        return Bot(
+            env['TELEGRAM_TOKEN'],
+            env['TELEGRAM_CHAT_ID'],
+            env.get('TELEGRAM_API_URL', API_URL),
+            on_call=telemetry.api_call if telemetry else None,
+        )
+    except KeyError:
+        print_and_exit('Error: .env file requires `TELEGRAM_TOKEN` and `TELEGRAM_CHAT_ID`,'
+                       ' but at least one of them cannot be found')
+
+
+def run_and_report(job: 'Job', bot: 'Bot' = None, cancel: threading.Event = None):
+    """Run a job's command in a shell, print whether it succeeded and send the same message with `bot`, if given.
+
+    The command's output is streamed to the terminal as it runs, so only the status and resource usage are
+    printed afterwards. The message sent with `bot` also contains an excerpt of stderr on failure or stdout on
+    success. With `job.live`, that message is the live message that was sent at the start, edited. Setting
+    `cancel` stops the run; a cancelled run is neither recorded nor notified about.
+    """
+    from tools.history import RunRecord
+    from tools.runner import run_command
+
+    history = get_history()
+    eta = format_eta(history, job.command) if history else ''
+    print(f'executing...{f" ({eta})" if eta else ""}')
+    live: Optional['LiveMessage'] = None
+    if bot and job.live:
+        from tools.live import LiveMessage
+
+        live = LiveMessage(bot, job.command, job.live_lines).start()
+    elif bot and job.notify_start:
+        notify(bot, f'Started "{job.command}".{f" {eta[0].upper()}{eta[1:]}." if eta else ""}')
+    started = time.time()
+    emit('job_started', job_id=job.id, command=job.command)
+    archive = open_archive(job.command, started, job.archive, job.id, job.archive_budget, job.archive_max_age) \
+        if job.archive else None
+    result: Optional['RunResult'] = None
+    try:
+        result = run_command(
+            job.command,
+            cwd=job.cwd,
+            env=job.env,
+            log_path=job.log,
+            output_limit=job.output_limit,
+            limits=job.limits,
+            outputs=[output for output in (archive, live) if output] or None,
+            cancel=cancel,
+        )
+    finally:
+        if archive:
+            close_archive(archive, result)
+    emit_finished(job.id, result)
+    if result.cause == 'was cancelled':
+        print(f'"{job.command}" was cancelled.')
+        if live:
+            live.finish(f'"{job.command}" was cancelled.')
+        return
+    if history:
+        history.record(RunRecord.from_result(result, started, job.id))
+
+    if result.returncode:
+        status = f'"{job.command}" did not run successfully{f": it {result.cause}" if result.cause else ""}.'
+        output = result.stderr.text()
+    else:
+        status = f'"{job.command}" executed successfully!'
+        output = result.stdout.text()
+    usage = result.usage.format()
+    print(status)
+    print(usage)
+    if job.usage_json:
+        write_usage_json(job.usage_json, result)
+    if bot and job.notify:
+        msg = f'{status}\n{usage}'
+        # The live message can only hold the end of a long output. It is sent as a new message if it couldn't
+        # be sent or edited.
+        if not (live and live.finish(msg, output)):
+            notify(bot, f'{msg}\n\n{output}' if output else msg)
+        if job.attach_log and job.log:
+            notify(bot, f'Output of "{job.command}"', document=job.log)
+
+
+def watch_and_run(args, bot: Optional['Bot']):
+    """Run the command every time one of the `--on-change` paths changes, until interrupted."""
+    from tools.exceptions import WatchError
+    from tools.watch import DEBOUNCE, Watcher
+
+    paths = [path for path in args.on_change.split(',') if path]
+    debounce = DEBOUNCE if args.debounce is None else args.debounce
+    try:
+        # A log file in a watched directory would otherwise trigger a new run with every run.
+        watcher = Watcher(paths, ignore=[args.log] if args.log else [])
+    except WatchError as e:
+        print_and_exit(f'Error: {e}')
+    count = watcher.watch_count
+    print(f'Watching {", ".join(paths)} ({count} {"directory" if count == 1 else "directories"}) for changes.'
+          ' Stop with Ctrl+C.')
+
+    def describe(changed: List[str]) -> str:
+        shown = ', '.join(os.path.relpath(path) for path in changed[:3])
+        return f'{shown} and {len(changed) - 3} more' if len(changed) > 3 else shown
+
+    with watcher:
         try:
-            env = load_env_file(env_path)
-        except FileNotFoundError:
-            print_and_exit(f'Error: "{env_path}" not found')
+            changed = watcher.wait(debounce)
+            while True:
+                print(f'Changed: {describe(changed)}')
+                job = job_from_args(args, time.time())
+                if not args.restart:
+                    run_and_report(job, bot)
+                    start_flusher()
+                    # Changes made during the run are still queued, and start one more run right away.
+                    changed = watcher.wait(debounce)
+                    continue
+                cancel = threading.Event()
+                run = threading.Thread(target=run_and_report, args=(job, bot, cancel), name=f'job-{job.id}')
+                run.start()
+                changed = []
+                try:
+                    while run.is_alive() and not changed:
+                        changed = watcher.wait(debounce, timeout=0.5)
+                finally:
+                    if run.is_alive():
+                        # New changes, or Ctrl+C: stop the run before starting over.
+                        cancel.set()
+                    run.join()
+                start_flusher()
+                if not changed:
+                    changed = watcher.wait(debounce)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            close_history()
+
+
+def wait_for_process(args) -> str:
+    """Wait until the process of `--after-pid` or `--after-pid-file` exited and return a message that says so."""
+    from tools.exceptions import ProcessWaitError
+    from tools.history import format_duration
+    from tools.pidwait import describe_process, process_exists, read_pid_file, wait_for_exit
+
+    try:
+        pid = args.after_pid if args.after_pid is not None else read_pid_file(args.after_pid_file)
+        command = describe_process(pid)
+        name = f'{pid}{f" ({command})" if command else ""}'
+        if not process_exists(pid):
+            return f'Process {name} is not running.'
+        print(f'Waiting for process {name} to exit...')
+        start = time.monotonic()
+        wait_for_exit(pid)
+    except ProcessWaitError as e:
+        print_and_exit(f'Error: {e}')
+    return f'Process {name} exited after {format_duration(time.monotonic() - start)} of waiting.'
+
+
+def format_eta(history: 'History', command: str) -> str:
+    """Describe how long the command usually takes and when it should be done, or return '' if nobody knows."""
+    import sqlite3
+    from tools.history import format_duration
+
+    try:
+        estimate = history.estimate(command)
+    except sqlite3.Error as e:
+        print(f'Warning: could not read the run history: {e}')
+        return ''
+    if not estimate:
+        return ''
+    p50, p95 = estimate
+    done = datetime.datetime.now() + datetime.timedelta(seconds=p50)
+    return (f'usually takes {format_duration(p50)}, 95% within {format_duration(p95)},'
+            f' ETA {done.isoformat(sep=" ", timespec="seconds")}')
+
+
+def open_archive(
+        command: str,
+        started: float,
+        log_format: str,
+        job_id: str = None,
+        budget: int = None,
+        max_age: float = None,
+) -> Optional['LogArchiveWriter']:
+    """Start archiving the output of a run, or return None if the archive can't be written to. Like the history,
+    the archive never stops a job."""
+    from tools.logarchive import DEFAULT_BUDGET, DEFAULT_MAX_AGE, LogArchiveWriter, new_run_id
+
+    try:
+        return LogArchiveWriter(
+            new_run_id(started, job_id),
+            command,
+            log_format,
+            job_id=job_id,
+            budget=budget or DEFAULT_BUDGET,
+            max_age=max_age or DEFAULT_MAX_AGE,
+        )
+    except OSError as e:
+        print(f'Warning: could not archive the output: {e}')
+        return None
+
+
+def close_archive(archive: 'LogArchiveWriter', result: Optional['RunResult']):
+    try:
+        archive.close(result.returncode if result else None)
+    except OSError as e:
+        print(f'Warning: could not archive the output: {e}')
+    else:
+        print(f'Output archived as run {archive.run_id}. See `schedcom logs {archive.run_id}`.')
+
+
+def write_usage_json(path: str, result: 'RunResult'):
+    """Write the resource usage of a run as JSON, to stdout if `path` is "-" or else appended as one line."""
+    line = json.dumps({
+        'command': result.command,
+        'returncode': result.returncode,
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        **result.usage.to_dict(),
+    })
+    if path == '-':
+        print(line)
+    else:
+        with open(path, 'a') as file:
+            file.write(line + '\n')
+
+
+def run_and_report_batch(path: str, max_parallel: int = None, bot: 'Bot' = None, limits: 'Limits' = None,
+                         archive: dict = None):
+    """Run every job of a job file and print and send one summary once all of them are finished.
+
+    `limits` apply to each job on its own. With `archive`, the `open_archive()` options, the output of every job
+    is archived as a run of its own.
+    """
+    from tools.batch import load_jobs, run_batch, run_job, summarize
+    from tools.history import RunRecord
+
+    try:
+        jobs = load_jobs(path)
+    except FileNotFoundError:
+        print_and_exit(f'Error: "{path}" not found')
+    except JobFileError as e:
+        print_and_exit(f'Error: {e}')
+
+    history = get_history()
+
+    def print_progress(batch_result: 'BatchResult'):
+        print(f'{batch_result.job.name}: {batch_result.status}')
+        if batch_result.result:
+            emit_finished(batch_result.job.name, batch_result.result)
+        if history and batch_result.result:
+            started = time.time() - batch_result.result.usage.wall
+            history.record(RunRecord.from_result(batch_result.result, started))
+
+    def run_archived(job: 'BatchJob') -> 'RunResult':
+        emit('job_started', job_id=job.name, command=job.command)
+        writer = open_archive(job.command, time.time(), **archive) if archive else None
+        result: Optional['RunResult'] = None
+        try:
+            result = run_job(job, limits=limits, outputs=[writer] if writer else None)
+        finally:
+            if writer:
+                close_archive(writer, result)
+        return result
+
+    print(f'executing {len(jobs)} jobs...')
+    results = run_batch(jobs, max_parallel, run_archived, on_done=print_progress)
+    summary = summarize(results, f'Batch "{os.path.basename(path)}"')
+    print(summary)
+    if bot:
+        notify(bot, summary)
+
+
+def get_spool() -> 'Spool':
+    from tools.spool import Spool
+
+    global _spool
+    if _spool is None:
+        _spool = Spool()
+    return _spool
+
+
+def get_history() -> Optional['History']:
+    """Return the run history, or None if its database can't be opened. The history never stops a job."""
+    import sqlite3
+    from tools.history import History
+
+    global _history
+    if _history is None:
+        try:
+            _history = History()
+        except (sqlite3.Error, OSError) as e:
+            print(f'Warning: could not open the run history: {e}')
+    return _history
+
+
+def close_history():
+    """Write the runs that are still buffered to the history database."""
+    if _history is not None:
+        _history.close()
+
+
+def get_telemetry() -> Optional['Telemetry']:
+    """Return the telemetry configured by `CK_EVENT_LOG` and `CK_METRICS_FILE`, in the environment or the `.env`
+    file, or None if there is none. Like the history, telemetry never stops a job."""
+    global _telemetry, _telemetry_loaded
+    if not _telemetry_loaded:
+        _telemetry_loaded = True
+        env = {}
         try:
-            bot = Bot(env['TELEGRAM_TOKEN'], env['TELEGRAM_CHAT_ID'])
-        except KeyError:
-            print_and_exit('Error: .env file requires `TELEGRAM_TOKEN` and `TELEGRAM_CHAT_ID`,'
-                           ' but at least one of them cannot be found')
+            env = load_env_file(ENV_PATH)
+        except OSError:
+            pass
+        env.update(os.environ)
+        # Checked here, so that `tools.telemetry` is only imported when it's used.
+        if env.get('CK_EVENT_LOG') or env.get('CK_METRICS_FILE'):
+            from tools.telemetry import Telemetry
+
+            try:
+                _telemetry = Telemetry.from_env(env)
+            except OSError as e:
+                print(f'Warning: could not open the telemetry files: {e}')
+    return _telemetry
+
+
+def emit(event: str, **fields):
+    """Emit a telemetry event, if telemetry is configured."""
+    telemetry = get_telemetry()
+    if telemetry:
+        telemetry.emit(event, **fields)
+
+
+def emit_finished(job_id: Optional[str], result: 'RunResult'):
+    if result.cause == 'was cancelled':
+        status = 'cancelled'
+    elif result.cause and result.cause.startswith('timed out'):
+        status = 'timed_out'
+    else:
+        status = 'failed' if result.returncode else 'succeeded'
+    emit(
+        'job_finished',
+        job_id=job_id,
+        command=result.command,
+        status=status,
+        returncode=result.returncode,
+        cause=result.cause,
+        duration=result.usage.wall,
+        user=result.usage.user,
+        sys=result.usage.sys,
+        max_rss=result.usage.max_rss,
+    )
+
+
+def notify(bot: 'Bot', text: str, document: str = None):
+    """Queue a message, or a file with `text` as its caption, to `bot`'s chat without waiting for Telegram.
+    See `start_flusher()`."""
+    get_spool().enqueue(text, bot.chat_id, document)
+    emit('notification_queued', chat_id=bot.chat_id, length=len(text), document=bool(document))
+
+
+def make_flusher(bot: 'Bot') -> 'SpoolFlusher':
+    """Deliver long texts in several messages or as a file, and gzip large documents."""
+    from tools.ckcyberbot import DOCUMENT_THRESHOLD, split_message
+    from tools.spool import SpoolFlusher
+
+    telemetry = get_telemetry()
+    return SpoolFlusher(
+        get_spool(),
+        bot.send_long_message,
+        lambda path, chat_id, caption: bot.send_document(path, chat_id, caption=caption, compress=None),
+        lambda text: [text] if len(text) > DOCUMENT_THRESHOLD else split_message(text),
+        emit=telemetry.emit if telemetry else None,
+    )
+
+
+def start_flusher():
+    """Write the queued messages to disk and start delivering them from a detached `schedcom spool flush`.
+
+    The new process exits right away if another flusher, e.g. the daemon's, is already delivering them.
+    """
+    if _spool is None:
+        return
+    _spool.close()
+    with open(os.path.join(_spool.directory, 'flusher.log'), 'ab') as log_file:
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'spool', 'flush'],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=log_file,
+            start_new_session=True,
+        )
+
+
+def run_job(job: 'Job'):
+    """Run a job that a `SchedulerDaemon` found to be due."""
+    print(f'[{datetime.datetime.now().isoformat(timespec="seconds")}] running job {job.id}: {job.command}')
+    run_and_report(job, load_bot() if job.notify or job.notify_start else None)
+
+
+def serve(chat_commands: bool = False):
+    from tools.scheduler import SchedulerDaemon
+
+    daemon = SchedulerDaemon(run_job)
+    poller = start_chat_commands(daemon) if chat_commands else None
+    flusher: Optional['SpoolFlusher'] = None
+    if os.path.exists(ENV_PATH):
+        flusher = make_flusher(load_bot())
+        threading.Thread(target=flusher.run, name='spool-flusher', daemon=True).start()
+
+    def stop(*_):
+        # `shutdown()` blocks until `serve_forever()` returns, so it can't run in the main thread.
+        threading.Thread(target=daemon.shutdown).start()
+        if flusher:
+            flusher.stop()
+        if poller:
+            poller.stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f'schedcom daemon listening on {daemon.socket_path} with {len(daemon.queue)} pending job(s)')
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except SchedulerError as e:
+        print_and_exit(f'Error: {e}')
+    finally:
+        close_history()
+
+
+def format_job(job: 'Job') -> str:
+    at = datetime.datetime.fromtimestamp(job.deadline).isoformat(timespec='seconds')
+    schedule = job.schedule
+    return (f'{job.id}  {at}  {f"[{schedule}] " if schedule else ""}'
+            f'{"[notify] " if job.notify else ""}{job.command}')
+
+
+def start_chat_commands(daemon: 'SchedulerDaemon') -> 'UpdatePoller':
+    """Answer /jobs and /cancel messages from the bot's chat in a background thread."""
+    from tools.updates import UpdatePoller
+
+    poller = UpdatePoller(load_bot())
+
+    @poller.command('jobs')
+    def list_jobs(*_) -> str:
+        jobs = daemon.queue.list()
+        return '\n'.join(format_job(job) for job in jobs) if jobs else 'No pending jobs.'
+
+    @poller.command('cancel')
+    def cancel_job(_bot, _message, args: List[str]) -> str:
+        if len(args) != 1:
+            return 'Usage: /cancel ID'
+        response = daemon.handle_request({'op': 'cancel', 'id': args[0]})
+        return f'Cancelled job {args[0]}.' if response['ok'] else f'Error: {response["error"]}'
+
+    threading.Thread(target=poller.run, name='bot-poller', daemon=True).start()
+    return poller
+
+
+def call_daemon(request: dict) -> dict:
+    from tools.scheduler import send_request
+
+    try:
+        response = send_request(request)
+    except SchedulerError as e:
+        print_and_exit(f'Error: {e}. Start one with `schedcom daemon`.')
+    if not response['ok']:
+        print_and_exit(f'Error: {response["error"]}')
+    return response
+
+
+def main_subcommand(argv: List[str]):
+    args = parse_subcommand_args(argv)
+
+    if args.subcommand == 'daemon':
+        serve(args.chat_commands)
+    elif args.subcommand == 'list':
+        jobs = call_daemon({'op': 'list'})['jobs']
+        if not jobs:
+            print('No pending jobs.')
+        from tools.scheduler import Job
+
+        for job in jobs:
+            print(format_job(Job.from_dict(job)))
+    elif args.subcommand == 'cancel':
+        call_daemon({'op': 'cancel', 'id': args.id})
+        print(f'Cancelled job {args.id}.')
+    elif args.subcommand == 'spool':
+        if args.action == 'flush':
+            make_flusher(load_bot()).run(until_empty=True)
+        else:
+            messages = get_spool().pending()
+            print(f'{len(messages)} message(s) waiting to be sent.')
+            for message in messages:
+                queued = datetime.datetime.fromtimestamp(message.time).isoformat(timespec='seconds')
+                print(f'{queued}  chat {message.chat_id}: {message.text.splitlines()[0] if message.text else ""}')
+    elif args.subcommand in ('history', 'stats'):
+        print_history(args)
+    elif args.subcommand == 'logs':
+        print_logs(args)
+
+
+def print_logs(args):
+    """List the archived runs, or print the output of one, decompressing only the blocks that are printed."""
+    from tools.exceptions import LogArchiveError
+    from tools.logarchive import find_run, format_size, list_runs
+
+    if not args.run:
+        runs = list_runs()
+        if not runs:
+            print('No archived runs.')
+        for run in runs:
+            status = 'running' if run.finished is None else 'ok' if run.returncode == 0 else f'exit {run.returncode}'
+            print(f'{run.run_id}  {status:>8}  {format_size(run.size):>10}  {format_size(run.disk_usage()):>10}'
+                  f'  {run.command}')
+        return
+
+    try:
+        run = find_run(args.run)
+        if args.tail is not None:
+            sys.stdout.buffer.write(run.tail(args.tail))
+        else:
+            if args.offset < run.first_offset:
+                print(f'[... the first {run.first_offset} bytes were deleted to stay within the budget ...]',
+                      file=sys.stderr)
+            end = args.offset + args.length if args.length is not None else None
+            for chunk in run.iter_bytes(args.offset, end):
+                sys.stdout.buffer.write(chunk)
+        sys.stdout.flush()
+    except LogArchiveError as e:
+        print_and_exit(f'Error: {e}')
+    except BrokenPipeError:
+        # E.g. `schedcom logs RUN | head`. Stop quietly, also when Python flushes stdout on exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def print_history(args):
+    import sqlite3
+    from tools.history import format_duration
+
+    history = get_history()
+    if history is None:
+        exit(1)
+    try:
+        if args.subcommand == 'history':
+            records = history.recent(args.limit, args.command)
+            if not records:
+                print('No runs recorded yet.')
+            for record in records:
+                started = datetime.datetime.fromtimestamp(record.started).isoformat(timespec='seconds')
+                status = 'ok' if record.returncode == 0 else f'exit {record.returncode}'
+                print(f'{started}  {status:>8}  {format_duration(record.duration):>12}  {record.command}')
+        else:
+            stats = history.stats(args.command)
+            if not stats:
+                print('No runs recorded yet.')
+                return
+            print(f'{"runs":>6}  {"failed":>6}  {"p50":>12}  {"p95":>12}  command')
+            for stat in stats:
+                p50 = format_duration(stat.p50) if stat.p50 is not None else '-'
+                p95 = format_duration(stat.p95) if stat.p95 is not None else '-'
+                print(f'{stat.runs:>6}  {stat.failure_rate:>6.0%}  {p50:>12}  {p95:>12}  {stat.command}')
+    except sqlite3.Error as e:
+        print_and_exit(f'Error: could not read the run history: {e}')
+
+
+def job_from_args(args, deadline: float, **kwargs) -> 'Job':
+    """Create a job from the command line options. Paths are made absolute and the environment is copied, so that
+    the daemon runs the job like this shell would."""
+    from tools.live import LIVE_LINES
+    from tools.runner import DEFAULT_OUTPUT_LIMIT
+    from tools.scheduler import Job
+
+    return Job(
+        args.command,
+        deadline,
+        notify=args.notify,
+        notify_start=args.notify_start,
+        cwd=os.getcwd(),
+        env=dict(os.environ),
+        log=os.path.abspath(args.log) if args.log else None,
+        output_limit=args.output_limit if args.output_limit is not None else DEFAULT_OUTPUT_LIMIT,
+        attach_log=args.attach_log,
+        usage_json=args.usage_json if args.usage_json in (None, '-') else os.path.abspath(args.usage_json),
+        live=args.live,
+        live_lines=args.live_lines if args.live_lines is not None else LIVE_LINES,
+        timeout=args.timeout,
+        max_rss=args.max_rss,
+        cpu_seconds=args.cpu_seconds,
+        archive=args.archive,
+        archive_budget=args.archive_budget,
+        archive_max_age=args.archive_max_age,
+        **kwargs,
+    )
+
+
+def submit_recurring(args):
+    """Submit a `--cron` or `--every` job to the daemon, or exit with an error message."""
+    from tools.cron import parse_cron
+
+    now = time.time()
+    every: Optional[float] = None
+    try:
+        if args.cron:
+            deadline = parse_cron(args.cron).next_after(now)
+        else:
+            every = parse_delay(args.every)
+            if not every:
+                print_and_exit(f'{args.every} is not a valid interval.', EXIT_BAD_SCHEDULE)
+            deadline = now + every
+    except ScheduleError as e:
+        print_and_exit(f'Error: {e}', EXIT_BAD_SCHEDULE)
+
+    job = job_from_args(args, deadline, cron=args.cron, every=every, misfire=args.misfire)
+    response = call_daemon({'op': 'submit', 'job': job.to_dict()})
+    emit('job_scheduled', job_id=response['job']['id'], command=job.command, deadline=deadline,
+         schedule=str(job.schedule), daemon=True)
+    next_run = datetime.datetime.fromtimestamp(deadline).isoformat(timespec='seconds')
+    print(f'Scheduled recurring job {response["job"]["id"]} ({job.schedule}): next run at {next_run}.')
+
+
+def main(argv: List[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in SUBCOMMANDS:
+        main_subcommand(argv)
+        return
+
+    args = parse_args(argv)
+
+    delay: Union[int, float] = 0
+    bot: Optional['Bot'] = None
+
+    if args.notify or args.notify_start:
+        bot = load_bot()
 
     if args.at:
         at_str: str = args.at
@@ -82,51 +1019,76 @@ if __name__ == '__main__':
 
     elif args.in_:
         in_str: str = args.in_
+        delay = parse_delay(in_str)
 
-        match = re.match(r'^(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$', in_str)
-
-        if not match:
+        if delay is None:
             print(f'{in_str} is not a valid time delay.')
             exit(3)
 
-        days, hours, minutes, seconds = match.groups()
+    if args.on_change:
+        watch_and_run(args, bot)
+        return
 
-        td = datetime.timedelta(
-            days=int(days) if days else 0,
-            hours=int(hours) if hours else 0,
-            minutes=int(minutes) if minutes else 0,
-            seconds=int(seconds) if seconds else 0
-        )
+    after_process = args.after_pid is not None or args.after_pid_file
+    if after_process:
+        message = wait_for_process(args)
+        print(message)
+        if not args.command and not args.jobs:
+            notify(bot, message)
+            start_flusher()
+            return
 
-        delay = td.total_seconds()
+    if args.cron or args.every:
+        if args.jobs:
+            print_and_exit('Error: `--jobs` can\'t be combined with `--cron` or `--every`', EXIT_BAD_SCHEDULE)
+        submit_recurring(args)
+        return
+
+    if args.jobs:
+        # A batch is waited for in this process. The daemon only knows about single commands.
+        if delay:
+            print(f'Executing the jobs in {args.jobs} in {int(delay)} s.')
+            time.sleep(delay)
+        from tools.runner import Limits
 
-    if not delay and not args.notify:
+        limits = Limits(args.timeout, args.max_rss, args.cpu_seconds)
+        archive = dict(log_format=args.archive, budget=args.archive_budget, max_age=args.archive_max_age) \
+            if args.archive else None
+        run_and_report_batch(args.jobs, args.max_parallel, bot if args.notify else None, limits, archive)
+        close_history()
+        start_flusher()
+        return
+
+    if not delay and not after_process and not args.notify and not args.notify_start:
         print('Error: You tried executing a command without a delay or a notification')
         exit(4)
 
+    if delay and not args.no_daemon:
+        from tools.scheduler import send_request
+
+        job = job_from_args(args, time.time() + delay)
+        try:
+            response = send_request({'op': 'submit', 'job': job.to_dict()})
+        except DaemonNotRunningError:
+            # Without a daemon, fall back to waiting in this process.
+            pass
+        else:
+            if not response['ok']:
+                print_and_exit(f'Error: {response["error"]}')
+            emit('job_scheduled', job_id=job.id, command=job.command, deadline=job.deadline, daemon=True)
+            print(f'Scheduled job {job.id}: executing {args.command} in {int(delay)} s.')
+            return
+
     if delay:
         delay = int(delay)
+        emit('job_scheduled', command=args.command, deadline=time.time() + delay, daemon=False)
         print(f'Executing {args.command} in {delay} s.')
         time.sleep(delay)
 
-    print(f'executing...')
-    completed_process = subprocess.run(args.command, shell=True, capture_output=True)
+    run_and_report(job_from_args(args, time.time()), bot)
+    close_history()
+    start_flusher()
 
-    if completed_process.returncode:
-        fail_msg = f'"{args.command}" did not run successfully.\n\n' + str(completed_process.stderr)
-        print(fail_msg)
-        if args.notify:
-            # Create the bot here so that there isn't an error if the
-            # user isn't using `--notify` and  hasn't configured a `.env` file
 
-            # `bot` has to be type `Bot` here, since `print_and_exit()` guards against `bot` being None.
-            # PyCharm's real-time type checker isn't smart enough to know this, so just ignore it.
-            # noinspection PyUnboundLocalVariable
-            bot.send_message(fail_msg)
-    else:
-        # FIXME: completed_process.stdout contains escaped `\n` and other characters.
-        success_msg = f'"{args.command}" executed successfully!\n\n' + str(completed_process.stdout)
-        print(success_msg)
-        if args.notify:
-            # noinspection PyUnboundLocalVariable
-            bot.send_message(success_msg)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+import heapq
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, asdict, replace
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from tools.cron import CronSchedule, IntervalSchedule, parse_cron
+from tools.exceptions import DaemonNotRunningError, ScheduleError, SchedulerError
+from tools.live import LIVE_LINES
+from tools.runner import DEFAULT_OUTPUT_LIMIT, Limits
+from tools.utils import get_state_dir
+
+
+# The daemon wakes up at least this often, even with nothing due, so that wall clock jumps
+# (suspend/resume, NTP corrections) are noticed without waiting for a stale timeout to expire.
+MAX_SLEEP = 60.0
+
+# A recurring job that is due for longer than this has misfired, e.g. because the machine was suspended.
+MISFIRE_GRACE = 60.0
+# What to do with the runs a recurring job missed: run it once, run it once per missed run, or skip them all.
+MISFIRE_POLICIES = ('once', 'all', 'skip')
+# With the "all" policy, never catch up with more than this many runs at once.
+MAX_CATCH_UP = 100
+
+
+def default_socket_path() -> str:
+    return os.path.join(get_state_dir(), 'schedcom.sock')
+
+
+def default_queue_path() -> str:
+    return os.path.join(get_state_dir(), 'queue.json')
+
+
+@dataclass
+class Job:
+    command: str
+    deadline: float
+    notify: bool = False
+    notify_start: bool = False
+    cwd: Optional[str] = None
+    # The environment of the shell that submitted the job, so that it runs the same with or without a daemon.
+    env: Optional[Dict[str, str]] = None
+    log: Optional[str] = None
+    output_limit: int = DEFAULT_OUTPUT_LIMIT
+    attach_log: bool = False
+    usage_json: Optional[str] = None
+    # Show the progress in one message that is edited while the command runs, see `tools.live`.
+    live: bool = False
+    live_lines: int = LIVE_LINES
+    timeout: Optional[float] = None
+    max_rss: Optional[int] = None
+    cpu_seconds: Optional[int] = None
+    # The format of the output archive, see `tools.logarchive`, or None to not archive the output.
+    archive: Optional[str] = None
+    archive_budget: Optional[int] = None
+    archive_max_age: Optional[float] = None
+    cron: Optional[str] = None
+    every: Optional[float] = None
+    misfire: str = 'once'
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    created: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Job':
+        return cls(**{key: data[key] for key in cls.__dataclass_fields__ if key in data})
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @property
+    def limits(self) -> Limits:
+        return Limits(self.timeout, self.max_rss, self.cpu_seconds)
+
+    @property
+    def schedule(self) -> Optional[Union[CronSchedule, IntervalSchedule]]:
+        """The recurring schedule of the job, or None if it only runs once."""
+        if self.cron:
+            return parse_cron(self.cron)
+        if self.every:
+            return IntervalSchedule(self.every, self.deadline)
+        return None
+
+
+def plan_runs(job: Job, now: float) -> Tuple[int, Optional[float]]:
+    """Return how many times a due job has to run now and its next deadline, or None if it doesn't recur."""
+    schedule = job.schedule
+    if schedule is None:
+        return 1, None
+    next_deadline = schedule.next_after(max(now, job.deadline))
+    if now - job.deadline <= MISFIRE_GRACE or job.misfire == 'once':
+        return 1, next_deadline
+    if job.misfire == 'skip':
+        return 0, next_deadline
+    runs, deadline = 1, job.deadline
+    while runs < MAX_CATCH_UP:
+        deadline = schedule.next_after(deadline)
+        if deadline > now:
+            break
+        runs += 1
+    return runs, next_deadline
+
+
+class JobQueue:
+    """A min-heap of pending jobs keyed by deadline, optionally persisted to a JSON file.
+
+    Cancelled jobs are removed from the `jobs` dict only. Their heap entries are skipped lazily
+    when they reach the top, which keeps both `push` and `cancel` at O(log n) or better.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = 0
+        self._lock = threading.RLock()
+        if path:
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def _push(self, job: Job):
+        self.jobs[job.id] = job
+        # The counter breaks ties between equal deadlines in FIFO order.
+        self._counter += 1
+        heapq.heappush(self._heap, (job.deadline, self._counter, job.id))
+
+    def push(self, job: Job) -> Job:
+        with self._lock:
+            self._push(job)
+            self.save()
+        return job
+
+    def push_many(self, jobs: List[Job]):
+        """Push several jobs, saving the queue only once."""
+        with self._lock:
+            for job in jobs:
+                self._push(job)
+            self.save()
+
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            if self.jobs.pop(job_id, None) is None:
+                return False
+            self.save()
+            return True
+
+    def _discard_cancelled(self):
+        while self._heap and self._heap[0][2] not in self.jobs:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        with self._lock:
+            self._discard_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float = None, save: bool = True) -> List[Job]:
+        """Remove and return every job whose deadline is at or before `now`, earliest first.
+
+        With `save=False`, the caller is responsible for saving the queue, e.g. after pushing recurring jobs back.
+        """
+        if now is None:
+            now = time.time()
+        due = []
+        with self._lock:
+            self._discard_cancelled()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, job_id = heapq.heappop(self._heap)
+                job = self.jobs.pop(job_id, None)
+                if job:
+                    due.append(job)
+                self._discard_cancelled()
+            if due and save:
+                self.save()
+        return due
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return sorted(self.jobs.values(), key=lambda job: job.deadline)
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            for job_data in data.get('jobs', []):
+                self._push(Job.from_dict(job_data))
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write to a temporary file and rename it so that a crash never leaves a half-written queue.
+        tmp_path = f'{self.path}.tmp'
+        # The jobs' environments may hold secrets.
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            json.dump({'jobs': [job.to_dict() for job in self.list()]}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: '_UnixServer'
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.daemon.handle_request(request)
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'ok': False, 'error': f'bad request: {e}'}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon: 'SchedulerDaemon'):
+        self.daemon = daemon
+        super().__init__(path, _RequestHandler)
+
+
+class SchedulerDaemon:
+    """Hold every pending job in one `JobQueue` and run each of them with `runner` when it is due.
+
+    Clients talk to the daemon over a Unix socket with newline-delimited JSON requests. See
+    `send_request()`.
+    """
+
+    def __init__(
+            self,
+            runner: Callable[[Job], None],
+            queue: JobQueue = None,
+            socket_path: str = None,
+    ):
+        self.runner = runner
+        self.queue = queue if queue is not None else JobQueue(default_queue_path())
+        self.socket_path = socket_path or default_socket_path()
+        self._wakeup = threading.Condition()
+        self._running: Set[str] = set()
+        self._running_lock = threading.Lock()
+        self._stopping = False
+        self._server: Optional[_UnixServer] = None
+
+    def handle_request(self, request: dict) -> dict:
+        op = request['op']
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        if op == 'submit':
+            job = Job.from_dict(request['job'])
+            try:
+                job.schedule
+            except ScheduleError as e:
+                return {'ok': False, 'error': str(e)}
+            if job.misfire not in MISFIRE_POLICIES:
+                return {'ok': False, 'error': f'unknown misfire policy "{job.misfire}"'}
+            self.queue.push(job)
+            self._notify_timer()
+            return {'ok': True, 'job': job.to_dict()}
+        if op == 'list':
+            return {'ok': True, 'jobs': [job.to_dict() for job in self.queue.list()]}
+        if op == 'cancel':
+            if self.queue.cancel(request['id']):
+                self._notify_timer()
+                return {'ok': True}
+            return {'ok': False, 'error': f'no pending job with ID "{request["id"]}"'}
+        return {'ok': False, 'error': f'unknown operation "{op}"'}
+
+    def _notify_timer(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def _run_job(self, job: Job, runs: int):
+        try:
+            for _ in range(runs):
+                self.runner(job)
+        except Exception as e:
+            # A failing job must never take the daemon down with it.
+            print(f'Error: job {job.id} ("{job.command}") raised {e!r}')
+        finally:
+            with self._running_lock:
+                self._running.discard(job.id)
+
+    def _start(self, job: Job, runs: int):
+        with self._running_lock:
+            if job.id in self._running:
+                # Recurring jobs keep their ID, so this is the previous run of the same job.
+                print(f'Skipping job {job.id} ("{job.command}"): its previous run is still going')
+                return
+            self._running.add(job.id)
+        threading.Thread(target=self._run_job, args=(job, runs), name=f'job-{job.id}').start()
+
+    def _dispatch_due(self):
+        now = time.time()
+        recurring = []
+        due = self.queue.pop_due(now, save=False)
+        for job in due:
+            try:
+                runs, next_deadline = plan_runs(job, now)
+            except ScheduleError as e:
+                print(f'Error: dropping job {job.id}: {e}')
+                continue
+            if next_deadline is not None:
+                recurring.append(replace(job, deadline=next_deadline))
+            if runs:
+                self._start(job, runs)
+        if due:
+            # Popping and rescheduling are saved together, so a crash can't lose a recurring job.
+            self.queue.push_many(recurring)
+
+    def _timer_loop(self):
+        while not self._stopping:
+            self._dispatch_due()
+            # The deadline is read under the lock that `_notify_timer()` takes, so a job submitted after reading it
+            # can't notify before the wait starts and be missed.
+            with self._wakeup:
+                deadline = self.queue.next_deadline()
+                timeout = MAX_SLEEP if deadline is None else min(MAX_SLEEP, max(0.0, deadline - time.time()))
+                if not self._stopping:
+                    self._wakeup.wait(timeout)
+
+    def _bind(self):
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        try:
+            send_request({'op': 'ping'}, self.socket_path)
+        except DaemonNotRunningError:
+            pass
+        else:
+            raise SchedulerError(f'a schedcom daemon is already listening on "{self.socket_path}"')
+        # The socket is stale if nobody answered, e.g. after a crash.
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self._server = _UnixServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o600)
+
+    def serve_forever(self):
+        self._bind()
+        timer = threading.Thread(target=self._timer_loop, name='schedcom-timer', daemon=True)
+        timer.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def shutdown(self):
+        self._stopping = True
+        self._notify_timer()
+        if self._server:
+            self._server.shutdown()
+
+
+def send_request(request: dict, socket_path: str = None, timeout: float = 5.0) -> dict:
+    """Send one request to a running `SchedulerDaemon` and return its response."""
+    socket_path = socket_path or default_socket_path()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as file:
+                line = file.readline()
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        raise DaemonNotRunningError(f'no schedcom daemon is listening on "{socket_path}"') from e
+    if not line:
+        raise SchedulerError('the schedcom daemon closed the connection without answering')
+    return json.loads(line)
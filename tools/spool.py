@@ -0,0 +1,341 @@
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, Iterator, List, Optional
+
+from tools.exceptions import TelegramApiError
+from tools.utils import get_state_dir
+
+
+# https://core.telegram.org/bots/api#sendmessage
+MAX_MESSAGE_LENGTH = 4096
+
+COALESCE_SEPARATOR = '\n\n'
+
+# Rewrite the queue file without its delivered messages once it grows past this size.
+COMPACT_SIZE = 64 * 1024
+
+# Backoff for failed deliveries without a `retry_after`: RETRY_BASE * 2 ** attempt, capped, plus jitter.
+RETRY_BASE = 1.0
+RETRY_MAX = 300.0
+
+
+def default_spool_dir() -> str:
+    return os.path.join(get_state_dir(), 'spool')
+
+
+@dataclass
+class SpooledMessage:
+    chat_id: str
+    text: str
+    id: str
+    time: float
+    # The path of a file to send as a document, with `text` as its caption.
+    document: Optional[str] = None
+    # How many parts of a text that is sent in several parts were delivered already.
+    parts_sent: int = 0
+
+
+@dataclass
+class Batch:
+    """One API call's worth of coalesced messages to the same chat."""
+    chat_id: str
+    text: str
+    ids: List[str]
+    document: Optional[str] = None
+    # When the oldest of the messages was enqueued.
+    queued: float = 0.0
+    parts_sent: int = 0
+
+
+def coalesce(messages: List[SpooledMessage], limit: int = MAX_MESSAGE_LENGTH) -> List[Batch]:
+    """Join consecutive messages to the same chat into as few messages of at most `limit` characters as possible.
+
+    Messages keep their order within each chat. Documents, messages that are too long on their own and messages
+    that were partly delivered are never joined with others.
+    """
+    batches: List[Batch] = []
+    open_batches: Dict[str, Batch] = {}
+    for message in messages:
+        batch = open_batches.get(message.chat_id)
+        if message.document or message.parts_sent or len(message.text) > limit:
+            batches.append(Batch(
+                message.chat_id, message.text, [message.id], message.document, message.time, message.parts_sent
+            ))
+            open_batches.pop(message.chat_id, None)
+        elif batch and len(batch.text) + len(COALESCE_SEPARATOR) + len(message.text) <= limit:
+            batch.text += COALESCE_SEPARATOR + message.text
+            batch.ids.append(message.id)
+        else:
+            batch = open_batches[message.chat_id] = Batch(
+                message.chat_id, message.text, [message.id], queued=message.time
+            )
+            batches.append(batch)
+    return batches
+
+
+class Spool:
+    """A disk-backed, append-only queue of outgoing messages that several processes can share.
+
+    `enqueue()` only hands the message to a writer thread, which appends everything enqueued within
+    `fsync_interval` seconds with one write and one fsync. Deliveries are recorded by appending an ack line, and
+    so are the delivered parts of a message that is sent in several, so the file is only ever appended to, except when `compact()` rewrites it under an exclusive lock.
+    """
+
+    def __init__(self, directory: str = None, fsync_interval: float = 0.05):
+        self.directory = directory or default_spool_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, 'queue.jsonl')
+        self.lock_path = os.path.join(self.directory, 'queue.lock')
+        self.fsync_interval = fsync_interval
+        self._buffer: List[str] = []
+        self._buffer_lock = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._closing = False
+
+    @contextmanager
+    def _locked(self, exclusive: bool = False) -> Iterator[None]:
+        # Appends take a shared lock, so only `compact()` (exclusive) has to wait for them.
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _append(self, lines: List[str]):
+        data = ''.join(line + '\n' for line in lines).encode()
+        with self._locked():
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _write_loop(self):
+        while True:
+            with self._buffer_lock:
+                while not self._buffer and not self._closing:
+                    self._buffer_lock.wait()
+                if not self._buffer:
+                    return
+            # Give concurrent enqueues a moment to join this write and fsync.
+            if not self._closing:
+                time.sleep(self.fsync_interval)
+            with self._buffer_lock:
+                lines, self._buffer = self._buffer, []
+            self._append(lines)
+            with self._buffer_lock:
+                self._buffer_lock.notify_all()
+
+    def enqueue(self, text: str, chat_id: str, document: str = None) -> str:
+        """Queue a message, or a document with `text` as its caption, for delivery and return its ID without
+        waiting for the disk."""
+        message = SpooledMessage(str(chat_id), text, uuid.uuid4().hex, time.time(), document)
+        with self._buffer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='spool-writer', daemon=True)
+                self._writer.start()
+            self._buffer.append(json.dumps(asdict(message)))
+            self._buffer_lock.notify_all()
+        return message.id
+
+    def close(self):
+        """Write everything enqueued so far to disk and stop the writer thread."""
+        with self._buffer_lock:
+            self._closing = True
+            self._buffer_lock.notify_all()
+        if self._writer:
+            self._writer.join()
+            self._writer = None
+        self._closing = False
+
+    def ack(self, ids: List[str]):
+        """Record that the messages with these IDs were delivered, or given up on."""
+        self._append([json.dumps({'ack': ids})])
+
+    def ack_parts(self, ids: List[str], parts: int):
+        """Record that the first `parts` parts of the messages with these IDs were delivered."""
+        self._append([json.dumps({'sent': ids, 'parts': parts})])
+
+    def pending(self) -> List[SpooledMessage]:
+        """Return the messages that weren't acked yet, oldest first."""
+        messages: Dict[str, SpooledMessage] = {}
+        try:
+            with open(self.path, 'rb') as file:
+                for line in file:
+                    # Skip a line another process is still writing.
+                    if not line.endswith(b'\n'):
+                        break
+                    record = json.loads(line)
+                    if 'ack' in record:
+                        for message_id in record['ack']:
+                            messages.pop(message_id, None)
+                    elif 'sent' in record:
+                        for message_id in record['sent']:
+                            if message_id in messages:
+                                messages[message_id].parts_sent = record['parts']
+                    else:
+                        messages[record['id']] = SpooledMessage(**record)
+        except FileNotFoundError:
+            pass
+        return list(messages.values())
+
+    def compact(self):
+        """Rewrite the queue file with only its pending messages, if it has grown past `COMPACT_SIZE`."""
+        with self._locked(exclusive=True):
+            try:
+                if os.path.getsize(self.path) < COMPACT_SIZE:
+                    return
+            except FileNotFoundError:
+                return
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as file:
+                for message in self.pending():
+                    file.write(json.dumps(asdict(message)) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+
+class SpoolFlusher:
+    """Deliver the messages of a `Spool` in the background, coalescing and retrying them.
+
+    Only one flusher per spool directory delivers at a time, across processes. The flusher waits until the
+    oldest pending message is `window` seconds old, so that a wave of messages to the same chat is sent as a few
+    long messages instead of many short ones.
+
+    Texts are delivered with `send(text, chat_id)` and documents with `send_document(path, chat_id, caption)`.
+    `split(text)` may cut a text into several parts to send one by one: each part is acked once it's sent, so a
+    retry only sends the rest.
+    Deliveries are reported to `emit(event, **fields)` as `notification_sent` and `notification_failed` events.
+    """
+
+    def __init__(
+            self,
+            spool: Spool,
+            send: Callable[[str, str], object],
+            send_document: Callable[[str, str, str], object] = None,
+            split: Callable[[str], List[str]] = None,
+            window: float = 2.0,
+            poll_interval: float = 1.0,
+            max_attempts: int = 10,
+            emit: Callable[..., None] = None,
+    ):
+        self.spool = spool
+        self.send = send
+        self.send_document = send_document
+        self.split = split
+        self.window = window
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.emit = emit
+        self._attempts: Dict[str, int] = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _deliver(self, batch: Batch) -> Optional[float]:
+        """Send one batch. Return None if it's done with, or how long to wait before retrying."""
+        try:
+            if batch.document:
+                if not self.send_document:
+                    raise FileNotFoundError(f'documents can\'t be sent by this flusher: {batch.document}')
+                self.send_document(batch.document, batch.chat_id, batch.text)
+            else:
+                parts = self.split(batch.text) if self.split else [batch.text]
+                while batch.parts_sent < len(parts):
+                    self.send(parts[batch.parts_sent], batch.chat_id)
+                    batch.parts_sent += 1
+                    if batch.parts_sent < len(parts):
+                        self.spool.ack_parts(batch.ids, batch.parts_sent)
+        except (TelegramApiError, OSError) as e:
+            attempt = self._attempts.get(batch.ids[0], 0) + 1
+            error_code = getattr(e, 'error_code', None)
+            retry_after = getattr(e, 'retry_after', None)
+            permanent = isinstance(e, FileNotFoundError) or (
+                isinstance(e, TelegramApiError) and error_code and 400 <= error_code < 500 and error_code != 429
+            )
+            if permanent or attempt >= self.max_attempts:
+                print(f'Error: giving up on a message to chat {batch.chat_id}: {e}')
+                retry_in = None
+            else:
+                for message_id in batch.ids:
+                    self._attempts[message_id] = attempt
+                retry_in = retry_after
+                if retry_in is None:
+                    retry_in = min(RETRY_MAX, RETRY_BASE * 2 ** attempt) * random.uniform(1, 1.5)
+            if self.emit:
+                self.emit('notification_failed', messages=len(batch.ids), attempt=attempt, error=str(e),
+                          error_code=error_code, retry_in=retry_in)
+            if retry_in is not None:
+                return retry_in
+        else:
+            if self.emit:
+                self.emit('notification_sent', messages=len(batch.ids), document=bool(batch.document),
+                          attempt=self._attempts.get(batch.ids[0], 0) + 1, delay=time.time() - batch.queued)
+        self.spool.ack(batch.ids)
+        for message_id in batch.ids:
+            self._attempts.pop(message_id, None)
+        return None
+
+    def flush_once(self) -> Optional[float]:
+        """Deliver every pending message that is ready. Return how long to wait until the next attempt,
+        or None if nothing is pending anymore."""
+        messages = self.spool.pending()
+        if not messages:
+            return None
+        wait = messages[0].time + self.window - time.time()
+        if wait > 0:
+            return wait
+        retry_in = None
+        for batch in coalesce(messages):
+            delay = self._deliver(batch)
+            if delay is not None:
+                retry_in = delay if retry_in is None else min(retry_in, delay)
+                if delay >= self.window:
+                    # Most likely the API or the network is down, so don't hammer it with the other batches.
+                    break
+        self.spool.compact()
+        return retry_in if retry_in is not None else 0.0
+
+    def _try_lock(self) -> Optional[int]:
+        fd = os.open(os.path.join(self.spool.directory, 'flusher.lock'), os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def run(self, until_empty: bool = False):
+        """Deliver messages until `stop()` is called or, with `until_empty`, until the spool is empty.
+
+        While another flusher is delivering this spool's messages, `until_empty` returns immediately, leaving
+        them to it. Otherwise the lock is tried again every `poll_interval`, in case the other flusher exits.
+        """
+        while not self._stop.is_set():
+            fd = self._try_lock()
+            if fd is None:
+                if until_empty:
+                    return
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                while not self._stop.is_set():
+                    wait = self.flush_once()
+                    if wait is None:
+                        if until_empty:
+                            break
+                        wait = self.poll_interval
+                    self._stop.wait(min(wait, self.poll_interval) if not until_empty else wait)
+            finally:
+                os.close(fd)
+            # A message may have been enqueued after the last check, by a process that saw the lock still held.
+            if not self.spool.pending():
+                return
@@ -0,0 +1,204 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Mapping, Optional, Tuple
+
+
+# Structured events for monitoring: every event is appended to a JSON-lines file, and the metrics derived from
+# them are kept in a Prometheus textfile for the node exporter's textfile collector.
+# https://github.com/prometheus/node_exporter#textfile-collector
+
+# Set in the environment or in the tools' `.env` file.
+EVENT_LOG_VARIABLE = 'CK_EVENT_LOG'
+METRICS_FILE_VARIABLE = 'CK_METRICS_FILE'
+
+JOB_DURATION_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+REQUEST_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DELIVERY_DELAY_BUCKETS = (1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+# Name -> (type, help, histogram buckets).
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    'ck_jobs_scheduled_total': ('counter', 'Jobs scheduled by schedcom.', ()),
+    'ck_job_runs_total': ('counter', 'Finished runs by command and status.', ()),
+    'ck_job_duration_seconds': ('histogram', 'Wall time of the runs of a command.', JOB_DURATION_BUCKETS),
+    'ck_job_last_exit_code': ('gauge', 'Exit code of the last run of a command.', ()),
+    'ck_job_last_run_timestamp_seconds': ('gauge', 'When the last run of a command finished.', ()),
+    'ck_job_last_success_timestamp_seconds': ('gauge', 'When the last successful run of a command finished.', ()),
+    'ck_bot_requests_total': ('counter', 'Telegram Bot API requests by method and HTTP status.', ()),
+    'ck_bot_request_duration_seconds': (
+        'histogram', 'Latency of Telegram Bot API requests.', REQUEST_DURATION_BUCKETS
+    ),
+    'ck_notifications_total': ('counter', 'Notifications by what happened to them.', ()),
+    'ck_notification_retries_total': ('counter', 'Failed notification deliveries that will be retried.', ()),
+    'ck_notification_delivery_seconds': (
+        'histogram', 'Time from queueing a notification to delivering it.', DELIVERY_DELAY_BUCKETS
+    ),
+}
+
+
+def _format_labels(labels: Mapping[str, object]) -> str:
+    def escape(value: object) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+class MetricsFile:
+    """Counters, gauges and histograms shared by every process, written to a Prometheus textfile.
+
+    The values are kept in a JSON file next to the textfile. Every update reads, changes and writes it under an
+    exclusive lock, and then renders the textfile to a temporary file that is renamed over the old one, so that
+    the exporter never reads half of it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state_path = f'{path}.json'
+        self.lock_path = f'{path}.lock'
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def _read_state(self) -> dict:
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, path: str, content: str):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(content)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+    def update(self, updates: List[Tuple[str, Mapping[str, object], float]]):
+        """Apply `(metric, labels, value)` updates: counters are increased by the value, gauges set to it, and
+        histograms observe it."""
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            state = self._read_state()
+            for name, labels, value in updates:
+                kind, _, buckets = METRICS[name]
+                series = state.setdefault(name, {})
+                key = _format_labels(labels)
+                if kind == 'counter':
+                    series[key] = series.get(key, 0) + value
+                elif kind == 'gauge':
+                    series[key] = value
+                else:
+                    histogram = series.setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0, 'count': 0})
+                    for index, bound in enumerate(buckets):
+                        if value <= bound:
+                            histogram['buckets'][index] += 1
+                    histogram['sum'] += value
+                    histogram['count'] += 1
+            self._write(self.state_path, json.dumps(state))
+            self._write(self.path, self.render(state))
+
+    @staticmethod
+    def render(state: dict) -> str:
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = state.get(name)
+            if not series:
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for key, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{key}}} {value}' if key else f'{name} {value}')
+                    continue
+                prefix = f'{key},' if key else ''
+                # Bucket counts are cumulative already: an observation counts in every bucket it fits in.
+                for bound, count in zip(buckets, value['buckets']):
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {value["count"]}')
+                lines.append(f'{name}_sum{{{key}}} {value["sum"]}' if key else f'{name}_sum {value["sum"]}')
+                lines.append(f'{name}_count{{{key}}} {value["count"]}' if key else f'{name}_count {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_updates(event: str, fields: Mapping[str, object]) -> List[Tuple[str, Dict[str, object], float]]:
+    """Derive the metrics of an event."""
+    if event == 'job_scheduled':
+        return [('ck_jobs_scheduled_total', {}, 1)]
+    if event == 'job_finished':
+        command = {'command': fields['command']}
+        updates = [
+            ('ck_job_runs_total', {**command, 'status': fields['status']}, 1),
+            ('ck_job_duration_seconds', command, fields['duration']),
+            ('ck_job_last_exit_code', command, fields['returncode']),
+            ('ck_job_last_run_timestamp_seconds', command, fields['time']),
+        ]
+        if fields['status'] == 'succeeded':
+            updates.append(('ck_job_last_success_timestamp_seconds', command, fields['time']))
+        return updates
+    if event == 'api_call':
+        return [
+            ('ck_bot_requests_total', {'method': fields['method'], 'status': fields['status'] or 'error'}, 1),
+            ('ck_bot_request_duration_seconds', {'method': fields['method']}, fields['duration']),
+        ]
+    if event == 'notification_queued':
+        return [('ck_notifications_total', {'result': 'queued'}, 1)]
+    if event == 'notification_sent':
+        return [
+            ('ck_notifications_total', {'result': 'sent'}, fields['messages']),
+            ('ck_notification_delivery_seconds', {}, fields['delay']),
+        ]
+    if event == 'notification_failed':
+        if fields['retry_in'] is None:
+            return [('ck_notifications_total', {'result': 'failed'}, fields['messages'])]
+        return [('ck_notification_retries_total', {}, fields['messages'])]
+    return []
+
+
+class Telemetry:
+    """Emit events to a JSON-lines file and/or the metrics derived from them to a Prometheus textfile.
+
+    Each event is one line, written with a single `write()` to a file opened with O_APPEND, so that the events
+    of several processes never interleave. Telemetry never stops a job: failures to write are printed once.
+    """
+
+    def __init__(self, event_log: str = None, metrics_file: str = None):
+        self.event_log = event_log
+        self.metrics = MetricsFile(metrics_file) if metrics_file else None
+        self._fd: Optional[int] = None
+        self._warned = False
+        if event_log:
+            os.makedirs(os.path.dirname(os.path.abspath(event_log)), exist_ok=True)
+            self._fd = os.open(event_log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> Optional['Telemetry']:
+        """Create the telemetry configured by `CK_EVENT_LOG` and `CK_METRICS_FILE`, or return None if neither is."""
+        event_log = env.get(EVENT_LOG_VARIABLE)
+        metrics_file = env.get(METRICS_FILE_VARIABLE)
+        if not event_log and not metrics_file:
+            return None
+        return cls(os.path.expanduser(event_log) if event_log else None,
+                   os.path.expanduser(metrics_file) if metrics_file else None)
+
+    def emit(self, event: str, **fields):
+        fields = {'time': time.time(), 'event': event, 'pid': os.getpid(), **fields}
+        try:
+            if self._fd is not None:
+                os.write(self._fd, json.dumps(fields).encode() + b'\n')
+            if self.metrics:
+                updates = _metric_updates(event, fields)
+                if updates:
+                    self.metrics.update(updates)
+        except OSError as e:
+            if not self._warned:
+                print(f'Warning: could not write telemetry: {e}')
+                self._warned = True
+
+    def api_call(self, method: str, status: Optional[int], duration: float):
+        """Record one Bot API request. Pass this as the `on_call` of a `Bot`."""
+        self.emit('api_call', method=method, status=status, duration=duration)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
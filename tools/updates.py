@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from tools.ckcyberbot import Bot
+from tools.exceptions import TelegramApiError
+from tools.utils import get_state_dir
+
+
+# How long `getUpdates` waits on the server for new updates before returning an empty result.
+LONG_POLL_TIMEOUT = 30
+
+# How long to wait after a failed `getUpdates` before trying again.
+ERROR_DELAY = 5.0
+
+# A handler gets the bot, the message and the words after the command, and may return a reply.
+Handler = Callable[[Bot, dict, List[str]], Optional[str]]
+
+
+def default_offset_path() -> str:
+    return os.path.join(get_state_dir(), 'bot_offset.json')
+
+
+class UpdatePoller:
+    """Long-poll a bot's updates and dispatch "/command" messages to handlers on a pool of worker threads.
+
+    The offset of the last update is saved to `offset_path`, so a restarted poller neither misses nor repeats
+    updates. Only messages from `allowed_chat_ids`, by default just the bot's own chat, are handled.
+    """
+
+    def __init__(
+            self,
+            bot: Bot,
+            offset_path: str = None,
+            timeout: int = LONG_POLL_TIMEOUT,
+            max_workers: int = 4,
+            allowed_chat_ids: Iterable[str] = None,
+    ):
+        self.bot = bot
+        self.offset_path = offset_path or default_offset_path()
+        self.timeout = timeout
+        self.max_workers = max_workers
+        if allowed_chat_ids is None:
+            allowed_chat_ids = [bot.chat_id] if bot.chat_id else []
+        self.allowed_chat_ids = {str(chat_id) for chat_id in allowed_chat_ids}
+        self.handlers: Dict[str, Handler] = {}
+        self.offset = self._load_offset()
+        self._stop = threading.Event()
+
+    def command(self, name: str) -> Callable[[Handler], Handler]:
+        """Register the decorated function as the handler of "/name"."""
+        def decorator(handler: Handler) -> Handler:
+            self.handlers[name.lstrip('/')] = handler
+            return handler
+        return decorator
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path) as file:
+                return json.load(file)['offset']
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0
+
+    def _save_offset(self):
+        os.makedirs(os.path.dirname(self.offset_path), exist_ok=True)
+        tmp_path = f'{self.offset_path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'offset': self.offset}, file)
+        os.replace(tmp_path, self.offset_path)
+
+    def _handle(self, handler: Handler, message: dict, args: List[str]):
+        try:
+            reply = handler(self.bot, message, args)
+        except Exception as e:
+            reply = f'Error: {e}'
+        if reply:
+            try:
+                self.bot.send_message(reply, str(message['chat']['id']))
+            except (TelegramApiError, OSError) as e:
+                print(f'Error: could not reply to {message.get("text")!r}: {e}')
+
+    def dispatch(self, update: dict, pool: ThreadPoolExecutor):
+        message = update.get('message')
+        if not message or not message.get('text', '').startswith('/'):
+            return
+        if str(message['chat']['id']) not in self.allowed_chat_ids:
+            return
+        command, *args = message['text'].split()
+        # In group chats, commands may be addressed to a bot by name, e.g. "/jobs@CkCyberBot".
+        name = command[1:].split('@', 1)[0]
+        handler = self.handlers.get(name, self._unknown_command)
+        pool.submit(self._handle, handler, message, args)
+
+    def _unknown_command(self, bot: Bot, message: dict, args: List[str]) -> str:
+        names = ', '.join(f'/{name}' for name in sorted(self.handlers))
+        return f'Unknown command "{message["text"].split()[0]}". Try {names}.'
+
+    def poll_once(self, pool: ThreadPoolExecutor):
+        """Wait up to `timeout` seconds for updates and dispatch them."""
+        response = self.bot.get_updates(allowed_updates=['message'], timeout=self.timeout, offset=self.offset)
+        updates = response['result']
+        for update in updates:
+            self.dispatch(update, pool)
+        if updates:
+            self.offset = updates[-1]['update_id'] + 1
+            self._save_offset()
+
+    def run(self):
+        """Poll and dispatch until `stop()` is called. Handlers may still be running afterwards."""
+        with ThreadPoolExecutor(self.max_workers, thread_name_prefix='bot-handler') as pool:
+            while not self._stop.is_set():
+                try:
+                    self.poll_once(pool)
+                except (TelegramApiError, OSError) as e:
+                    print(f'Error: getUpdates failed: {e}')
+                    self._stop.wait(ERROR_DELAY)
+
+    def stop(self):
+        """Stop after the current long poll returns."""
+        self._stop.set()
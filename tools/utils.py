@@ -1,23 +1,135 @@
 import os
-from typing import Literal, Dict, NoReturn
+import re
+from typing import Literal, Dict, Iterable, Iterator, NoReturn, Optional, Tuple
 from contextlib import contextmanager
 
 
+# Parsed `.env` files by absolute path, with the (device, inode, size, mtime) they were parsed at.
+_env_cache: Dict[str, Tuple[Tuple[int, int, int, int], Dict[str, str]]] = {}
+
+_CLOSING_QUOTES = {
+    '"': re.compile(r'((?:[^"\\]|\\.)*)"', re.DOTALL),
+    "'": re.compile(r"([^']*)'"),
+}
+_ESCAPE_SEQUENCE = re.compile(r'\\(.)', re.DOTALL)
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+
+def _iter_env_entries(lines: Iterable[str]) -> Iterator[Tuple[Optional[str], Optional[str], str]]:
+    """Parse `.env` lines in one pass and yield `(key, value, raw_text)` for every entry.
+
+    Comments and blank lines are yielded with a key of None, so the file can be rewritten exactly as it was.
+    Values may be quoted: single quotes are taken literally, double quotes understand backslash escapes, and
+    both may span several lines. Unquoted values end at a ` #` comment.
+    """
+    lines = iter(lines)
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            yield None, None, line
+            continue
+        if stripped.startswith('export '):
+            stripped = stripped[len('export '):].lstrip()
+        key, equals, assigned = stripped.partition('=')
+        key = key.strip()
+        if not equals or not key:
+            raise ValueError(f'{line.rstrip()!r} is not a KEY=value assignment')
+        value = assigned.lstrip()
+        raw_text = line
+        if not value or value[0] not in '"\'':
+            # A comment needs whitespace in front of it, so that e.g. URLs with fragments survive. Look for it
+            # before the leading whitespace is stripped, so that `KEY= # comment` is empty.
+            for separator in (' #', '\t#'):
+                assigned = assigned.split(separator, 1)[0]
+            yield key, assigned.strip(), raw_text
+            continue
+
+        quote, value = value[0], value[1:]
+        match = _CLOSING_QUOTES[quote].match(value)
+        while not match:
+            # No closing quote yet, so the value continues on the next line.
+            next_line = next(lines, None)
+            if next_line is None:
+                raise ValueError(f'the value of {key} has an unterminated {quote} quote')
+            raw_text += next_line
+            value += '\n' + next_line.rstrip('\r\n')
+            match = _CLOSING_QUOTES[quote].match(value)
+        value = match.group(1)
+        if quote == '"':
+            value = _ESCAPE_SEQUENCE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), value)
+        yield key, value, raw_text
+
+
 def load_env_file(filename: str) -> Dict[str, str]:
-    """Load environmental variables from a `.env` file."""
-    result = {}
+    """Load environmental variables from a `.env` file.
+
+    Lines may start with `export`, and values may be quoted (see `_iter_env_entries`). The parsed file is
+    cached until its inode, size or modification time changes, so daemons can call this as often as they like.
+    """
+    path = os.path.abspath(filename)
+    try:
+        st = os.stat(path)
+        version = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    except OSError:
+        # Let `open()` raise the error below.
+        version = None
+    cached = _env_cache.get(path)
+    if version and cached and cached[0] == version:
+        return dict(cached[1])
+
     with open(filename) as f:
-        for line in f.readlines():
-            if line.startswith('#') or not line.strip():
-                # Skip this line. It's a comment or just whitespace.
-                continue
-            # Remove the end of line character
-            line = line.rstrip()
-            # Split the line into key and value
-            key, value = line.split('=', 1)
-            # Add the variable to the result
-            result[key] = value
-    return result
+        result = {key: value for key, value, _ in _iter_env_entries(f) if key is not None}
+    if version:
+        _env_cache[path] = (version, result)
+    return dict(result)
+
+
+def _format_env_value(value: str) -> str:
+    if value and not any(char in value for char in ' \t\n#"\'\\'):
+        return value
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'"{escaped}"'
+
+
+def update_env_file(filename: str, updates: Dict[str, str]):
+    """Set the given variables in a `.env` file, creating it if necessary.
+
+    Existing assignments are replaced where they are, new ones are appended, and every other line is kept as it
+    was. The new file is written next to the old one and renamed over it, so readers never see half a file.
+    """
+    # Imported here, because `tempfile` is slow to import and most tools only ever read `.env` files.
+    import tempfile
+
+    lines = []
+    remaining = dict(updates)
+    try:
+        with open(filename) as f:
+            for key, _, raw_text in _iter_env_entries(f):
+                if key in remaining:
+                    export = 'export ' if raw_text.lstrip().startswith('export ') else ''
+                    lines.append(f'{export}{key}={_format_env_value(remaining.pop(key))}\n')
+                elif key is None or key not in updates:
+                    # Later duplicates of an updated key are dropped, so the new value is the one that counts.
+                    lines.append(raw_text if raw_text.endswith('\n') else raw_text + '\n')
+        mode = os.stat(filename).st_mode & 0o777
+    except FileNotFoundError:
+        # `.env` files hold secrets.
+        mode = 0o600
+    for key, value in remaining.items():
+        lines.append(f'{key}={_format_env_value(value)}\n')
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.env.', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _env_cache.pop(os.path.abspath(filename), None)
 
 
 def yes_or_no(prompt: str, default: Literal['y', 'n'] = None):
@@ -48,6 +160,12 @@ def print_and_exit(msg: str, exit_code: int = 1) -> NoReturn:
     exit(exit_code)
 
 
+def get_state_dir() -> str:
+    """Return the directory where the tools keep their persistent state, e.g. `~/.local/state/ck`."""
+    base = os.environ.get('XDG_STATE_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'state')
+    return os.path.join(base, 'ck')
+
+
 @contextmanager
 def using_dir(dir_new: str) -> None:
     """Temporarily change the working directory within a context manager."""
@@ -0,0 +1,187 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from tools.exceptions import WatchError
+
+
+# Linux's inotify, through ctypes: the standard library has no binding for it.
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK)
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+EVENT = struct.Struct('iIII')
+
+# Changes in these directories never count, and they aren't watched at all.
+IGNORED_DIRS = {'.git', '.hg', '.svn', '__pycache__'}
+
+# Wait for this many seconds without changes before reporting a burst of them, e.g. a `git checkout`.
+DEBOUNCE = 0.5
+# ...but never for longer than this after the first change, even if changes never stop.
+MAX_DEBOUNCE = 10.0
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _get_libc() -> ctypes.CDLL:
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise WatchError('watching for changes requires Linux inotify')
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+
+class Watcher:
+    """Wait for changes to files and directory trees with inotify, without polling.
+
+    Directories are watched recursively: directories created or moved into a watched tree are watched as soon as
+    they appear. Files are watched through their parent directory, so that editors that replace a file rather
+    than writing to it are noticed too. Changes to the paths in `ignore`, e.g. the command's own log file, and
+    anything in `IGNORED_DIRS` don't count.
+    """
+
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = ()):
+        self._libc = _get_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError(f'could not start watching: {os.strerror(ctypes.get_errno())}')
+        self._poll = select.poll()
+        self._poll.register(self._fd, select.POLLIN)
+        self.ignore = {os.path.abspath(path) for path in ignore}
+        self.roots: List[str] = []
+        # Watch descriptor -> watched directory.
+        self._watches: Dict[int, str] = {}
+        # Directories that are only watched for some of their files -> the names of those files.
+        self._files: Dict[str, Set[str]] = {}
+        self._trees: Set[str] = set()
+        try:
+            for path in paths:
+                path = os.path.abspath(path)
+                if os.path.isdir(path):
+                    self._add_tree(path)
+                elif os.path.exists(path):
+                    directory, name = os.path.split(path)
+                    self._files.setdefault(directory, set()).add(name)
+                    self._add(directory)
+                else:
+                    raise WatchError(f'"{path}" does not exist')
+                self.roots.append(path)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'Watcher':
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    @property
+    def watch_count(self) -> int:
+        return len(self._watches)
+
+    def _add(self, directory: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                # Deleted while the tree was walked, or not readable: there is nothing to watch.
+                return
+            if error == errno.ENOSPC:
+                raise WatchError('the limit of inotify watches was reached. Raise it with'
+                                 ' `sysctl fs.inotify.max_user_watches=524288`')
+            raise WatchError(f'could not watch "{directory}": {os.strerror(error)}')
+        self._watches[wd] = directory
+
+    def _add_tree(self, root: str):
+        for directory, subdirectories, _ in os.walk(root):
+            subdirectories[:] = [
+                name for name in subdirectories
+                if name not in IGNORED_DIRS and os.path.join(directory, name) not in self.ignore
+            ]
+            self._trees.add(directory)
+            self._add(directory)
+
+    def _read(self) -> List[str]:
+        """Read the pending events and return the paths that changed."""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0'))
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything may have changed.
+                changed.extend(self.roots)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory is gone.
+                del self._watches[wd]
+                self._trees.discard(directory)
+                continue
+            if directory not in self._trees and name not in self._files.get(directory, ()):
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if path in self.ignore or name in IGNORED_DIRS:
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and directory in self._trees:
+                self._add_tree(path)
+            changed.append(path)
+        return changed
+
+    def _wait_readable(self, timeout: Optional[float]) -> bool:
+        return bool(self._poll.poll(None if timeout is None else max(0, int(timeout * 1000))))
+
+    def wait(self, debounce: float = DEBOUNCE, timeout: float = None) -> List[str]:
+        """Block until something changes and then until nothing changed for `debounce` seconds, and return the
+        paths that changed, sorted. Return an empty list if nothing changed within `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed: List[str] = []
+        while not changed:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return []
+            if self._wait_readable(remaining):
+                changed.extend(self._read())
+        burst_deadline = time.monotonic() + MAX_DEBOUNCE
+        while time.monotonic() < burst_deadline and self._wait_readable(debounce):
+            changed.extend(self._read())
+        return sorted(set(changed))